@@ -1,18 +1,79 @@
 import yaml
 import argparse
+import hashlib
+import json
 import os
+import shutil
+import socket
+import sys
+import time
 from glob import glob
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor
 
 from modules.handler import LibHandler
-from modules.buildwrapper import BuildWrapper
-from modules.dependency import DependencyHelper
-from modules.ida import IDAHelper
+from modules.buildwrapper import BuildWrapper, FAILED, CANCELLED
+from modules.dependency import DependencyHelper, DependencyError
+from modules.ida import IDAHelper, REGEX
+from modules.buildcache import BuildCache
+from modules.compilercache import CompilerCache
+from modules.configurecache import ConfigureCache
+from modules.debuginfo import PdbSearchCache, matchPdb
+from modules.filelock import FileLock
+from modules.blobstore import BlobStore
+from modules.diskbudget import DiskBudget, formatSize
+from modules.supervisor import ProcessSupervisor
+from modules.governor import ResourceGovernor
+from modules.history import RunHistory
+from modules.scheduler import Scheduler, formatDuration
+from modules.exportindex import ExportIndex, exporterVersion
+from modules.exportqueue import ExportQueue, ExportWorker
+from modules.manifest import Manifest
+from modules.artifactory import Artifactory
+from modules.mirrors import MirrorSelector
+from modules.scratch import ScratchSpace
+from modules.daemon import Daemon
+from modules.discovery import VersionDiscovery
+from modules.journal import RunJournal, STARTED, DONE
+from modules.retention import (Retention, UNREFERENCED, SUPERSEDED,
+                               DUPLICATE)
+
+# the path prefixes of all stages
+TMP_PREFIX = "tmp/"
+CACHE_PREFIX = TMP_PREFIX + "cache/"
+EXTRACTED_PREFIX = TMP_PREFIX + "extracted/"
+BUILD_PREFIX = TMP_PREFIX + "build/"
+BIN_PREFIX = TMP_PREFIX + "bin/"
+BLOB_PREFIX = TMP_PREFIX + "blobs/"
+LOG_PREFIX = TMP_PREFIX + "logs/"
+WORKER_PREFIX = TMP_PREFIX + "worker/"
+CUSTOM_CMAKE_PREFIX = "cmake/"
+# durations of previous runs, used to schedule the builds and exports
+HISTORY_FILE = TMP_PREFIX + "history.json"
+# every single measurement of the history, e.g. for tuning the IDA profiles
+HISTORY_LOG = TMP_PREFIX + "history.log"
+# exporter versions of all local databases
+EXPORT_INDEX_FILE = TMP_PREFIX + "exports.json"
+# throughput of the download mirrors
+MIRRORS_FILE = TMP_PREFIX + "mirrors.json"
+# sizes of the build directories, used to reserve room in the scratch space
+SCRATCH_SIZES_FILE = TMP_PREFIX + "scratch.json"
+# DLLs whose PDB could not be found, see PdbSearchCache
+PDB_SEARCH_FILE = TMP_PREFIX + "pdbsearch.json"
+# last responses of the upstream listings of the discover blocks
+DISCOVERY_FILE = TMP_PREFIX + "discovery.json"
+# stage transitions of the last run of every kind, see --resume
+JOURNAL_PREFIX = TMP_PREFIX + "journal/"
 
 
 def main():
     """ main function """
 
+    # subcommands are dispatched before setting up the parser for the
+    # build run, which would take them for the path to cmake
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
+
     # find necessary executable files
     cmakePath = find(["C:\\Program Files\\CMake\\bin\\cmake.exe",
                       "C:\\Program Files (x86)\\CMake\\bin\\cmake.exe"])
@@ -38,6 +99,20 @@ def main():
     parser.add_argument("lists", metavar="<libs.yml>", type=str, nargs="*",
                         help="yml file containing a list of libraries",
                         default=["libs.yml"])
+    parser.add_argument("--lib", metavar="<name>", type=str, action="append",
+                        help="only build libraries matching the glob pattern "
+                        "(and their dependencies); can be given several times")
+    parser.add_argument("--version", metavar="<version>", type=str,
+                        action="append", help="only build versions matching "
+                        "the glob pattern; can be given several times")
+    parser.add_argument("--compiler", metavar="<compiler>", type=str,
+                        action="append", help="only use compilers whose id or "
+                        "short name matches the glob pattern; can be given "
+                        "several times")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted run: skip the work it "
+                        "finished according to its journal and redo what "
+                        "was in flight")
     args = parser.parse_args()
 
     # building without CMake is not supported
@@ -50,114 +125,1112 @@ def main():
         print("No idaq.exe found. Exitting.")
         return
 
-    # setup the path prefixes
-    tmpPrefix = "tmp/"
-    cachePrefix = tmpPrefix + "cache/"
-    extractedPrefix = tmpPrefix + "extracted/"
-    buildPrefix = tmpPrefix + "build/"
-    binPrefix = tmpPrefix + "bin/"
-    customCmakePrefix = "cmake/"
-
     # create all needed directories
-    if not os.path.exists(tmpPrefix):
-        os.mkdir(tmpPrefix)
-    if not os.path.exists(cachePrefix):
-        os.mkdir(cachePrefix)
-    if not os.path.exists(extractedPrefix):
-        os.mkdir(extractedPrefix)
-    if not os.path.exists(buildPrefix):
-        os.mkdir(buildPrefix)
-    if not os.path.exists(binPrefix):
-        os.mkdir(binPrefix)
-
-    # instanciate the library handler
-    libHandler = LibHandler(cachePrefix=cachePrefix,
-                            extractedPrefix=extractedPrefix,
-                            buildPrefix=buildPrefix,
-                            binPrefix=binPrefix,
-                            customCmakePrefix=customCmakePrefix)
-
-    # load the compiler config
+    for prefix in [TMP_PREFIX, CACHE_PREFIX, EXTRACTED_PREFIX, BUILD_PREFIX,
+                   BIN_PREFIX]:
+        if not os.path.exists(prefix):
+            os.mkdir(prefix)
+
+    # load the compiler config and apply the compiler selectors
     compilers = yaml.load(open(args.compilers, "rb").read())
 
     # load artifactory settings
     artifactoryData = yaml.load(
         open("settings.yml", "rb").read())
-    artifactoryPath = artifactoryData.get("artifactory_path", None)
-    artifactoryUser = artifactoryData.get("artifactory_user", "")
-    artifactoryPass = artifactoryData.get("artifactory_pass", "")
+    services = loadServices(artifactoryData)
+    libHandler = makeLibHandler(services)
+
+    # all child processes (build scripts and IDA) are launched by a single
+    # supervisor which limits their number and captures their output
+    with makeSupervisor(artifactoryData) as supervisor:
+        outcome = runPipeline(args, compilers, artifactoryData, services,
+                              libHandler, supervisor, idaq, idaq64)
+    if outcome is None:
+        return
+
+    printSummary(*outcome)
+
+    services["diskBudget"].enforce("bin")
+
+    return
+
+
+def loadServices(settings):
+    """ Creates the services shared by all runs of the pipeline from the
+        settings and returns them as a dictionary. A daemon keeps them, and
+        thereby their caches and indexes, across runs.
+
+        :param settings: the contents of settings.yml
+    """
+    artifactoryPath = settings.get("artifactory_path", None)
+    auth = (settings.get("artifactory_user", ""),
+            settings.get("artifactory_pass", ""))
+
+    # deduplicate the extracted sources using hardlinks if enabled
+    blobStore = None
+    if settings.get("dedup_sources", False):
+        blobStore = BlobStore(BLOB_PREFIX)
+
+    # source archives are fetched from the fastest mirror, preferably the
+    # source mirror in the artifactory
+    sourceMirror = settings.get("source_mirror", None) or {}
+    mirrorSelector = MirrorSelector(
+        MIRRORS_FILE,
+        artifactory=(Artifactory(artifactoryPath, auth)
+                     if artifactoryPath and sourceMirror else None),
+        prefix=sourceMirror.get("path", "sources/"),
+        push=sourceMirror.get("push", False),
+        probeTimeout=settings.get("mirror_probe_timeout", 5.0),
+        failureTtl=settings.get("mirror_failure_ttl", 600.0))
+
+    # the remote build cache lives in the same artifactory
+    buildCache = None
+    if artifactoryPath and settings.get("build_cache", False):
+        buildCache = BuildCache(artifactoryPath, auth)
+
+    # optional ccache/sccache launcher for all compiler calls
+    compilerCache = None
+    compilerCacheData = settings.get("compiler_cache", None)
+    if compilerCacheData and compilerCacheData.get("launcher", None):
+        compilerCache = CompilerCache(
+            compilerCacheData["launcher"],
+            compilerCacheData.get("dir", TMP_PREFIX + "compilercache/"),
+            compilerCacheData.get("size", None))
+
+    # toolchain probes of previous configure runs, shared by the versions of
+    # a library with the same probes
+    configureCache = None
+    if settings.get("configure_cache", False):
+        configureCache = ConfigureCache(TMP_PREFIX + "configurecache/")
+
+    # optional fast volume for the build directories, e.g. a RAM disk
+    scratch = None
+    scratchData = settings.get("build_scratch", None)
+    if scratchData and scratchData.get("path", None):
+        scratch = ScratchSpace(scratchData["path"], SCRATCH_SIZES_FILE,
+                               scratchData.get("budget", None),
+                               scratchData.get("reserve", "2G"))
+
+    return {
+        "blobStore": blobStore,
+        # keep the stage directories within their budgets
+        "diskBudget": loadDiskBudget(settings),
+        "mirrorSelector": mirrorSelector,
+        "buildCache": buildCache,
+        "compilerCache": compilerCache,
+        "configureCache": configureCache,
+        "scratch": scratch,
+        # the durations of previous runs predict how long every task takes
+        "history": RunHistory(HISTORY_FILE, logPath=HISTORY_LOG),
+        "exportIndex": ExportIndex(EXPORT_INDEX_FILE),
+        # the trees are only searched again for the PDB of changed DLLs
+        "pdbSearch": PdbSearchCache(PDB_SEARCH_FILE),
+        # versions of the libraries with a discover block
+        "discovery": VersionDiscovery(DISCOVERY_FILE),
+        "journal": RunJournal(JOURNAL_PREFIX),
+    }
+
+
+def makeLibHandler(services):
+    """ Creates the :class:`LibHandler` that downloads and extracts the
+        libraries; it keeps the libraries of previous runs.
+
+        :param services: the services, see :func:`loadServices`
+    """
+    return LibHandler(cachePrefix=CACHE_PREFIX,
+                      extractedPrefix=EXTRACTED_PREFIX,
+                      buildPrefix=BUILD_PREFIX,
+                      binPrefix=BIN_PREFIX,
+                      customCmakePrefix=CUSTOM_CMAKE_PREFIX,
+                      blobStore=services["blobStore"],
+                      mirrorSelector=services["mirrorSelector"],
+                      discovery=services["discovery"],
+                      journal=services["journal"])
+
+
+def runPipeline(args, compilers, settings, services, libHandler, supervisor,
+                idaq, idaq64, rebuild=False):
+    """ Downloads, builds and exports the selected libraries with the
+        selected compilers. Returns the (results, exports, exportFailures)
+        for :func:`printSummary`, or None if nothing was selected.
+
+        :param args: the parsed command line; uses the input files (lists),
+            the selectors (lib, version, compiler), cmake and resume
+        :param compilers: the contents of compilers.yml
+        :param settings: the contents of settings.yml
+        :param services: the services, see :func:`loadServices`
+        :param libHandler: the :class:`LibHandler`
+        :param supervisor: the :class:`ProcessSupervisor`
+        :param idaq: the path of idaq.exe
+        :param idaq64: the path of idaq64.exe
+        :param rebuild: (optional) remove the binaries of the selected
+            libraries first, so that they are built and exported again
+    """
+    try:
+        return runStages(args, compilers, settings, services, libHandler,
+                         supervisor, idaq, idaq64, rebuild)
+    finally:
+        # the journal of a failed run is closed as well, which releases
+        # its lock, e.g. for the next job of the daemon
+        services["journal"].close()
+
+
+def runStages(args, compilers, settings, services, libHandler, supervisor,
+              idaq, idaq64, rebuild):
+    """ Runs the stages of :func:`runPipeline` within its journal. """
+    diskBudget = services["diskBudget"]
+    history = services["history"]
+    exportIndex = services["exportIndex"]
+    scratch = services["scratch"]
+    journal = services["journal"]
+
+    # apply the compiler selectors
+    if args.compiler:
+        compilers = {
+            name: compiler for name, compiler in compilers.items()
+            if any(fnmatch(name, c) or fnmatch(compiler["short"], c)
+                   for c in args.compiler)}
+    if not compilers:
+        print("No compiler matches the given selectors. Exitting.")
+        return None
+
+    # parse the declarations of all input files and compute the selected
+    # libraries together with the transitive closure of their dependencies;
+    # missing dependencies and cycles are reported before any work is done
+    declared = {}
+    for file in args.lists:
+        libHandler.declareFile(file, declared)
+    helper = DependencyHelper(declared)
+    selected = helper.select(args.lib, args.version)
+    if not selected:
+        print("No library matches the given selectors. Exitting.")
+        return None
+    try:
+        closure = helper.closure(selected)
+    except DependencyError as e:
+        print("{}. Exitting.".format(e))
+        return None
+    print("Selected {} libraries ({} including dependencies)".format(
+        len(selected), len(closure)))
+
+    # every stage transition is journaled, so that an interrupted run can be
+    # resumed exactly where it stopped; runs with other arguments keep their
+    # own journals
+    journal.start(hashlib.sha1(json.dumps(
+        [args.lists, args.lib, args.version, args.compiler],
+        sort_keys=True).encode("utf-8")).hexdigest()[:16],
+        resume=args.resume)
+    if args.resume:
+        builds = journal.previous("build").values()
+        print("Resuming: {} builds done, {} interrupted".format(
+            sum(1 for state in builds if state == DONE),
+            sum(1 for state in builds if state == STARTED)))
+
+    # only the selected libraries and compilers are analyzed
+    targets = set(
+        "{}-{}_{}".format(name, version, compiler["short"])
+        for name, version in selected
+        for compiler in compilers.values())
+
+    if rebuild:
+        for target in sorted(targets):
+            if os.path.exists(BIN_PREFIX + target):
+                print("Removing {} for the rebuild".format(target))
+                shutil.rmtree(BIN_PREFIX + target)
 
-    # iterate over all input files and parse the libraries into the cache
+    # iterate over all input files and parse the libraries into the cache;
+    # only the libraries in the closure are downloaded and extracted
     for file in args.lists:
-        libHandler.addFile(file)
+        libHandler.addFile(file, selection=set(closure),
+                           supervisor=supervisor)
+    services["mirrorSelector"].save()
+    services["discovery"].save()
+    diskBudget.enforce("cache")
 
-    # get the library cache from the handler and resolve the dependencies
+    # get the library cache from the handler and resolve the dependencies;
+    # the handler may hold further libraries of previous runs
     libs = libHandler.getLibs()
-    resolved = DependencyHelper(libs).resolve()
+    closure = set(closure)
+    resolved = [item for item in DependencyHelper(libs).resolve()
+                if (item.name, item.version) in closure]
 
     print("Compiling all libraries...")
 
-    # because of the dependencies, we only allow the build processes to use
-    # one core per compiler so that we have linear execution
-    with BuildWrapper(internals=resolved, libs=libs) as wrapper:
-        with ProcessPoolExecutor(max_workers=len(compilers)) as executor:
-            tasks = list()
-            for name, compiler in compilers.items():
-                # emit compile task to pool
-                t = executor.submit(wrapper.compileFor, compiler, args.cmake)
-                tasks.append(t)
+    # every library is built once per compiler; a build may start as soon
+    # as its dependencies were built with the same compiler, and builds
+    # on the longest critical path go first. The builds of one compiler run
+    # one at a time, so that the statistics of its compiler cache can be
+    # attributed to a single build
+    scheduler = Scheduler(settings.get(
+        "build_workers", len(compilers)), "builds", perGroup=1)
+    with BuildWrapper(internals=resolved, libs=libs,
+                      buildCache=services["buildCache"],
+                      compilerCache=services["compilerCache"],
+                      configureCache=services["configureCache"],
+                      diskBudget=diskBudget, supervisor=supervisor,
+                      history=history, scratch=scratch,
+                      journal=journal) as wrapper:
+        tasks = []
+        for compiler in compilers.values():
+            for task in wrapper.tasksFor(compiler):
+                dependencies = task.lib["dependencies"] or {}
+                # the scheduler cancels the dependents of a failed build
+                scheduler.add(
+                    (task.name, task.version, compiler["short"]),
+                    lambda task=task: (task.compile(cmake=args.cmake) or
+                                       task.lib["built"]),
+                    history.estimateBuild(task.name, task.version,
+                                          compiler["short"]),
+                    dependencies=[
+                        (depname, depversion, compiler["short"])
+                        for depname, depversion in dependencies.items()],
+                    label="{}-{}_{}".format(task.name, task.version,
+                                            compiler["short"]),
+                    group=compiler["short"], onCancel=task.cancel)
+                tasks.append(task)
+        try:
+            scheduler.run()
+        finally:
+            history.save()
+            if scratch is not None:
+                scratch.save()
+        results = [task.result for task in tasks]
 
-            for future in as_completed(tasks):
-                if future.exception() is not None:
-                    print("exception: {}".format(future.exception()))
+    # the sources and build directories are not needed by the export
+    diskBudget.enforce("extracted")
+    diskBudget.enforce("build")
 
     print("Compilation done, starting export for all dlls.")
 
+    # the analyses that were in flight when the resumed run was interrupted
+    # are started over, and the results of the finished ones are uploaded
+    # if that did not happen yet
+    uploads = set()
+    for key, state in journal.previous("ida").items():
+        if key.split("/")[0] not in targets:
+            continue
+        if state == STARTED:
+            print("Discarding the interrupted analysis of {}".format(key))
+            discardDatabase(journalPath(key))
+        elif state == DONE:
+            uploads.add(key)
+    for key, state in journal.previous("upload").items():
+        if key.split("/")[0] in targets and state == STARTED:
+            uploads.add(key)
+    uploads = [makeIdaHelper(journalPath(key), journaledPdb(journal, key),
+                             idaq, idaq64, settings, supervisor, history,
+                             exportIndex, journal=journal)
+               for key in sorted(uploads)
+               if not journal.resumed("upload", key) and
+               os.path.exists(journalPath(key))]
+
     # finally, we need to hand all files over to IDA so that it can
-    # analyze them for us; this time, we fire off all tasks at once
-    # because IDA does not depend on anything and we need to get
-    # things done
-    with ProcessPoolExecutor() as executor:
-        d = dict()
-
-        for dll, pdb in globfiles(binPrefix):
-            idahelper = IDAHelper(dll=dll, pdb=pdb,
-                                  idaq=idaq, idaq64=idaq64,
-                                  artifactoryPath=artifactoryPath,
-                                  auth=(artifactoryUser, artifactoryPass))
-            # emit analysis task to pool
-            t = executor.submit(idaPoolExecutionHelper, idahelper)
-            d[t] = idahelper
-
-        for future in as_completed(d):
-            idahelper = d[future]
-            if future.exception() is not None:
-                print("error creating idb for {}: {}".format(
-                    idahelper.dll, future.exception()))
+    # analyze them for us; the analyses do not depend on each other,
+    # so the longest ones are simply started first
+    jobs = []
+    mismatches = []
+    for dll, pdb in globfiles(BIN_PREFIX, targets):
+        # an analysis without the matching PDB yields a database without
+        # names; the builds already matched their PDBs, but the binaries may
+        # predate that or come from elsewhere, so the PDB is checked again and
+        # the DLL is skipped if there is none. The lock keeps a concurrent
+        # build of the same target from replacing the binaries meanwhile
+        target = os.path.basename(os.path.dirname(os.path.dirname(dll)))
+        with FileLock.forEntry(BIN_PREFIX + target):
+            pdb, reason = matchPdb(dll, pdb, [BUILD_PREFIX + target,
+                                              BIN_PREFIX + target],
+                                   services["pdbSearch"])
+        if pdb is None:
+            print("Skipping export of {}: {}".format(dll, reason))
+            if not reason.startswith("no PDB"):
+                mismatches.append(dll)
+            continue
+        idahelper = makeIdaHelper(dll, pdb, idaq, idaq64, settings,
+                                  supervisor, history, exportIndex,
+                                  dllProfile(libs, dll), journal)
+        # the profile of the library may exclude huge DLLs
+        reason = idahelper.skipReason()
+        if reason is not None:
+            print("Skipping export of {}: {}".format(dll, reason))
+            continue
+        jobs.append((idahelper, False))
+    services["pdbSearch"].save()
+
+    # databases exported by an older version of the exporter are only
+    # upgraded, which is much faster than a new analysis
+    jobs += [(makeIdaHelper(dll, pdb, idaq, idaq64, settings,
+                            supervisor, history, exportIndex,
+                            dllProfile(libs, dll)), True)
+             for dll, pdb in stalefiles(BIN_PREFIX, exportIndex, targets)]
+
+    try:
+        exports = {}
+        if uploads:
+            print("Finishing {} interrupted uploads".format(len(uploads)))
+            exports.update(resumeUploads(uploads, journal,
+                                         supervisor.maxProcesses))
+        if settings.get("export_queue", None):
+            # export workers on other machines help with the analysis
+            exports.update(queuedExports(
+                ExportQueue(settings["export_queue"]), jobs,
+                supervisor.maxProcesses,
+                lambda dll, pdb, profile: makeIdaHelper(
+                    dll, pdb, idaq, idaq64, settings, supervisor,
+                    None, None, profile),
+                settings.get("export_queue_timeout", 600)))
+        else:
+            exports.update(localExports(jobs, supervisor.maxProcesses))
+    finally:
+        history.save()
+
+    publishManifests(settings, jobs + [(idahelper, False)
+                                       for idahelper in uploads])
+    exportFailures = [dll for dll, success in exports.items()
+                      if not success] + mismatches
 
     print("Export done.")
 
-    return
+    return results, len(exports) + len(mismatches), exportFailures
+
+
+def printSummary(results, exports, exportFailures):
+    """ Prints the outcome of all builds and exports of the run.
+
+        :param results: list of (name, version, compiler, status, reason)
+            tuples as returned by :attr:`Task.result`
+        :param exports: the number of DLLs handed over to IDA
+        :param exportFailures: list of DLLs for which the export failed
+    """
+    print("Summary:")
+    counts = {}
+    for _, _, _, status, _ in results:
+        counts[status] = counts.get(status, 0) + 1
+    print("  builds: " + ", ".join(
+        "{} {}".format(count, status) for status, count in sorted(
+            counts.items(), key=lambda x: str(x[0]))))
+    for name, version, compiler, status, reason in sorted(results):
+        if status in [FAILED, CANCELLED]:
+            print("    {}-{}_{} {}: {}".format(
+                name, version, compiler, status, reason))
+    print("  exports: {} succeeded, {} failed".format(
+        exports - len(exportFailures), len(exportFailures)))
+    for dll in sorted(exportFailures):
+        print("    {}".format(dll))
+
+
+def loadDiskBudget(settings):
+    """ Creates the :class:`DiskBudget` for the stage directories from
+        the disk_budget settings.
+
+        :param settings: the contents of settings.yml
+    """
+    data = settings.get("disk_budget", None) or {}
+    stages = {
+        "cache": CACHE_PREFIX,
+        "extracted": EXTRACTED_PREFIX,
+        "build": BUILD_PREFIX,
+        "bin": BIN_PREFIX,
+    }
+    return DiskBudget(
+        stages,
+        budgets=dict((stage, data[stage]) for stage in stages if stage in data),
+        evictBuildAfterInstall=data.get("evict_build_after_install", False))
+
+
+def makeSupervisor(settings, maxProcesses=None):
+    """ Creates the :class:`ProcessSupervisor` for all child processes;
+        max_processes stays the upper bound, while the governor settings
+        share the CPUs, the memory and the bandwidth between the builds,
+        the IDA instances and the transfers.
+
+        :param settings: the contents of settings.yml
+        :param maxProcesses: (optional) overrides max_processes
+    """
+    data = settings.get("governor", None) or {}
+    governor = ResourceGovernor(
+        cpu=data.get("cpu", None),
+        memory=data.get("memory", None),
+        network=data.get("network", 4),
+        disk=data.get("disk", 2),
+        memoryReserve=data.get("memory_reserve", "1G"),
+        demands=data.get("demands", None))
+    return ProcessSupervisor(
+        LOG_PREFIX, maxProcesses or settings.get("max_processes", None),
+        governor)
+
+
+def gc(argv):
+    """ Garbage collection subcommand; enforces the disk budgets of all
+        stages and reports the reclaimed space.
+
+        :param argv: the command line arguments of the subcommand
+    """
+    parser = argparse.ArgumentParser(
+        prog="bindifflib.py gc", description="""Evict the least recently
+        used entries of all stage directories until they are within their
+        budgets.""")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only report what would be reclaimed")
+    args = parser.parse_args(argv)
+
+    settings = yaml.load(open("settings.yml", "rb").read())
+    blobStore = None
+    if os.path.exists(BLOB_PREFIX):
+        blobStore = BlobStore(BLOB_PREFIX)
+
+    report = loadDiskBudget(settings).gc(blobStore, dryRun=args.dry_run)
+    for stage, freed in report.items():
+        print("{:<10} {}".format(stage, formatSize(freed)))
+    print("{:<10} {}".format("total", formatSize(sum(report.values()))))
+
+
+def retention(argv):
+    """ Retention subcommand; removes the artifacts of libraries, versions
+        and compilers that are no longer built, superseded uploads and
+        duplicate files from the artifactory and reports the savings.
+
+        :param argv: the command line arguments of the subcommand
+    """
+    parser = argparse.ArgumentParser(
+        prog="bindifflib.py retention", description="""Remove or archive
+        the artifacts that are not referenced by the current library lists,
+        compilers and local databases any more.""")
+    parser.add_argument("compilers", metavar="<compilers.yml>", type=str,
+                        nargs="?", default="compilers.yml",
+                        help="yml file containing a list of compilers")
+    parser.add_argument("lists", metavar="<libs.yml>", type=str, nargs="*",
+                        default=["libs.yml"],
+                        help="yml file containing a list of libraries")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only report what would be removed")
+    args = parser.parse_args(argv)
+
+    settings = yaml.load(open("settings.yml", "rb").read())
+    if not settings.get("artifactory_path", None):
+        print("No artifactory configured. Exitting.")
+        return
+    retentionData = settings.get("retention", None) or {}
+
+    # the reference set: every declared version built with every compiler
+    compilers = yaml.load(open(args.compilers, "rb").read())
+    declared = {}
+    libHandler = makeLibHandler(loadServices(settings))
+    for name in args.lists:
+        libHandler.declareFile(name, declared)
+    targets = set((name, version, c["short"])
+                  for name, versions in declared.items()
+                  for version in versions for c in compilers.values())
+
+    # the local databases protect their files if they were never published
+    local = {}
+    for idb in ExportIndex(EXPORT_INDEX_FILE).databases():
+        base, ext = os.path.splitext(idb)
+        m = REGEX.search(base + ".dll")
+        if m is None:
+            continue
+        fname = m.group(4)
+        local.setdefault(m.groups()[:3], set()).update(
+            [fname + ".dll", fname + ".pdb", fname + ext,
+             fname + ".features.json"])
+
+    artifactory = Artifactory(
+        settings["artifactory_path"],
+        (settings.get("artifactory_user", ""),
+         settings.get("artifactory_pass", "")))
+    manifest = Manifest(artifactory)
+    helper = Retention(artifactory, manifest,
+                       archive=retentionData.get("archive", None),
+                       minAge=retentionData.get("min_age", 24) * 3600)
+    # no run may publish manifests between the plan and its application
+    with manifest.locked():
+        plan = helper.plan(targets, local)
+        report = helper.apply(plan, dryRun=args.dry_run)
+
+    total = 0
+    for reason in [UNREFERENCED, SUPERSEDED, DUPLICATE]:
+        count, size = report[reason]
+        total += size
+        print("{:<13} {:>6} files {:>10}".format(reason, count,
+                                                  formatSize(size)))
+    print("{:<13} {:>6} files {:>10}".format(
+        "total", len(plan["removals"]), formatSize(total)))
+    print("{} manifest entries pruned, {} files {}{} with {} requests".format(
+        report["pruned"], len(plan["removals"]),
+        "would be " if args.dry_run else "",
+        "archived" if retentionData.get("archive", None) else "deleted",
+        report["requests"]))
+
+
+def reexport(argv):
+    """ Re-export subcommand; upgrades all local databases that were exported
+        by an older version of bindifflib_exporter.py without analyzing the
+        DLLs again.
+
+        :param argv: the command line arguments of the subcommand
+    """
+    parser = argparse.ArgumentParser(
+        prog="bindifflib.py reexport", description="""Run the new steps of
+        the exporter on all databases exported by an older version of it
+        and upload the upgraded databases.""")
+    parser.add_argument("--idaq", metavar="<path to idaq executable>",
+                        default=find(
+                            ["C:\\Program Files (x86)\\IDA 6.95\\idaq.exe"]))
+    parser.add_argument("--idaq64", metavar="<path to idaq64 executable>",
+                        default=find(
+                            ["C:\\Program Files (x86)\\IDA 6.95\\idaq64.exe"]))
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only list the stale databases")
+    args = parser.parse_args(argv)
+
+    exportIndex = ExportIndex(EXPORT_INDEX_FILE)
+    stale = list(stalefiles(BIN_PREFIX, exportIndex))
+    print("{} stale databases (exporter version {})".format(
+        len(stale), exporterVersion()))
+    if args.dry_run:
+        for dll, _ in stale:
+            print("    {}".format(dll))
+        return
+    if not args.idaq:
+        print("No idaq.exe found. Exitting.")
+        return
+
+    settings = yaml.load(open("settings.yml", "rb").read())
+    history = RunHistory(HISTORY_FILE, logPath=HISTORY_LOG)
+    with makeSupervisor(settings) as supervisor:
+        results = runReexport(stale, settings, supervisor, history,
+                              exportIndex, args.idaq, args.idaq64)
+
+    failures = sorted(dll for dll, success in results.items() if not success)
+    print("re-exports: {} succeeded, {} failed".format(
+        len(results) - len(failures), len(failures)))
+    for dll in failures:
+        print("    {}".format(dll))
+
+
+def runReexport(stale, settings, supervisor, history, exportIndex, idaq,
+                idaq64):
+    """ Upgrades stale databases and publishes the manifests. Returns a
+        dictionary of DLLs and whether their re-export succeeded.
+
+        :param stale: list of (dll, pdb) pairs, see :func:`stalefiles`
+        :param settings: the contents of settings.yml
+        :param supervisor: the :class:`ProcessSupervisor`
+        :param history: the :class:`RunHistory`
+        :param exportIndex: the :class:`ExportIndex`
+        :param idaq: the path of idaq.exe
+        :param idaq64: the path of idaq64.exe
+    """
+    jobs = [(makeIdaHelper(dll, pdb, idaq, idaq64, settings, supervisor,
+                           history, exportIndex), True)
+            for dll, pdb in stale]
+    try:
+        results = localExports(jobs, supervisor.maxProcesses)
+    finally:
+        history.save()
+
+    publishManifests(settings, jobs)
+    return results
 
 
-def globfiles(path):
+def worker(argv):
+    """ Export worker subcommand; runs the IDA exports queued by the build
+        hosts in a shared export queue, see export_queue in settings.yml.
+
+        :param argv: the command line arguments of the subcommand
+    """
+    settings = {}
+    if os.path.exists("settings.yml"):
+        settings = yaml.load(open("settings.yml", "rb").read())
+
+    parser = argparse.ArgumentParser(
+        prog="bindifflib.py worker", description="""Run IDA exports from a
+        shared export queue and upload the results.""")
+    parser.add_argument("queue", metavar="<export queue>", nargs="?",
+                        default=settings.get("export_queue", None),
+                        help="directory of the export queue")
+    parser.add_argument("--idaq", metavar="<path to idaq executable>",
+                        default=find(
+                            ["C:\\Program Files (x86)\\IDA 6.95\\idaq.exe"]))
+    parser.add_argument("--idaq64", metavar="<path to idaq64 executable>",
+                        default=find(
+                            ["C:\\Program Files (x86)\\IDA 6.95\\idaq64.exe"]))
+    parser.add_argument("--processes", metavar="<count>", type=int,
+                        default=settings.get("max_processes", None),
+                        help="number of exports running at the same time")
+    parser.add_argument("--poll", metavar="<seconds>", type=int, default=30,
+                        help="interval of the checks for new jobs")
+    parser.add_argument("--once", action="store_true",
+                        help="exit as soon as the queue is empty")
+    args = parser.parse_args(argv)
+
+    if not args.queue:
+        print("No export queue given. Exitting.")
+        return
+    if not args.idaq:
+        print("No idaq.exe found. Exitting.")
+        return
+
+    queue = ExportQueue(args.queue)
+    name = "{}-{}".format(socket.gethostname(), os.getpid())
+    with makeSupervisor(settings, args.processes) as supervisor:
+        # the durations and exporter versions are recorded by the build
+        # host that queued the job
+        makeHelper = (lambda dll, pdb, profile: makeIdaHelper(
+            dll, pdb, args.idaq, args.idaq64, settings, supervisor,
+            None, None, profile))
+        print("Waiting for exports in {}...".format(args.queue))
+        with ThreadPoolExecutor(max_workers=supervisor.maxProcesses) as executor:
+            for i in range(supervisor.maxProcesses):
+                executor.submit(ExportWorker(
+                    queue, WORKER_PREFIX, makeHelper,
+                    "{}.{}".format(name, i)).run,
+                    None if args.once else args.poll)
+
+
+def daemon(argv):
+    """ Daemon subcommand; keeps the configuration, caches and indexes in
+        memory and runs the jobs submitted over a local HTTP API.
+
+        :param argv: the command line arguments of the subcommand
+    """
+    settings = yaml.load(open("settings.yml", "rb").read())
+    daemonData = settings.get("daemon", None) or {}
+
+    parser = argparse.ArgumentParser(
+        prog="bindifflib.py daemon", description="""Run as a daemon that
+        builds and exports the libraries submitted over a local HTTP API.""")
+    parser.add_argument("compilers", metavar="<compilers.yml>", nargs="?",
+                        default="compilers.yml",
+                        help="yml file containing a list of compilers to use")
+    parser.add_argument("lists", metavar="<libs.yml>", nargs="*",
+                        default=["libs.yml"],
+                        help="yml file containing a list of libraries")
+    parser.add_argument("--cmake", metavar="<path to cmake executable>",
+                        default=find(
+                            ["C:\\Program Files\\CMake\\bin\\cmake.exe",
+                             "C:\\Program Files (x86)\\CMake\\bin\\cmake.exe"]))
+    parser.add_argument("--idaq", metavar="<path to idaq executable>",
+                        default=find(
+                            ["C:\\Program Files (x86)\\IDA 6.95\\idaq.exe"]))
+    parser.add_argument("--idaq64", metavar="<path to idaq64 executable>",
+                        default=find(
+                            ["C:\\Program Files (x86)\\IDA 6.95\\idaq64.exe"]))
+    parser.add_argument("--host", default=daemonData.get("host", "127.0.0.1"),
+                        help="address of the HTTP API")
+    parser.add_argument("--port", type=int,
+                        default=daemonData.get("port", 8421),
+                        help="port of the HTTP API")
+    parser.add_argument("--poll", metavar="<seconds>", type=int, default=5,
+                        help="interval of the checks for changed files")
+    args = parser.parse_args(argv)
+
+    if not args.cmake:
+        print("No CMake executable found. Exitting.")
+        return
+    if not args.idaq:
+        print("No idaq.exe found. Exitting.")
+        return
+
+    for prefix in [TMP_PREFIX, CACHE_PREFIX, EXTRACTED_PREFIX, BUILD_PREFIX,
+                   BIN_PREFIX]:
+        if not os.path.exists(prefix):
+            os.mkdir(prefix)
+
+    # everything that survives between two jobs; the settings are bound
+    # into the services, so changes of settings.yml need a restart
+    services = loadServices(settings)
+    state = {"settings": os.stat("settings.yml").st_mtime}
+
+    def reload():
+        if os.stat("settings.yml").st_mtime != state["settings"]:
+            state["settings"] = os.stat("settings.yml").st_mtime
+            print("settings.yml changed; restart the daemon to apply it")
+        # the library handler forgets all libraries, but their archives
+        # and source trees are still on disk
+        state["compilers"] = yaml.load(open(args.compilers, "rb").read())
+        state["libHandler"] = makeLibHandler(services)
+
+    def declaredVersions():
+        declared = {}
+        for file in args.lists:
+            state["libHandler"].declareFile(file, declared)
+        return set((name, version) for name, versions in declared.items()
+                   for version in versions)
+
+    def discover(daemon):
+        # ask the upstreams for new versions and build them right away; this
+        # also picks up versions that were added to the libs.yml files. The
+        # daemon runs this between two jobs, so the library handler is not
+        # in use
+        services["discovery"].refresh()
+        known = declaredVersions()
+        services["discovery"].save()
+        new = known - state["known"]
+        state["known"] = known
+        for name in sorted(set(name for name, _ in new)):
+            versions = sorted(version for n, version in new if n == name)
+            print("New versions of {}: {}".format(name, ", ".join(versions)))
+            daemon.submit({"type": "build", "lib": [name],
+                           "version": versions})
+
+    reload()
+    state["known"] = declaredVersions()
+
+    with makeSupervisor(settings) as supervisor:
+
+        def runJob(job):
+            if job["type"] == "reexport":
+                exportIndex = services["exportIndex"]
+                targets = None
+                if job["lib"] or job["version"] or job["compiler"]:
+                    # the names of the binary trees are ambiguous, e.g. for
+                    # dashed versions, so the declared builds are matched
+                    targets = set(
+                        "{}-{}_{}".format(name, version, compiler["short"])
+                        for name, version in declaredVersions()
+                        for compilerName, compiler in
+                        state["compilers"].items()
+                        if jobMatches(job, name, version,
+                                      (compilerName, compiler["short"])))
+                results = runReexport(
+                    list(stalefiles(BIN_PREFIX, exportIndex, targets)),
+                    settings, supervisor, services["history"], exportIndex,
+                    args.idaq, args.idaq64)
+                return {"exports": len(results),
+                        "export_failures": sorted(
+                            dll for dll, success in results.items()
+                            if not success)}
+
+            jobArgs = argparse.Namespace(
+                lists=args.lists, cmake=args.cmake, lib=job["lib"],
+                version=job["version"], compiler=job["compiler"],
+                resume=False)
+            outcome = runPipeline(jobArgs, state["compilers"], settings,
+                                  services, state["libHandler"], supervisor,
+                                  args.idaq, args.idaq64,
+                                  rebuild=job["type"] == "rebuild")
+            if outcome is None:
+                raise ValueError("no library or compiler matches the job")
+            printSummary(*outcome)
+            services["diskBudget"].enforce("bin")
+            results, exports, exportFailures = outcome
+            builds = {}
+            for _, _, _, status, _ in results:
+                builds[str(status)] = builds.get(str(status), 0) + 1
+            return {"builds": builds, "exports": exports,
+                    "export_failures": sorted(exportFailures)}
+
+        def metrics():
+            data = [("bindifflib_processes_running", {}, supervisor.running),
+                    ("bindifflib_processes_max", {}, supervisor.maxProcesses),
+                    ("bindifflib_worker_utilization", {},
+                     supervisor.running / float(supervisor.maxProcesses))]
+            governor = supervisor.governor.stats()
+            for resource in sorted(governor["limits"]):
+                if governor["limits"][resource] is not None:
+                    data.append(("bindifflib_resource_limit",
+                                 {"resource": resource},
+                                 governor["limits"][resource]))
+                data.append(("bindifflib_resource_in_use",
+                             {"resource": resource},
+                             governor["inUse"][resource]))
+            data.append(("bindifflib_resource_waiting", {},
+                         governor["waiting"]))
+            for stage, stats in sorted(services["history"].stats().items()):
+                data.append(("bindifflib_stage_completed_total",
+                             {"stage": stage}, stats["count"]))
+                data.append(("bindifflib_stage_seconds_total",
+                             {"stage": stage}, stats["seconds"]))
+            if settings.get("export_queue", None):
+                data.append(("bindifflib_export_queue_depth", {},
+                             ExportQueue(settings["export_queue"]).pending()))
+            return data
+
+        Daemon(runJob, reload,
+               [args.compilers, "settings.yml"] + args.lists, metrics,
+               args.host, args.port, args.poll, discover,
+               daemonData.get("discover_interval", 3600)).serve()
+
+
+def jobMatches(job, name, version, compilerNames):
+    """ Checks whether a build matches the selectors of a daemon job.
+
+        :param job: the job, see :class:`Daemon`
+        :param name: the name of the library
+        :param version: the version of the library
+        :param compilerNames: the names that select the compiler, i.e. its
+            key in compilers.yml and its short name
+    """
+    for key, values in [("lib", [name]), ("version", [version]),
+                        ("compiler", compilerNames)]:
+        if job[key] and not any(fnmatch(value, p) for value in values
+                                for p in job[key]):
+            return False
+    return True
+
+
+def globfiles(path, targets=None):
     """ Scans the binary directory for any DLL that have not
-        yet been anaylized by IDA.
+        yet been anaylized by IDA. The PDB next to the DLL may be missing
+        or stale, see :func:`matchPdb`.
+
+        :param path: the binary directory
+        :param targets: (optional) set of directory names, i.e.
+            "<name>-<version>_<compiler>", to restrict the scan to
     """
-    pdbs = glob(path + "/*/bin/*.pdb")
     idbs = glob(path + "/*/bin/*.idb")
     i64s = glob(path + "/*/bin/*.i64")
     dlls = glob(path + "/*/bin/*.dll")
 
     for dll in dlls:
+        if targets is not None and (os.path.basename(
+                os.path.dirname(os.path.dirname(dll))) not in targets):
+            continue
+
         idb = dll.replace(".dll", ".idb")
         i64 = dll.replace(".dll", ".i64")
         pdb = dll.replace(".dll", ".pdb")
 
-        if (idb not in idbs) and (i64 not in i64s) and (pdb in pdbs):
+        if (idb not in idbs) and (i64 not in i64s):
             yield (dll, pdb)
 
 
+def localExports(jobs, workers):
+    """ Runs IDA exports on this machine, the longest first. Returns a
+        dictionary of DLLs and whether their export succeeded.
+
+        :param jobs: list of (:class:`IDAHelper`, reexport) tuples
+        :param workers: the number of exports running at the same time
+    """
+    scheduler = Scheduler(workers, "exports")
+    for idahelper, reexport in jobs:
+        scheduler.add(idahelper.dll, lambda idahelper=idahelper,
+                      reexport=reexport: idaPoolExecutionHelper(
+                          idahelper, reexport),
+                      idahelper.estimate(reexport), label=idahelper.dll)
+    return scheduler.run()
+
+
+def queuedExports(queue, jobs, workers, makeHelper, timeout, poll=10):
+    """ Runs IDA exports through a shared :class:`ExportQueue`, so that the
+        export workers of other machines can take part. This machine runs
+        exports as well. Returns a dictionary of DLLs and whether their
+        export succeeded.
+
+        :param queue: the :class:`ExportQueue`
+        :param jobs: list of (:class:`IDAHelper`, reexport) tuples
+        :param workers: the number of exports this machine runs at the
+            same time
+        :param makeHelper: callable that creates the :class:`IDAHelper`
+            for the DLL and PDB path and the IDA profile of a job
+        :param timeout: seconds without a renewal of its claim after which
+            a job is considered abandoned and put back into the queue
+        :param poll: (optional) seconds between checks for finished jobs
+    """
+    submitted = {}
+    for idahelper, reexport in jobs:
+        target = os.path.basename(os.path.dirname(os.path.dirname(
+            idahelper.dll)))
+        jobId = queue.submit(idahelper, target, reexport,
+                             priority=idahelper.estimate(reexport))
+        submitted[jobId] = (idahelper, reexport)
+    print("Queued {} exports in {}".format(len(submitted), queue.path))
+
+    name = "{}-{}".format(socket.gethostname(), os.getpid())
+    results = {}
+    remote = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = []
+        while len(results) < len(submitted):
+            # keep the local workers busy; a job given up by a remote worker
+            # may show up again at any time
+            running = [f for f in running if not f.done()]
+            if queue.pending():
+                for i in range(len(running), workers):
+                    running.append(executor.submit(ExportWorker(
+                        queue, WORKER_PREFIX, makeHelper,
+                        "{}.{}".format(name, i)).run))
+
+            for jobId, (idahelper, reexport) in submitted.items():
+                if idahelper.dll in results:
+                    continue
+                result = queue.result(jobId)
+                if result is None:
+                    continue
+
+                success = result["success"]
+                if success:
+                    features = result.get("features", None)
+                    if features is not None:
+                        features = os.path.join(queue.files(jobId), features)
+                    try:
+                        idahelper.adopt(
+                            os.path.join(queue.files(jobId), result["idb"]),
+                            result["duration"], result["exporter"],
+                            result["uploaded"], reexport,
+                            result.get("uploads", None), features)
+                    except Exception as e:
+                        print("error adopting idb for {}: {}".format(
+                            idahelper.dll, e))
+                        success = False
+                else:
+                    print("error creating idb for {} on {}: {}".format(
+                        idahelper.dll, result["worker"], result["message"]))
+                results[idahelper.dll] = success
+                queue.remove(jobId)
+                if not result["worker"].startswith(name):
+                    remote.add(result["worker"])
+
+                # the remote workers are only known once they finished a job
+                eta = sum(h.estimate(r) for h, r in submitted.values()
+                          if h.dll not in results) / (workers + len(remote))
+                print("[{}/{} exports] {} finished on {}, ETA {}".format(
+                    len(results), len(submitted), idahelper.dll,
+                    result["worker"], formatDuration(eta)))
+
+            if len(results) < len(submitted):
+                requeued = queue.requeue(timeout)
+                if requeued:
+                    print("Requeued {} abandoned exports".format(requeued))
+                time.sleep(poll)
+    return results
+
+
+def stalefiles(path, exportIndex, targets=None):
+    """ Scans the binary directory for any DLL whose database was exported
+        by an older version of the exporter.
+
+        :param path: the binary directory
+        :param exportIndex: the :class:`ExportIndex` of the databases
+        :param targets: (optional) set of directory names, i.e.
+            "<name>-<version>_<compiler>", to restrict the scan to
+    """
+    current = exporterVersion()
+    for dll in glob(path + "/*/bin/*.dll"):
+        if targets is not None and (os.path.basename(
+                os.path.dirname(os.path.dirname(dll))) not in targets):
+            continue
+
+        pdb = dll.replace(".dll", ".pdb")
+        for idb in [dll.replace(".dll", ".idb"), dll.replace(".dll", ".i64")]:
+            if (os.path.exists(idb) and os.path.exists(pdb) and
+                    exportIndex.version(idb) < current):
+                yield (dll, pdb)
+                break
+
+
+def publishManifests(settings, jobs):
+    """ Publishes the files uploaded by the exports in the manifests of
+        their libraries and in the index of the artifactory.
+
+        :param settings: the contents of settings.yml
+        :param jobs: list of (:class:`IDAHelper`, reexport) tuples
+    """
+    if not settings.get("artifactory_path", None):
+        return
+    manifest = Manifest(Artifactory(
+        settings["artifactory_path"],
+        (settings.get("artifactory_user", ""),
+         settings.get("artifactory_pass", ""))))
+    for idahelper, _ in jobs:
+        idahelper.publishTo(manifest)
+    try:
+        count = manifest.publish()
+        if count:
+            print("Published the manifests of {} libraries".format(count))
+    except Exception as e:
+        print("error publishing the manifests: {}".format(e))
+
+
+def makeIdaHelper(dll, pdb, idaq, idaq64, settings, supervisor, history,
+                  exportIndex, profile=None, journal=None):
+    """ Creates the :class:`IDAHelper` for a DLL from the settings.
+
+        :param settings: the contents of settings.yml
+        :param profile: (optional) the IDA analysis profile of the library
+        :param journal: (optional) the :class:`RunJournal` of the run
+    """
+    return IDAHelper(dll=dll, pdb=pdb, idaq=idaq, idaq64=idaq64,
+                     artifactoryPath=settings.get("artifactory_path", None),
+                     auth=(settings.get("artifactory_user", ""),
+                           settings.get("artifactory_pass", "")),
+                     supervisor=supervisor,
+                     compression=settings.get("compression", None),
+                     compressionLevel=settings.get("compression_level", None),
+                     history=history, exportIndex=exportIndex,
+                     profile=profile, journal=journal)
+
+
+def journalPath(key):
+    """ Returns the path of the DLL of a journal key of the export stage,
+        see :attr:`IDAHelper.journalKey`.
+    """
+    target, filename = key.split("/", 1)
+    return "{}{}/bin/{}".format(BIN_PREFIX, target, filename)
+
+
+def journaledPdb(journal, key):
+    """ Returns the path of the PDB an export of the interrupted run used,
+        which is recorded with its analysis and upload.
+
+        :param journal: the :class:`RunJournal`
+        :param key: the journal key of the export, see :func:`journalPath`
+    """
+    for stage in ["upload", "ida"]:
+        pdb = journal.data(stage, key).get("pdb", None)
+        if pdb is not None:
+            return pdb
+    # journals written before the PDB was recorded
+    return journalPath(key)[:-len(".dll")] + ".pdb"
+
+
+def discardDatabase(dll):
+    """ Removes the database of a DLL, including the unpacked database
+        files IDA leaves behind when it is killed.
+    """
+    for ext in [".idb", ".i64", ".id0", ".id1", ".id2", ".nam", ".til",
+                ".profile.json", ".features.json"]:
+        path = dll[:-len(".dll")] + ext
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def resumeUploads(helpers, journal, workers):
+    """ Uploads the results of the exports of an interrupted run. Returns a
+        dictionary of DLLs and whether their upload succeeded.
+
+        :param helpers: the :class:`IDAHelper` of every DLL
+        :param journal: the :class:`RunJournal`, which tells whether only
+            the IDB has to be uploaded
+        :param workers: the number of uploads running at the same time
+    """
+    def upload(idahelper):
+        try:
+            idahelper.storeresult(onlyIdb=journal.data(
+                "upload", idahelper.journalKey).get("onlyIdb", False))
+            return True
+        except Exception as e:
+            print(e)
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip([idahelper.dll for idahelper in helpers],
+                        executor.map(upload, helpers)))
+
+
+def dllProfile(libs, dll):
+    """ Returns the IDA analysis profile of the library a DLL belongs to.
+
+        :param libs: the global dictionary of libraries
+        :param dll: the path of the DLL within the binary directory
+    """
+    m = REGEX.search(dll)
+    if not m or m.group(1) not in libs:
+        return None
+    lib = libs[m.group(1)].get(m.group(2), None)
+    return lib.get("ida_profile", None) if lib is not None else None
+
+
 def find(where):
     """ Checks if any of the given paths exists and returns the first finding. """
     for path in where:
@@ -167,16 +1240,36 @@ def find(where):
         return None
 
 
-def idaPoolExecutionHelper(ida):
+def idaPoolExecutionHelper(ida, reexport=False):
     """ Helper function to avoid crashing the whole pool execution
         if any of the tasks fails.
+
+        :param reexport: (optional) upgrade the existing database instead
+            of creating a new one
     """
     try:
+        if reexport:
+            print("Re-exporting IDB file for {}...".format(ida.dll))
+            ida.reexport()
+            ida.storeresult(onlyIdb=True)
+            return True
         print("Creating IDB file for {}...".format(ida.dll))
         ida.makeidb()
         ida.storeresult()
+        return True
     except Exception as e:
         print(e)
+        return False
+
+
+# subcommands of bindifflib.py, see main()
+COMMANDS = {
+    "gc": gc,
+    "retention": retention,
+    "reexport": reexport,
+    "worker": worker,
+    "daemon": daemon,
+}
 
 
 if __name__ == "__main__":
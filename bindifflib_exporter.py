@@ -1,13 +1,52 @@
 from idaapi import *
 from idc import *
 from idautils import *
+import json
+import os
 import sys
+import zlib
 
+# version of the exporter; it has to be increased whenever a step is added
+# or changed, and the step has to be tagged with the new version. Existing
+# databases only run the steps newer than the version they were exported
+# with, see "python bindifflib.py reexport"
+EXPORTER_VERSION = 2
+
+# netnode holding the version a database was exported with
+VERSION_NETNODE = "$ bindifflib"
+
+# version of the feature files; the IDA plugin computes the same features of
+# the open database, so both have to be changed together
+FEATURES_VERSION = 1
+# shorter strings and functions are too common to tell libraries apart
+MIN_STRING_LENGTH = 6
+MIN_FUNCTION_ITEMS = 8
+
+
+def applyProfile():
+    """ Disables the analysis passes listed in the profile file given in the
+        plugin options, see ida_profile in libs.yml. Has to run before the
+        auto-analysis is finished.
+    """
+    path = get_plugin_options("bindifflib_profile")
+    if not path:
+        return
+    with open(path, "r") as f:
+        profile = json.load(f)
+
+    inf = cvar.inf
+    for flag in profile.get("disable_analysis", []):
+        value = globals().get(flag, None)
+        if value is None:
+            print("Unknown analysis flag {}".format(flag))
+        elif flag.startswith("AF2_"):
+            inf.af2 &= ~value
+        else:
+            inf.af &= ~value
 
-def main():
-    # Wait for auto-analysis
-    Wait()
 
+def applyPdb():
+    """ Loads the symbols from the PDB file given in the plugin options. """
     # setup netnode values
     n = netnode("$ pdb")
     n.altset(0, get_imagebase())
@@ -16,7 +55,84 @@ def main():
     # load pdb file
     RunPlugin("pdb", 3)
 
-    # close IDA
+
+def crc(text):
+    """ Returns the CRC32 of a string as unsigned number. """
+    if not isinstance(text, bytes):
+        text = text.encode("utf-8")
+    return zlib.crc32(text) & 0xffffffff
+
+
+def databaseFeatures():
+    """ Returns cheap features of the database, as sorted lists of CRC32s:
+        the string constants, the imported APIs ("module!name") and the
+        mnemonic sequences of the functions. The mnemonics do not depend on
+        relocations, but on the compiler.
+    """
+    strings = set(crc(str(s)) for s in Strings()
+                  if s.length >= MIN_STRING_LENGTH)
+
+    imports = set()
+    for i in range(get_import_module_qty()):
+        module = (get_import_module_name(i) or "").lower()
+        if module.endswith(".dll"):
+            module = module[:-len(".dll")]
+
+        def add(ea, name, ordinal):
+            if name:
+                imports.add(crc("{}!{}".format(module, name)))
+            return True
+        enum_import_names(i, add)
+
+    functions = set()
+    for f in Functions():
+        items = list(FuncItems(f))
+        if len(items) >= MIN_FUNCTION_ITEMS:
+            functions.add(crc(" ".join(GetMnem(ea) for ea in items)))
+
+    return {
+        "version": FEATURES_VERSION,
+        "strings": sorted(strings),
+        "imports": sorted(imports),
+        "functions": sorted(functions),
+    }
+
+
+def writeFeatures():
+    """ Writes the features of the database next to it; they are uploaded
+        with the database, so that the IDA plugin can rank the libraries by
+        their similarity to the database of an analyst.
+    """
+    path = os.path.splitext(GetIdbPath())[0] + ".features.json"
+    with open(path, "w") as f:
+        json.dump(databaseFeatures(), f)
+
+
+# all export steps and the exporter version they were introduced or last
+# changed in, in the order they are run
+STEPS = [
+    (1, applyPdb),
+    (2, writeFeatures),
+]
+
+
+def main():
+    # the analysis profile only applies to new databases
+    applyProfile()
+
+    # Wait for auto-analysis; returns at once for existing databases
+    Wait()
+
+    # run all steps the database has not seen yet
+    n = netnode(VERSION_NETNODE, 0, True)
+    version = n.altval(0)
+    for step, func in STEPS:
+        if step > version:
+            func()
+    n.altset(0, EXPORTER_VERSION)
+
+    # store the database and close IDA
+    SaveBase("")
     Exit(0)
 
 if __name__ == "__main__":
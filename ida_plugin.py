@@ -1,10 +1,20 @@
-from idc import RunPlugin, AskStr, Message, Warning
+from idc import RunPlugin, AskStr, AskYN, Message, Warning, GetMnem
 from idaapi import Choose, add_hotkey
+from idautils import Strings, Functions, FuncItems
+import idaapi
+import math
 import requests
+import threading
 import os
 import yaml
 import json
 import re
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # path settings
 homedir = os.path.expanduser("~")
@@ -19,6 +29,124 @@ auth = ("user", "password")
 # copiler settings path
 compiler_file = "C:\\your\\path\\to\\compilers.yml"
 
+# compression codecs of the artifacts, identified by the file name suffix
+codecs = {".zst": "zstd", ".gz": "gzip"}
+
+# index of all libraries and versions published by bindifflib
+indexPath = "bin/index.json"
+
+# local copies of the feature files of the published databases
+featureCacheDir = os.path.join(bindifflibhome, "features")
+
+# features of the databases as computed by bindifflib_exporter.py; they have
+# to be kept in sync with the exporter
+FEATURES_VERSION = 1
+MIN_STRING_LENGTH = 6
+MIN_FUNCTION_ITEMS = 8
+
+# weights of the kinds of features in the ranking; the functions tell the
+# compilers apart, the strings and imports the libraries and versions
+FEATURE_WEIGHTS = {"functions": 0.5, "strings": 0.3, "imports": 0.2}
+
+# number of candidates shown by the ranking
+rankedCandidates = 20
+
+# local copy of the library list, so that the chooser can be shown at once
+packetCacheFile = os.path.join(bindifflibhome, "packages.json")
+
+# the library list of the current session and the running task, i.e. a
+# query or a download
+packetCache = None
+currentTask = None
+
+# callables posted by background tasks for the UI thread on IDA versions
+# without MFF_NOWAIT, see BackgroundTask.post
+pendingCalls = []
+pendingLock = threading.Lock()
+
+
+class DownloadCancelled(Exception):
+    """ Raised in a background task after the user cancelled it. """
+    pass
+
+
+class BackgroundTask(threading.Thread):
+    """ Runs network work off IDA's UI thread, so that the IDA session
+        stays responsive. Messages and results are handed back to the UI
+        thread with execute_sync, since the IDA API must only be used from
+        there.
+    """
+    def __init__(self, work, done=None):
+        """ Initializes the task.
+
+            :param work: callable that does the work; receives the task and
+                returns the result
+            :param done: (optional) callable that receives the result on
+                the UI thread
+        """
+        super(BackgroundTask, self).__init__()
+        self.daemon = True
+        self.cancelled = threading.Event()
+        self.result = None
+        self._work = work
+        self._done = done
+
+    def run(self):
+        try:
+            self.result = self._work(self)
+        except DownloadCancelled:
+            self.message("Cancelled.")
+            return
+        except Exception as e:
+            message = "Error: {}".format(e)
+            self.post(lambda: Warning(message))
+            return
+        if self._done is not None and not self.cancelled.is_set():
+            self.post(lambda: self._done(self.result))
+
+    def start(self):
+        """ Starts the task; called on the UI thread. Without MFF_NOWAIT, a
+            timer runs the posted callables on the UI thread until the task
+            is done.
+        """
+        super(BackgroundTask, self).start()
+        if hasattr(idaapi, "MFF_NOWAIT") or not hasattr(
+                idaapi, "register_timer"):
+            return
+
+        def poll():
+            runPending()
+            with pendingLock:
+                if self.is_alive() or pendingCalls:
+                    return 100
+            return -1
+        idaapi.register_timer(100, poll)
+
+    def post(self, func):
+        """ Runs a callable on the UI thread without waiting for it. """
+        if not hasattr(idaapi, "MFF_NOWAIT"):
+            # a synchronous request would deadlock while the UI thread is
+            # busy, so the callable is left to the timer of the task, or to
+            # the next invocation of the plugin on IDA versions without
+            # timers
+            with pendingLock:
+                pendingCalls.append(func)
+            return
+
+        def callback():
+            func()
+            return 1
+        idaapi.execute_sync(callback, idaapi.MFF_FAST | idaapi.MFF_NOWAIT)
+
+    def message(self, text):
+        """ Prints a line to IDA's output window. """
+        self.post(lambda: Message(text + "\n"))
+
+    def check(self):
+        """ Raises :class:`DownloadCancelled` if the task was cancelled. """
+        if self.cancelled.is_set():
+            raise DownloadCancelled()
+
 
 class VersionChooser(Choose):
     """ Displays a choose dialog where the user has to select
@@ -44,13 +172,25 @@ class NameChooser(Choose):
         return
 
 
+class CandidateChooser(Choose):
+    """ Presents the libraries ranked by their similarity to the open
+        database, so that the user only downloads the likely ones.
+    """
+    def __init__(self, rows):
+        super(CandidateChooser, self).__init__(rows, "Select Candidate", 1)
+        self.width = 80
+
+    def enter(self, n):
+        return
+
+
 def queryPackets():
     """ Retrieves the full list of packages from the artifactory and
         returns empty list on error.
     """
     try:
         data = json.loads(requests.post(artifactoryBase + "api/search/aql",
-                          data='items.find({"repo":"{}"}).include("name", "path")'.format(repoName),
+                          data='items.find({"repo":"{}"}).include("name", "path", "actual_sha1", "modified")'.format(repoName),
                           verify=False, auth=auth).text)
         resultset = []
         for entry in data["results"]:
@@ -60,50 +200,494 @@ def queryPackets():
         return []
 
 
-def filterPackagesByVersion(packets, version):
-    """ Filters packets by version and emits a generator as the result. """
-    for p in packets:
-        if version in p["path"]:
-            yield p
+def fetchJson(path):
+    """ Downloads a JSON document from the repository, or returns None if
+        it does not exist.
+    """
+    resp = requests.get(repoPath + path, verify=False, auth=auth)
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    return json.loads(resp.text)
 
 
-def getPacketsByName(packets, name):
-    """ Return a list of packages that match the given name. """
-    resultset = []
+def indexFromPackets(packets):
+    """ Builds the equivalent of the published index from the full list of
+        packages, for repositories without manifests.
+    """
+    libraries = {}
     for p in packets:
-        if name in p["path"]:
-            resultset.append(p)
-    return resultset
+        parts = p["path"].split("/")
+        # bin/<name>/<version>/<compiler>
+        if len(parts) < 4:
+            continue
+        versions = libraries.setdefault(parts[1], {"versions": []})["versions"]
+        if parts[2] not in versions:
+            versions.append(parts[2])
+    for library in libraries.values():
+        library["versions"].sort()
+    return {"libraries": libraries}
+
+
+def manifestFromPackets(packets, name):
+    """ Builds the equivalent of the published manifest of a library from
+        the full list of packages, for repositories without manifests.
+    """
+    versions = {}
+    for p in packets:
+        parts = p["path"].split("/")
+        if len(parts) < 4 or parts[1] != name:
+            continue
+        filename, codec = splitCodec(p["name"])
+        versions.setdefault(parts[2], {}).setdefault(parts[3], []).append({
+            "file": filename,
+            "path": p["path"] + "/" + p["name"],
+            "codec": codec,
+            "sha1": p.get("actual_sha1", None),
+            "modified": p.get("modified", None),
+        })
+    return {"name": name, "versions": versions}
+
+
+def loadPacketCache():
+    """ Returns the library list of the last query, or None if there is
+        none.
+    """
+    try:
+        with open(packetCacheFile, "r") as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def storePacketCache(cache):
+    """ Stores the library list for the next sessions. """
+    if not os.path.exists(bindifflibhome):
+        os.makedirs(bindifflibhome)
+    with open(packetCacheFile + ".part", "w") as f:
+        json.dump(cache, f)
+    if os.path.exists(packetCacheFile):
+        os.remove(packetCacheFile)
+    os.rename(packetCacheFile + ".part", packetCacheFile)
+
+
+def refreshPackets(task):
+    """ Background work that fetches the library list. The small index
+        published by bindifflib is used if there is one that covers the
+        whole repository; otherwise, the whole repository is listed, so
+        that the libraries uploaded before there was an index are found,
+        too. Returns None if the query failed.
+    """
+    index = fetchJson(indexPath)
+    task.check()
+    if index is not None and index.get("complete", False):
+        cache = {"index": index, "packets": None}
+    else:
+        packets = queryPackets()
+        task.check()
+        if not packets:
+            return None
+        cache = {"index": indexFromPackets(packets), "packets": packets}
+    storePacketCache(cache)
+    return cache
+
+
+def packetsRefreshed(cache):
+    """ Takes over the library list of a background refresh. """
+    global packetCache
+    if cache:
+        packetCache = cache
+        Message("Library list updated ({} libraries)\n".format(
+            len(cache["index"]["libraries"])))
+
+
+def runPending():
+    """ Runs the callables posted by background tasks; called on the UI
+        thread, see :meth:`BackgroundTask.post`.
+    """
+    with pendingLock:
+        calls = pendingCalls[:]
+        del pendingCalls[:]
+    for call in calls:
+        call()
 
 
-def getPacketNames(packets):
-    """ Return a unified list of names of the libraries from the
-        list of packages sent by the artifactory server.
+def startTask(task, message):
+    """ Runs a background task that the user is waiting for; the UI stays
+        responsive, and the task continues in its done callable. Invoking
+        the plugin again allows for cancelling it, see :func:`taskRunning`.
     """
-    resultset = []
-    for p in packets:
-        name = p["path"].split("/")[1]
-        if name not in resultset:
-            resultset.append(name)
-    resultset.sort()
-    return resultset
+    global currentTask
+    currentTask = task
+    currentTask.description = message
+    currentTask.start()
+    Message("{} Press Ctrl-Shift-B to cancel\n".format(message))
+
+
+def splitCodec(filename):
+    """ Returns the name of a file without the suffix of its compression
+        codec and the codec itself (None if it is not compressed).
+    """
+    base, ext = os.path.splitext(filename)
+    if ext in codecs:
+        return base, codecs[ext]
+    return filename, None
+
+
+def streamDecompress(resp, codec, fileobj, task=None):
+    """ Writes the body of a streamed response into a file while
+        decompressing it, so that the file is never held in memory.
+        The download stops between two chunks if the task is cancelled.
+    """
+    if codec == "zstd":
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    elif codec == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    else:
+        decompressor = None
+
+    for chunk in resp.raw.stream(1 << 20, decode_content=False):
+        if task is not None:
+            task.check()
+        fileobj.write(decompressor.decompress(chunk)
+                      if decompressor is not None else chunk)
+    if codec == "gzip":
+        fileobj.write(decompressor.flush())
+
+
+def downloadFiles(task, downloads):
+    """ Background work that downloads the selected IDBs.
+
+        :param downloads: list of (url, local path, codec) tuples
+    """
+    for i, (url, local_path, codec) in enumerate(downloads):
+        task.check()
+        task.message("[{}/{}] Downloading {}...".format(
+            i + 1, len(downloads), os.path.basename(local_path)))
+        resp = requests.get(url, stream=True, verify=False)
+
+        # handle the response; the file is written under a temporary
+        # name first so that an aborted download is not mistaken
+        # for a complete one
+        try:
+            if resp.status_code != 200:
+                text = resp.text
+                task.post(lambda: Warning(
+                    "Server did not respond with status 200. Message:\n" +
+                    text))
+                continue
+            try:
+                with open(local_path + ".part", "wb") as f:
+                    streamDecompress(resp, codec, f, task)
+            except DownloadCancelled:
+                os.remove(local_path + ".part")
+                raise
+            if os.path.exists(local_path):
+                os.remove(local_path)
+            os.rename(local_path + ".part", local_path)
+        finally:
+            resp.close()
+
+
+def crc(text):
+    """ Returns the CRC32 of a string as unsigned number. """
+    if not isinstance(text, bytes):
+        text = text.encode("utf-8")
+    return zlib.crc32(text) & 0xffffffff
+
+
+def databaseFeatures():
+    """ Returns the features of the open database, exactly like
+        bindifflib_exporter.py computes them for the published databases.
+    """
+    strings = set(crc(str(s)) for s in Strings()
+                  if s.length >= MIN_STRING_LENGTH)
+
+    imports = set()
+    for i in range(idaapi.get_import_module_qty()):
+        module = (idaapi.get_import_module_name(i) or "").lower()
+        if module.endswith(".dll"):
+            module = module[:-len(".dll")]
+
+        def add(ea, name, ordinal):
+            if name:
+                imports.add(crc("{}!{}".format(module, name)))
+            return True
+        idaapi.enum_import_names(i, add)
+
+    functions = set()
+    for f in Functions():
+        items = list(FuncItems(f))
+        if len(items) >= MIN_FUNCTION_ITEMS:
+            functions.add(crc(" ".join(GetMnem(ea) for ea in items)))
+
+    return {
+        "version": FEATURES_VERSION,
+        "strings": strings,
+        "imports": imports,
+        "functions": functions,
+    }
+
+
+def fetchFeatures(entry):
+    """ Returns the features of a published database, or None if they are
+        missing or were computed by another version of the exporter. They
+        are cached locally; the checksum of the artifact (or its time of
+        modification or size, for entries without one) is part of the name
+        of the cached file, so that the features of a re-exported database
+        are fetched again.
+    """
+    version = (entry.get("sha1") or entry.get("modified") or
+               entry.get("size") or 0)
+    local = os.path.join(featureCacheDir, "{}_{}".format(
+        entry["path"].replace("/", "_"),
+        re.sub(r"[^0-9A-Za-z.-]", "_", str(version))))
+    if not os.path.exists(local):
+        resp = requests.get(repoPath + entry["path"], stream=True,
+                            verify=False, auth=auth)
+        try:
+            if resp.status_code != 200:
+                return None
+            if not os.path.exists(featureCacheDir):
+                os.makedirs(featureCacheDir)
+            with open(local + ".part", "wb") as f:
+                streamDecompress(resp, entry["codec"], f)
+            if os.path.exists(local):
+                os.remove(local)
+            os.rename(local + ".part", local)
+        finally:
+            resp.close()
+    try:
+        with open(local, "r") as f:
+            features = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if features.get("version") != FEATURES_VERSION:
+        return None
+    return features
+
+
+def fetchCandidates(task, libraries, packets):
+    """ Background work that fetches the features of all published
+        databases. Returns a list of (candidate, features, files) tuples;
+        a candidate is a (name, version, compiler, file) tuple, the files
+        are the manifest entries of the library built with the compiler.
+    """
+    candidates = []
+    for name in sorted(libraries):
+        task.check()
+        if packets is None:
+            manifest = fetchJson(libraries[name]["manifest"])
+        else:
+            manifest = manifestFromPackets(packets, name)
+        if not manifest:
+            continue
+        for version, compilers in manifest["versions"].items():
+            for compiler, files in compilers.items():
+                for entry in files:
+                    if not entry["file"].endswith(".features.json"):
+                        continue
+                    task.check()
+                    features = fetchFeatures(entry)
+                    if features is None:
+                        continue
+                    base = entry["file"][:-len(".features.json")]
+                    candidates.append(((name, version, compiler, base),
+                                       features, files))
+    return candidates
+
+
+def rankCandidates(target, candidates):
+    """ Ranks the published databases by their similarity to the features
+        of the open database. For every kind of features, the score of a
+        candidate is the share of its features found in the open database,
+        so that a library linked into a larger binary still scores high.
+        Every feature is weighted by how rare it is among the candidates,
+        so that the runtime functions and strings all libraries share count
+        little. Returns a list of (score, candidate, files) tuples, best
+        first.
+    """
+    frequency = {}
+    for _, features, _ in candidates:
+        for kind in FEATURE_WEIGHTS:
+            for h in set(features.get(kind, [])):
+                frequency[(kind, h)] = frequency.get((kind, h), 0) + 1
+
+    total = float(len(candidates))
+    ranking = []
+    for candidate, features, files in candidates:
+        score = 0.0
+        weights = 0.0
+        for kind, weight in FEATURE_WEIGHTS.items():
+            hashes = set(features.get(kind, []))
+            if not hashes or not target[kind]:
+                continue
+            rarity = dict((h, math.log(1 + total / frequency[(kind, h)]))
+                          for h in hashes)
+            common = sum(rarity[h] for h in hashes & target[kind])
+            score += weight * common / sum(rarity.values())
+            weights += weight
+        if weights:
+            ranking.append((score / weights, candidate, files))
+    ranking.sort(key=lambda r: r[0], reverse=True)
+    return ranking
+
+
+def idbDownload(entry, libpath, short):
+    """ Returns the download of an IDB listed in a manifest as (url, local
+        path, codec) tuple, or None if it is no IDB or already present.
+    """
+    # we only need i64/idb files, which may be compressed
+    path, ext = os.path.splitext(entry["file"])
+    if ext not in [".i64", ".idb"]:
+        return None
+
+    # construct local paths
+    local_filename = "{}_{}{}".format(path, short, ext)
+    local_path = os.path.join(libpath, local_filename)
+
+    # skip if library was already downloaded
+    if os.path.exists(local_path) and os.path.getsize(local_path) != 0:
+        print("{} already present".format(local_filename))
+        return None
+
+    if entry["codec"] == "zstd" and zstandard is None:
+        Warning("{} is zstd compressed, please install the "
+                "zstandard module".format(entry["path"]))
+        return None
 
+    return (repoPath + entry["path"], local_path, entry["codec"])
 
-def getPacketVersions(packets):
-    """ Return a unified list of version for the given list of packages. """
-    resultset = []
-    for packet in packets:
-        v = packet["path"].split("/")[2]
-        if v not in resultset:
-            resultset.append(v)
-    resultset.sort()
-    return resultset
+
+def makeLibPath(name, version):
+    """ Creates and returns the local folder of a library version. """
+    libpath = os.path.join(bindifflibhome, name, version)
+    try:
+        os.makedirs(libpath)
+    except:
+        # folder already exists
+        pass
+    return libpath
+
+
+def startDownload(downloads, libpath):
+    """ Downloads IDBs in the background; the analyst can keep working and
+        cancel the download by invoking the plugin again.
+    """
+    startTask(BackgroundTask(
+        lambda task: downloadFiles(task, downloads),
+        lambda _: Message("Done. Files saved to folder {}\n".format(libpath))),
+        "Downloading {} files in the background.".format(len(downloads)))
+
+
+def taskRunning():
+    """ Checks whether a query or a download is running; only one runs at a
+        time, invoking the plugin again allows for cancelling it.
+    """
+    # callables left behind by tasks on IDA versions without timers
+    runPending()
+    if currentTask is not None and currentTask.is_alive():
+        if AskYN(0, "{} Cancel it?".format(currentTask.description)) == 1:
+            currentTask.cancelled.set()
+        return True
+    return False
+
+
+def loadLibraries(then):
+    """ Loads the library list and continues with it, unless it cannot be
+        queried.
+
+        :param then: callable that receives the library list on the UI
+            thread
+    """
+    global packetCache
+
+    # the chooser is populated from the cached library list at once while
+    # the list is refreshed in the background; only without any cached list
+    # we have to wait for the artifactory
+    if packetCache is None:
+        packetCache = loadPacketCache()
+        if packetCache is not None:
+            BackgroundTask(refreshPackets, packetsRefreshed).start()
+    if packetCache is not None:
+        then(packetCache)
+        return
+
+    def loaded(cache):
+        global packetCache
+        if not cache:
+            Warning("Could not get the list of libraries")
+            return
+        packetCache = cache
+        then(cache)
+    startTask(BackgroundTask(refreshPackets, loaded),
+              "Querying the artifactory...")
+
+
+def rank():
+    """ Ranks the published libraries by their similarity to the open
+        database and downloads the IDB of the selected candidate.
+    """
+    if taskRunning():
+        return
+    loadLibraries(rankLibraries)
+
+
+def rankLibraries(cache):
+    """ Fetches the features of all libraries for :func:`rank`. """
+    libraries = cache["index"]["libraries"]
+    packets = cache["packets"]
+
+    Message("Computing the features of the database...\n")
+    target = databaseFeatures()
+    startTask(BackgroundTask(
+        lambda task: fetchCandidates(task, libraries, packets),
+        lambda candidates: chooseCandidate(target, candidates)),
+        "Fetching the features of the libraries...")
+
+
+def chooseCandidate(target, candidates):
+    """ Shows the ranking of :func:`rank` and downloads the IDB of the
+        selected candidate.
+    """
+    if not candidates:
+        Warning("No features found, the libraries have to be re-exported "
+                "with the current exporter")
+        return
+
+    ranking = rankCandidates(target, candidates)[:rankedCandidates]
+    rows = ["{:.2f}  {}  {}  {}  {}".format(score, *candidate)
+            for score, candidate, _ in ranking]
+    choice = CandidateChooser(rows).choose()
+    if not choice:
+        return
+
+    _, (name, version, short, base), files = ranking[choice - 1]
+    libpath = makeLibPath(name, version)
+    downloads = []
+    for entry in files:
+        if os.path.splitext(entry["file"])[0] != base:
+            continue
+        download = idbDownload(entry, libpath, short)
+        if download is not None:
+            downloads.append(download)
+
+    if not downloads:
+        Message("Nothing to download. Files are in folder {}\n".format(libpath))
+        return
+    startDownload(downloads, libpath)
 
 
 def main():
-    # get all packages from server and extracts the names
-    packets = queryPackets()
-    names = getPacketNames(packets)
+    if taskRunning():
+        return
+    loadLibraries(chooseLibrary)
+
+
+def chooseLibrary(cache):
+    """ Asks for the library and version to download for :func:`main`. """
+    libraries = cache["index"]["libraries"]
+    names = sorted(libraries)
 
     # ask for the library to download
     chooser = NameChooser(names)
@@ -114,14 +698,9 @@ def main():
 
     name = names[choice - 1]
 
-    # filter out all packets that don't match the name
-    filtered_packets = getPacketsByName(packets, name)
-    if not filtered_packets:
-        return
-
     # get list of available versions and ask the user
     # which one to use
-    versions = getPacketVersions(filtered_packets)
+    versions = libraries[name]["versions"]
     chooser = VersionChooser(versions)
     selection = chooser.choose()
     if not selection:
@@ -130,58 +709,46 @@ def main():
 
     version = versions[selection - 1]
 
+    # the manifest of the library lists the exact files of every version
+    # and compiler
+    if cache["packets"] is None:
+        startTask(BackgroundTask(
+            lambda task: fetchJson(libraries[name]["manifest"]),
+            lambda manifest: downloadVersion(name, version, manifest)),
+            "Loading the file list of {}...".format(name))
+    else:
+        downloadVersion(name, version,
+                        manifestFromPackets(cache["packets"], name))
+
+
+def downloadVersion(name, version, manifest):
+    """ Downloads the IDBs of a library version for all compilers. """
+    if not manifest or version not in manifest["versions"]:
+        Warning("Could not get the file list of {}-{}".format(name, version))
+        return
+    files = manifest["versions"][version]
+
     # construct the local path of the library
-    libpath = os.path.join(bindifflibhome, name, version)
-    try:
-        os.makedirs(libpath)
-    except:
-        # folder already exists
-        pass
+    libpath = makeLibPath(name, version)
 
     # parse list of compilers
     compilers = yaml.load(open(compiler_file, "rb").read())
 
-    # iterate through list of packages (filtered by version)
-    for p in filterPackagesByVersion(filtered_packets, versions[selection - 1]):
-        # we only need i64/idb files
-        if os.path.splitext(p["name"])[1] in [".i64", ".idb"]:
-            # construct remote path
-            remote_file = p["path"] + "/" + p["name"]
-
-            # we need to download a library for all given compilers
-            for _, c in compilers.items():
-                if c["short"] not in p["path"]:
-                    # skip if there's no remote library for the compiler
-                    continue
-
-                # construct local paths
-                path, ext = os.path.splitext(p["name"])
-                local_filename = "{}_{}{}".format(path, c["short"], ext)
-                local_path = os.path.join(libpath, local_filename)
-
-                # skip if library was already downloaded
-                if (os.path.exists(local_path) and
-                        os.path.getsize(local_path) is not 0):
-                    print("{} already present".format(local_filename))
-                    continue
-
-                # initiate download from artifactory
-                print("Downloading {}...".format(local_filename))
-                resp = requests.get(
-                    repoPath + "/" + p["path"] + "/" + p["name"],
-                    stream=True, verify=False)
-
-                # handle the response
-                try:
-                    if resp.status_code is not 200:
-                        Warning("Server did not respond with status 200. Message:\n" + data)
-                    else:
-                        with open(local_path, "wb") as f:
-                            f.write(resp.raw.read())
-                except:
-                    Warning("Error!")
-
-    Message("Done. Files saved to folder {}".format(libpath))
+    # we need to download a library for all given compilers and collect
+    # the files to download
+    downloads = []
+    for _, c in compilers.items():
+        # there is nothing if there's no remote library for the compiler
+        for entry in files.get(c["short"], []):
+            download = idbDownload(entry, libpath, c["short"])
+            if download is not None:
+                downloads.append(download)
+
+    if not downloads:
+        Message("Nothing to download. Files are in folder {}\n".format(libpath))
+        return
+
+    startDownload(downloads, libpath)
 
 if __name__ == "__main__":
     # we try to setup a hotkey to make re-running the script easier
@@ -189,5 +756,8 @@ if __name__ == "__main__":
         Message("Failed to set hotkey, please re-run this script to download other IDBs")
     else:
         Message("Hotkey registered, press Ctrl-Shift-B to download another library")
+    if add_hotkey("Ctrl-Shift-R", rank) is not None:
+        Message("Press Ctrl-Shift-R to rank the libraries by their similarity "
+                "to this database")
 
     main()
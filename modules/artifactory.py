@@ -0,0 +1,267 @@
+import hashlib
+import shutil
+import gzip
+import json
+import os
+from datetime import datetime
+from tempfile import TemporaryFile
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+from base64 import b64encode
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# file name suffixes of the supported compression codecs
+CODECS = {
+    "zstd": ".zst",
+    "gzip": ".gz",
+}
+
+
+class Artifactory(object):
+    """ Small wrapper around the REST interface of the artifactory. Only
+        plain GET and PUT requests are used, so any HTTP server that accepts
+        PUT uploads can stand in for the artifactory (e.g. for testing).
+        Only the retention (see :class:`Retention`) lists, deletes and moves
+        artifacts with the storage, DELETE and move APIs.
+    """
+
+    def __init__(self, path, auth):
+        """ Initializes an instance of this class.
+
+            :param path: the URL base path of the repository in the
+                artifactory, including a trailing slash
+            :param auth: HTTP basic auth tokens for the artifactory
+        """
+        super(Artifactory, self).__init__()
+        self._path = path
+        self._auth = auth
+
+    @property
+    def path(self):
+        return self._path
+
+    def url(self, remotePath):
+        """ Returns the full URL of a path within the repository. """
+        return self._path + remotePath.lstrip("/")
+
+    def _api(self, endpoint, remotePath):
+        """ Returns the URL of a REST API endpoint for a path within the
+            repository, e.g. "storage".
+        """
+        base, repo = self._path.rstrip("/").rsplit("/", 1)
+        return "{}/api/{}/{}/{}".format(base, endpoint, repo,
+                                        remotePath.strip("/"))
+
+    def list(self, remotePath):
+        """ Lists all files below a folder with a single request. Returns a
+            list of dictionaries with "path" (within the repository), "size",
+            "sha1" and "modified" (seconds since the epoch), or an empty list
+            if the folder does not exist.
+
+            :param remotePath: the path of the folder within the repository
+        """
+        r = Request(self._api("storage", remotePath) +
+                    "?list&deep=1&listFolders=0", headers=self._headers())
+        try:
+            with urlopen(r) as response:
+                data = json.loads(response.read().decode("utf-8"))
+        except HTTPError as e:
+            if e.code == 404:
+                return []
+            raise
+
+        files = []
+        for entry in data.get("files", []):
+            if entry.get("folder", False):
+                continue
+            modified = entry.get("lastModified", None)
+            files.append({
+                "path": remotePath.strip("/") + entry["uri"],
+                "size": entry.get("size", 0),
+                "sha1": entry.get("sha1", None),
+                # e.g. 2019-01-01T10:00:00.000+0000 or ...000Z
+                "modified": (datetime.strptime(
+                    modified, "%Y-%m-%dT%H:%M:%S.%f%z").timestamp()
+                    if modified else None),
+            })
+        return files
+
+    def delete(self, remotePath):
+        """ Deletes a file or a whole folder. Returns False if it does not
+            exist.
+
+            :param remotePath: the path within the repository
+        """
+        try:
+            urlopen(Request(self.url(remotePath), headers=self._headers(),
+                            method="DELETE")).close()
+            return True
+        except HTTPError as e:
+            if e.code == 404:
+                return False
+            raise
+
+    def move(self, remotePath, targetRepo):
+        """ Moves a file or a whole folder to the same path in another
+            repository, e.g. an archive on cheaper storage.
+
+            :param remotePath: the path within the repository
+            :param targetRepo: the name of the target repository
+        """
+        url = "{}?to=/{}/{}".format(self._api("move", remotePath),
+                                    targetRepo, remotePath.strip("/"))
+        urlopen(Request(url, headers=self._headers(), data=b"",
+                        method="POST")).close()
+
+    def _headers(self):
+        """ Returns the headers needed by every request, most importantly
+            the HTTP basic auth.
+        """
+        return {
+            "Authorization": "Basic {}".format(
+                b64encode(":".join(self._auth).encode()).decode("ascii")),
+        }
+
+    def put(self, remotePath, data):
+        """ Uploads a binary blob to the given path.
+
+            :param remotePath: the path of the file within the repository
+            :param data: the binary contents of the file
+        """
+        # construct the PUT header, e.g. MD5 and SHA-1 hashes
+        # of the file so that the artifactory can verify the upload
+        headers = self._headers()
+        headers.update({
+            "Content-Type": "application/octet-stream",
+            "X-Checksum-md5": hashlib.md5(data).hexdigest(),
+            "X-Checksum-sha1": hashlib.sha1(data).hexdigest(),
+        })
+
+        r = Request(self.url(remotePath), headers=headers, data=data,
+                    method="PUT")
+        urlopen(r).close()
+
+    def _putStream(self, remotePath, fileobj, properties=None):
+        """ Uploads the contents of a seekable file object without reading
+            it into memory at once. Returns the SHA-1 of the contents.
+
+            :param remotePath: the path of the file within the repository
+            :param fileobj: a file object opened for binary reading
+            :param properties: (optional) dictionary of artifact properties,
+                which are set by the artifactory from matrix parameters
+        """
+        md5 = hashlib.md5()
+        sha1 = hashlib.sha1()
+        size = 0
+        for chunk in iter(lambda: fileobj.read(1 << 20), b""):
+            md5.update(chunk)
+            sha1.update(chunk)
+            size += len(chunk)
+        fileobj.seek(0)
+
+        headers = self._headers()
+        headers.update({
+            "Content-Type": "application/octet-stream",
+            "Content-Length": str(size),
+            "X-Checksum-md5": md5.hexdigest(),
+            "X-Checksum-sha1": sha1.hexdigest(),
+        })
+
+        url = self.url(remotePath)
+        for key, value in sorted((properties or {}).items()):
+            url += ";{}={}".format(key, value)
+
+        r = Request(url, headers=headers, data=fileobj, method="PUT")
+        urlopen(r).close()
+        return sha1.hexdigest()
+
+    @staticmethod
+    def compress(src, dst, codec, level=None):
+        """ Compresses a file object into another one.
+
+            :param src: a file object opened for binary reading
+            :param dst: a file object opened for binary writing
+            :param codec: the codec, see CODECS
+            :param level: (optional) the compression level
+        """
+        if codec == "zstd":
+            compressor = zstandard.ZstdCompressor(
+                level=level if level is not None else 10)
+            compressor.copy_stream(src, dst)
+        elif codec == "gzip":
+            with gzip.GzipFile(fileobj=dst, mode="wb",
+                               compresslevel=level if level is not None
+                               else 6) as f:
+                shutil.copyfileobj(src, f, 1 << 20)
+        else:
+            raise ValueError("Unknown codec {}".format(codec))
+
+    def putFile(self, remotePath, filename, codec=None, level=None,
+                properties=None):
+        """ Uploads a local file to the given path, optionally compressed.
+            The codec is appended to the file name and recorded in the
+            "codec" property of the artifact. Returns the path the file
+            was stored at and the SHA-1 of the stored artifact.
+
+            :param remotePath: the path of the file within the repository
+            :param filename: the path of the local file
+            :param codec: (optional) the compression codec, see CODECS;
+                falls back to gzip if zstandard is not installed
+            :param level: (optional) the compression level
+            :param properties: (optional) dictionary of additional
+                artifact properties
+        """
+        if codec == "zstd" and zstandard is None:
+            codec = "gzip"
+        properties = dict(properties or {})
+
+        with open(filename, "rb") as f:
+            if codec is None:
+                return remotePath, self._putStream(remotePath, f, properties)
+
+            with TemporaryFile() as tmp:
+                self.compress(f, tmp, codec, level)
+                tmp.seek(0)
+                remotePath += CODECS[codec]
+                properties.update({
+                    "codec": codec,
+                    "size": os.path.getsize(filename),
+                })
+                return remotePath, self._putStream(remotePath, tmp,
+                                                   properties)
+
+    def get(self, remotePath):
+        """ Downloads a file and returns its contents, or None if the
+            file does not exist.
+
+            :param remotePath: the path of the file within the repository
+        """
+        try:
+            r = Request(self.url(remotePath), headers=self._headers())
+            with urlopen(r) as response:
+                return response.read()
+        except HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def download(self, remotePath, fileobj):
+        """ Streams a file into an open file object. Returns False if the
+            file does not exist.
+
+            :param remotePath: the path of the file within the repository
+            :param fileobj: a file object opened for binary writing
+        """
+        try:
+            r = Request(self.url(remotePath), headers=self._headers())
+            with urlopen(r) as response:
+                shutil.copyfileobj(response, fileobj)
+            return True
+        except HTTPError as e:
+            if e.code == 404:
+                return False
+            raise
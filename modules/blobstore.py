@@ -0,0 +1,166 @@
+import hashlib
+import os
+import shutil
+import stat
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request to clone a file on copy-on-write file systems, e.g. Btrfs
+# and XFS; it only exists on Linux. Elsewhere the ioctl fails (or fcntl is
+# missing, e.g. on Windows) and a plain copy is made instead
+FICLONE = 0x40049409
+
+
+class BlobStore(object):
+    """ Content-addressed store for extracted source files. Every distinct
+        file is stored once and the source trees of all library versions
+        are made of hardlinks to the stored files. Since adjacent versions
+        of a library share most of their files, this saves disk and page
+        cache space.
+
+        All trees share the same inodes, so a file of a tree must never be
+        modified in place; it has to be replaced (see :meth:`detach`). The
+        writes of bindifflib itself are safe: remove_files_from only drops
+        links, a custom CMake file replaces the CMakeLists.txt, and PDBs and
+        databases are written to the binary trees, which are not part of the
+        store. Custom build scripts that patch sources have to detach them
+        first.
+
+        No lock is needed between :meth:`ingest` and :meth:`prune`: a file
+        is linked into its tree before it becomes a blob, so a blob never has
+        a single link while it is in use.
+    """
+
+    def __init__(self, path):
+        """ Initializes an instance of this class.
+
+            :param path: the directory where the blobs are stored; must be
+                on the same volume as the extracted sources for hardlinks
+                to work
+        """
+        super(BlobStore, self).__init__()
+        self._path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _blobPath(self, filename):
+        """ Hashes a file and returns the path of its blob. The executable
+            bit is part of the key because it is shared by all links.
+        """
+        h = hashlib.sha1()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        if os.stat(filename).st_mode & stat.S_IXUSR:
+            digest += "x"
+        return os.path.join(self._path, digest[:2], digest)
+
+    @staticmethod
+    def _clone(src, dst):
+        """ Creates a copy of a file, sharing the data blocks if the file
+            system supports copy-on-write clones.
+        """
+        if fcntl is not None:
+            try:
+                with open(src, "rb") as s, open(dst, "wb") as d:
+                    fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+                shutil.copystat(src, dst)
+                return
+            except OSError:
+                pass
+        shutil.copy2(src, dst)
+
+    def _link(self, path, blob, target):
+        """ Materializes a file at the target path, using a hardlink to its
+            blob or a copy-on-write clone if hardlinks are not possible (e.g.
+            another volume or the link limit of the file system is reached).
+            If there is no blob yet, e.g. because :meth:`prune` removed it
+            meanwhile, the file is moved to the target and becomes the blob.
+
+            :param path: the path of the extracted file, which is consumed
+            :param blob: the path of its blob
+            :param target: the path of the file within the tree
+        """
+        try:
+            os.link(blob, target)
+            return
+        except FileNotFoundError:
+            pass
+        except OSError:
+            self._clone(blob, target)
+            return
+
+        # the file is part of the tree first, so the blob has two links from
+        # the moment it exists on
+        os.replace(path, target)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(target, blob)
+        except OSError:
+            # another run stored the same file meanwhile, or the link limit
+            # is reached; this tree just keeps a private copy
+            pass
+
+    def ingest(self, src, dst):
+        """ Moves all files of the tree src into the store and materializes
+            the tree at dst. The tree appears at dst atomically, i.e. an
+            interrupted run never leaves a partial tree behind.
+
+            :param src: the directory of the freshly extracted tree; it is
+                consumed by this call
+            :param dst: the final directory of the tree
+        """
+        partial = dst.rstrip("/\\") + ".partial"
+        if os.path.exists(partial):
+            shutil.rmtree(partial)
+
+        for root, dirs, files in os.walk(src):
+            target = os.path.join(partial, os.path.relpath(root, src))
+            os.makedirs(target, exist_ok=True)
+
+            for d in dirs:
+                path = os.path.join(root, d)
+                if os.path.islink(path):
+                    os.symlink(os.readlink(path), os.path.join(target, d))
+
+            for f in files:
+                path = os.path.join(root, f)
+                if os.path.islink(path):
+                    os.symlink(os.readlink(path), os.path.join(target, f))
+                    continue
+
+                self._link(path, self._blobPath(path),
+                           os.path.join(target, f))
+
+        shutil.rmtree(src)
+        os.rename(partial, dst)
+
+    @staticmethod
+    def detach(path):
+        """ Replaces a file by a private copy so that it can be modified
+            without changing the other trees sharing its blob.
+
+            :param path: the path of the file within an extracted tree
+        """
+        if os.path.isfile(path) and os.stat(path).st_nlink > 1:
+            tmp = path + ".detach"
+            shutil.copy2(path, tmp)
+            os.replace(tmp, path)
+
+    def prune(self):
+        """ Removes all blobs that are not referenced by any tree anymore
+            and returns the number of bytes freed.
+        """
+        freed = 0
+        for root, _, files in os.walk(self._path):
+            for f in files:
+                path = os.path.join(root, f)
+                st = os.stat(path)
+                if st.st_nlink == 1:
+                    os.remove(path)
+                    freed += st.st_size
+        return freed
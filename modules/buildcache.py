@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import shutil
+from tempfile import TemporaryFile
+from zipfile import ZipFile, ZIP_DEFLATED
+from .artifactory import Artifactory
+
+
+class BuildCache(object):
+    """ Remote cache for build outputs. The install tree of every successful
+        build is stored as a zip archive in the artifactory under a
+        deterministic key, so that other machines (or later runs) can
+        download it instead of compiling the library again.
+    """
+
+    def __init__(self, artifactoryPath, auth, prefix="buildcache/"):
+        """ Initializes an instance of this class.
+
+            :param artifactoryPath: the URL base path for the artifactory
+            :param auth: HTTP basic auth tokens for the artifactory
+            :param prefix: (optional) path prefix within the repository
+                where the cached builds are stored
+        """
+        super(BuildCache, self).__init__()
+        self._artifactory = Artifactory(artifactoryPath, auth)
+        self._prefix = prefix
+
+    def key(self, libs, name, version, compiler, launcher=None):
+        """ Computes the build key of a library. The key covers everything
+            that influences the build output: the source archive, the
+            compiler and its launcher, all build flags and scripts and,
+            transitively, the keys of all dependencies. Returns None if the
+            key cannot be computed, e.g. because the source hash is unknown.
+
+            Builds seeded by the :class:`ConfigureCache` must not be
+            stored, as their toolchain probes are not part of the key.
+
+            :param libs: the global dictionary of libraries
+            :param name: the name of the library
+            :param version: the version of the library
+            :param compiler: information about the compiler, as provided
+                in compilers.yml
+            :param launcher: (optional) the path of the compiler launcher
+                of the :class:`CompilerCache`
+        """
+        lib = libs[name][version]
+        if not lib.get("sourcehash"):
+            return None
+
+        # hash the custom CMake file instead of its path so that changes
+        # to the file invalidate the cached builds
+        customcmake = None
+        if lib["customcmake"]:
+            with open(lib["customcmake"], "rb") as f:
+                customcmake = hashlib.sha1(f.read()).hexdigest()
+
+        dependencies = {}
+        if lib["dependencies"] is not None:
+            for depname, depversion in lib["dependencies"].items():
+                depkey = self.key(libs, depname, depversion, compiler,
+                                  launcher)
+                if depkey is None:
+                    return None
+                dependencies[depname] = depkey
+
+        data = {
+            "source": lib["sourcehash"],
+            "compiler": {
+                "generator": compiler["generator"],
+                "short": compiler["short"],
+                "version": compiler["version"],
+            },
+            "cmakeflags": lib["cmakeflags"],
+            "custombuild": lib["custombuild"],
+            "customcmake": customcmake,
+            "remove_files_from": lib.get("remove_files_from"),
+            # the kind of the launcher, e.g. ccache or sccache; where it is
+            # installed does not matter
+            "launcher": (os.path.basename(launcher).lower()
+                         if launcher else None),
+            "dependencies": dependencies,
+        }
+
+        return hashlib.sha1(
+            json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def _remotePath(self, name, version, compiler, key):
+        """ Returns the path of a cached build within the repository. """
+        return "{prefix}{name}/{version}/{compiler}/{key}.zip".format(
+            prefix=self._prefix, name=name, version=version,
+            compiler=compiler["short"], key=key)
+
+    def fetch(self, name, version, compiler, key, binpath):
+        """ Downloads a cached build and unpacks it into the binpath.
+            Returns True on a cache hit.
+
+            :param name: the name of the library
+            :param version: the version of the library
+            :param compiler: information about the compiler
+            :param key: the build key as returned by :meth:`key`
+            :param binpath: the directory where the binaries will be stored
+        """
+        with TemporaryFile() as tmp:
+            try:
+                if not self._artifactory.download(
+                        self._remotePath(name, version, compiler, key), tmp):
+                    return False
+            except Exception as e:
+                print("Build cache lookup for {}-{}_{} failed: {}".format(
+                    name, version, compiler["short"], e))
+                return False
+
+            tmp.seek(0)
+            # the tree is unpacked next to the binpath and renamed, so that
+            # other runs never see a partial tree
+            staging = os.path.join(os.path.dirname(binpath), ".staging",
+                                   os.path.basename(binpath))
+            if os.path.exists(staging):
+                shutil.rmtree(staging)
+            with ZipFile(tmp) as archive:
+                archive.extractall(staging)
+            # remove leftovers of a previous, possibly broken build
+            if os.path.exists(binpath):
+                shutil.rmtree(binpath)
+            os.rename(staging, binpath)
+
+        return True
+
+    def store(self, name, version, compiler, key, binpath):
+        """ Packs the install tree of a build and uploads it to the cache.
+
+            :param name: the name of the library
+            :param version: the version of the library
+            :param compiler: information about the compiler
+            :param key: the build key as returned by :meth:`key`
+            :param binpath: the directory where the binaries are stored
+        """
+        with TemporaryFile() as tmp:
+            with ZipFile(tmp, "w", ZIP_DEFLATED) as archive:
+                for root, _, files in os.walk(binpath):
+                    for f in files:
+                        path = os.path.join(root, f)
+                        # IDA databases are not part of the build output
+                        if os.path.splitext(f)[1] in [".idb", ".i64"]:
+                            continue
+                        archive.write(path, os.path.relpath(path, binpath))
+
+            tmp.seek(0)
+            try:
+                self._artifactory.put(
+                    self._remotePath(name, version, compiler, key), tmp.read())
+            except Exception as e:
+                print("Could not store {}-{}_{} in the build cache: {}".format(
+                    name, version, compiler["short"], e))
@@ -1,9 +1,31 @@
 import subprocess
 import os
+import time
 import shutil
+import copy
+from contextlib import nullcontext
 from glob import glob
 from tempfile import mkstemp
+from .debuginfo import matchPdb
 from .dependency import Internal
+from .diskbudget import DiskBudget
+from .filelock import FileLock
+from .supervisor import ProcessError
+
+
+# states of a build, stored as "status" in the library list
+BUILT = "built"
+FAILED = "failed"
+CANCELLED = "cancelled"
+UNSUPPORTED = "unsupported"
+
+# marker file in a binary tree whose build did not finish yet; the tree is
+# published by removing it
+PARTIAL_MARKER = ".bindifflib-partial"
+
+# stops a batch file at the first failing command so that its exit code
+# tells whether the build succeeded
+ERRORLEVEL_CHECK = "if errorlevel 1 exit /b %errorlevel%\n"
 
 
 class BuildWrapper(object):
@@ -13,11 +35,23 @@ class BuildWrapper(object):
     """
 
     def __init__(self, internals=[], isDependencyWrapper=False,
-                 dependencyList=None, libs=None):
+                 dependencyList=None, libs=None, **options):
+        """ Initializes an instance of this class.
+
+            :param internals: list of :class:`Internal` objects to build
+            :param isDependencyWrapper: denotes whether the wrapper builds
+                the dependencies of another library
+            :param dependencyList: dictionary of names and versions of the
+                dependencies, only used for dependency wrappers
+            :param libs: the global dictionary of libraries
+            :param options: keyword arguments that are passed on to every
+                :class:`Task`, see there
+        """
         super(BuildWrapper, self).__init__()
         self._internals = internals
         self._libs_orig = libs
         self._isDependencyWrapper = isDependencyWrapper
+        self._options = options
 
         if isDependencyWrapper:
             tmp = []
@@ -37,20 +71,50 @@ class BuildWrapper(object):
     def binPaths(self):
         return self._binPaths
 
+    def tasksFor(self, compiler):
+        """ Returns a :class:`Task` for every library of the wrapper, in
+            the order of the internals. The tasks of a top-level wrapper
+            share a private copy of the library list.
+
+            :param compiler: information about the compiler, as provided
+                in compilers.yml
+        """
+        if self._isDependencyWrapper:
+            # dependency builds have to update the library list of the
+            # task that depends on them
+            libs = self._libs_orig
+            internals = self._internals
+        else:
+            # every compiler needs a private copy of the library list,
+            # which is updated during the build
+            libs = copy.deepcopy(self._libs_orig)
+            internals = [Internal(lib=libs[item.name][item.version],
+                                  name=item.name, version=item.version,
+                                  dependencies=item.dependencies)
+                         for item in self._internals]
+
+        return [Task(item, compiler, libs, **self._options)
+                for item in internals]
+
     def compileFor(self, compiler, cmake):
         self._binPaths = []
 
-        libs = dict(self._libs_orig)
-        for item in self._internals:
-            Task(item, compiler, libs).compile(
-                cmake=cmake, isDep=self._isDependencyWrapper)
-            self._binPaths.append(item.lib["binpath"])
+        tasks = self.tasksFor(compiler)
+        for task in tasks:
+            task.compile(cmake=cmake, isDep=self._isDependencyWrapper)
+            self._binPaths.append(task.lib["binpath"])
+
+        # return the outcome of every build for the end-of-run summary
+        return [task.result for task in tasks]
 
 
 class Task(object):
     """ Encapsulates the compile process of a single library. """
 
-    def __init__(self, meta, compiler, libs):
+    def __init__(self, meta, compiler, libs, buildCache=None,
+                 compilerCache=None, diskBudget=None, supervisor=None,
+                 history=None, scratch=None, journal=None,
+                 configureCache=None):
         """
         Initializes a compile task.
 
@@ -59,12 +123,43 @@ class Task(object):
         :param libs: the global dictionary of libraries for the given compiler,
             used to determine which library has already been built to skip possible
             dependency compilation.
+        :param buildCache: (optional) a :class:`BuildCache` that is asked for
+            the build output before compiling and that receives the output
+            of every fresh build
+        :param compilerCache: (optional) a :class:`CompilerCache` whose
+            launcher is used for all compiler calls
+        :param diskBudget: (optional) a :class:`DiskBudget` that releases
+            the build directory after a successful install
+        :param supervisor: (optional) the :class:`ProcessSupervisor` that
+            runs the build scripts; without one, they are run directly
+        :param history: (optional) the :class:`RunHistory` that receives
+            the duration of every build stage
+        :param scratch: (optional) the :class:`ScratchSpace` that holds the
+            build directories if it has room for them
+        :param journal: (optional) the :class:`RunJournal` that records the
+            start and the outcome of every build
+        :param configureCache: (optional) the :class:`ConfigureCache` that
+            seeds the CMake build directories with the toolchain probes of
+            previous configure runs
         """
         super(Task, self).__init__()
         self._meta = meta
         self._basepath = os.getcwd() + "/"
         self._compiler = compiler
         self._libs = libs
+        self._buildCache = buildCache
+        self._compilerCache = compilerCache
+        self._diskBudget = diskBudget
+        self._supervisor = supervisor
+        self._history = history
+        self._scratch = scratch
+        self._journal = journal
+        self._configureCache = configureCache
+        self._options = dict(buildCache=buildCache,
+                             compilerCache=compilerCache,
+                             diskBudget=diskBudget, supervisor=supervisor,
+                             history=history, scratch=scratch,
+                             journal=journal, configureCache=configureCache)
 
     @property
     def name(self):
@@ -86,6 +181,13 @@ class Task(object):
         """ Returns the metadata of the library."""
         return self._meta.lib
 
+    @property
+    def result(self):
+        """ Returns the outcome of the build as a (name, version, compiler,
+            status, reason) tuple."""
+        return (self.name, self.version, self.compiler["short"],
+                self.lib.get("status", None), self.lib.get("reason", None))
+
     def _updateLibList(self, buildpath, binpath):
         """ Updates the realtive paths in the global library list to
             absolute paths so that we are immune against wrong
@@ -102,20 +204,83 @@ class Task(object):
     def _setSuccessfulBuild(self, success):
         """ Set the build status of the current library."""
         self._libs[self.name][self.version]["built"] = success
+        if success:
+            self._setStatus(BUILT)
+
+    def _setStatus(self, status, reason=None):
+        """ Sets the state of the current library, see BUILT, FAILED,
+            CANCELLED and UNSUPPORTED.
+
+            :param status: the new state
+            :param reason: (optional) a message explaining the state
+        """
+        self._libs[self.name][self.version]["status"] = status
+        self._libs[self.name][self.version]["reason"] = reason
+        if status != BUILT:
+            self._libs[self.name][self.version]["built"] = False
+
+    def cancel(self, reason):
+        """ Marks the library as cancelled without building it, e.g.
+            because the build of a dependency failed.
+
+            :param reason: a message explaining the cancellation
+        """
+        if self.lib.get("status") is not None:
+            return
+        self._setStatus(CANCELLED, reason)
+        print("Cancelled {}-{}_{}: {}".format(
+            self.name, self.version, self.compiler["short"], reason))
+
+    def _isDependency(self):
+        """ Checks whether any other library depends on the current one. """
+        for versions in self._libs.values():
+            for lib in versions.values():
+                deps = lib["dependencies"]
+                if deps is not None and deps.get(self.name) == self.version:
+                    return True
+        return False
+
+    def _verifyOutput(self, binpath):
+        """ Verifies the output of a build and returns None on success or
+            a message describing what is missing. Every build has to produce
+            at least one DLL with a matching PDB in binpath/bin, and libraries
+            that others depend on need import libraries as well.
+
+            :param binpath: the directory where the binaries are stored
+        """
+        dlls = glob(binpath + "/bin/*.dll")
+        if not dlls:
+            return "no DLL in {}/bin".format(binpath)
+        if not [dll for dll in dlls if os.path.exists(dll[:-4] + ".pdb")]:
+            return "no DLL with a matching PDB in {}/bin".format(binpath)
+        # some build scripts install the import libraries next to the DLLs
+        if self._isDependency() and not (glob(binpath + "/lib/*.lib") or
+                                         glob(binpath + "/bin/*.lib")):
+            return "no import library in {}/lib".format(binpath)
+        return None
+
+    def _matchPdbs(self, binpath, buildpath):
+        """ Replaces stale PDBs in binpath/bin by the matching ones of the
+            build directory, see :func:`matchPdb`. This has to happen while
+            the build directory exists: a scratch build directory is
+            released right after the build, and cached builds have none.
+
+            :param binpath: the directory where the binaries are stored
+            :param buildpath: the build directory
+        """
+        for dll in glob(binpath + "/bin/*.dll"):
+            matchPdb(dll, dll[:-4] + ".pdb", [buildpath])
 
     def _checkBuildFolderPopulated(self):
-        """ Checks whether there are already some DLLs present in the
+        """ Checks whether the output of a previous build is present in the
             binpath. This allows for skipping the build process if it
             already happened before the current instance of the script
             was run.
         """
         binpath = self._libs[self.name][self.version]["binpath"]
-        if os.path.exists(binpath):
-            dlls = glob(binpath + "/bin/*.dll")
-            if dlls is not None:
-                return True
-            else:
-                return False
+        if os.path.exists(os.path.join(binpath, PARTIAL_MARKER)):
+            return False
+        return self._verifyOutput(binpath) is None
 
     def _formatCommand(self, cmd, binpath, extractedpath, buildpath):
         """ Formats a given command so that we can apply
@@ -130,6 +295,9 @@ class Task(object):
                              built binaries will be stored
             - extractedpath: the full path to the source files
             - buldpath:      the full path to the build directory
+            - launcher:      the full path to the compiler cache launcher,
+                             or an empty string if there is none; allows
+                             for e.g. CC="{launcher} cl" in nmake calls
 
             :param cmd: the command that is to be formatted
             :param binpath: the full path to the doirectory where the binaries
@@ -145,9 +313,174 @@ class Task(object):
             version=self.version,
             binpath=binpath,
             extractedpath=extractedpath,
-            buildpath=buildpath
+            buildpath=buildpath,
+            launcher=(self._compilerCache.launcher
+                      if self._compilerCache is not None else "")
         )
 
+    def _resources(self, kind):
+        """ Holds the resources of a transfer of this task, see
+            :meth:`ProcessSupervisor.resources`.
+        """
+        if self._supervisor is None:
+            return nullcontext()
+        return self._supervisor.resources(kind)
+
+    def _run(self, args, name, cwd, env):
+        """ Runs a child process through the supervisor, or directly if
+            there is none.
+
+            :param args: the command line of the child process
+            :param name: the name of the task, used for the log file
+            :param cwd: the working directory of the child
+            :param env: the environment of the child
+        """
+        if self._supervisor is not None:
+            self._supervisor.run(args, name, cwd=cwd, env=env, kind="build")
+        else:
+            returncode = subprocess.run(args, cwd=cwd, env=env,
+                                        stdout=subprocess.DEVNULL).returncode
+            if returncode != 0:
+                raise ProcessError(name, returncode, None)
+
+    def _runStages(self, buildpath, binpath, extractedpath,
+                   dependencyBinPaths, cmake, env):
+        """ Runs all stages of the build in a build directory. Every stage
+            is run and timed separately so that the run history can predict
+            the duration of later builds. Returns whether the build was
+            configured with the cached toolchain probes of other versions.
+            Raises :class:`ProcessError` if a stage fails.
+
+            :param buildpath: the full path to the build directory
+            :param binpath: the full path to the directory where the
+                binaries will be stored
+            :param extractedpath: the full path to the source files
+            :param dependencyBinPaths: the binary paths of all dependencies
+            :param cmake: the absolute path to the CMake executable
+            :param env: the environment of the build processes
+        """
+        if not os.path.exists(buildpath):
+            os.mkdir(buildpath)
+
+        stages = []
+        batch = None
+        seed = []
+        seeded = False
+        checks = None
+        # check if we have a custom build script in the libs.yml
+        if self.lib["custombuild"]:
+            # create a temporary batch file
+            _, batch = mkstemp(suffix=".bat")
+            os.close(_)
+            # write all commands to the batch file
+            with open(batch, "w") as f:
+                for cmd in self.lib["custombuild"]:
+                    f.write(self._formatCommand(
+                        cmd, binpath, extractedpath, buildpath
+                    ) + "\n")
+                    f.write(ERRORLEVEL_CHECK)
+            stages.append(("build", [batch]))
+        elif "cmakeflags" in self.lib or "customcmake" in self.lib:
+            # copy over a custom CMake file id there is one present
+            if self.lib["customcmake"]:
+                # the existing file may be a hardlink into the blob store
+                # that is shared with other versions, so it has to be
+                # replaced instead of being overwritten in place
+                target = extractedpath + "/CMakeLists.txt"
+                if os.path.exists(target):
+                    os.remove(target)
+                shutil.copyfile(self.lib["customcmake"], target)
+
+            # construct the call to CMake; also applies the install prefix
+            # and specifies the output directory for the PDB file
+            args = [cmake,
+                    "-G", self.compiler["generator"],
+                    "-DCMAKE_INSTALL_PREFIX={}".format(binpath),
+                    "-DCMAKE_PDB_OUTPUT_DIRECTORY_RELWITHDEBINFO={}/bin".format(
+                        binpath),
+                    ]
+
+            # append custom CMake flags if provided
+            if "cmakeflags" in self.lib and self.lib["cmakeflags"] is not None:
+                for flag in self.lib["cmakeflags"]:
+                    args.append("-D{}".format(flag))
+
+            # if there are dependencies, we need to hint cmake some paths
+            # so that the include and lib folder can be found by the
+            # Find*.cmake files
+            if dependencyBinPaths:
+                args.append("-DCMAKE_PREFIX_PATH={}".format(
+                    ';'.join(dependencyBinPaths)))
+
+            # route all compiler calls through the compiler cache
+            if self._compilerCache is not None:
+                args += self._compilerCache.cmakeArgs(
+                    self.compiler, buildpath)
+
+            # skip the toolchain probes that previous versions with the same
+            # probes already ran
+            if self._configureCache is not None:
+                checks = self._configureCache.checks(extractedpath)
+                seed = self._configureCache.cmakeArgs(
+                    self.name, self.compiler, cmake, checks)
+                args += seed
+
+            # append the source path
+            args.append(extractedpath)
+
+            stages.append(("configure", args))
+            stages.append(("build", [cmake, "--build", ".",
+                                     "--config", "RelWithDebInfo"]))
+            stages.append(("install", [cmake, "--build", ".",
+                                       "--target", "install",
+                                       "--config", "RelWithDebInfo"]))
+
+        # protect the build directory from eviction, even by concurrent
+        # garbage collections
+        DiskBudget.pin(buildpath)
+        try:
+            for stage, args in stages:
+                start = time.time()
+                logname = "{}-{}_{}.{}".format(
+                    self.name, self.version, self.compiler["short"], stage)
+                seeding = stage == "configure" and bool(seed)
+                try:
+                    # the log of a seeded configure is kept apart, so that it
+                    # survives the retry
+                    self._run(args, logname + (".seeded" if seeding else ""),
+                              cwd=buildpath, env=env)
+                    seeded = seeded or seeding
+                except ProcessError:
+                    if not seeding:
+                        raise
+                    # the probes of another version may not hold for this
+                    # one, so the configure is repeated without them
+                    print("Configuring {}-{} with the cached toolchain probes "
+                          "failed, retrying without them".format(
+                              self.name, self.version))
+                    cachefile = os.path.join(buildpath, "CMakeCache.txt")
+                    if os.path.exists(cachefile):
+                        os.remove(cachefile)
+                    self._run([a for a in args if a not in seed], logname,
+                              cwd=buildpath, env=env)
+                    # only now the probes are known to be at fault; if the
+                    # retry failed as well, the build itself is broken
+                    self._configureCache.invalidate(
+                        self.name, self.compiler, cmake, checks)
+                if stage == "configure" and self._configureCache is not None:
+                    self._configureCache.capture(
+                        self.name, self.compiler, cmake, checks, buildpath)
+                if self._history is not None:
+                    self._history.record(
+                        stage, self.name, self.version,
+                        self.compiler["short"], time.time() - start)
+        finally:
+            DiskBudget.unpin(buildpath)
+            # remove the temporary batch file
+            if batch is not None:
+                os.unlink(batch)
+        return seeded
+
     def compile(self, cmake="", isDep=False):
         """ Launches the actual compilation. Depending on if a custom
             build script was put into the libs.yml file it either executes
@@ -171,23 +504,64 @@ class Task(object):
         binpath = (self._basepath + self.lib["binpath"] +
                    "_" + self.compiler["short"])
 
-        # skip if it was marked as already built
+        # skip if it was marked as already built or if it already failed
         if self._libs[self.name][self.version]["built"]:
             return
+        if self._libs[self.name][self.version].get("status") is not None:
+            return
 
         # skip if we have a 64bit compiler and 64bit builds are not allowed
         if self.lib["64bit"] is False and "x64" in self.compiler["short"]:
+            self._setStatus(UNSUPPORTED, "64bit builds are disabled")
             return
 
         # apply absolute paths to the global list
         self._updateLibList(buildpath, binpath)
+        target = "{}-{}_{}".format(self.name, self.version,
+                                   self.compiler["short"])
+
+        # other runs building the same library with the same compiler, e.g.
+        # with another libs.yml, wait for the build and reuse its binaries
+        with FileLock.forEntry(binpath):
+            self._compile(target, buildpath, extractedpath, binpath, cmake,
+                          isDep)
+
+    def _compile(self, target, buildpath, extractedpath, binpath, cmake,
+                 isDep):
+        """ Builds the library while holding the lock of its binary tree,
+            see :meth:`compile`.
+        """
+        # a resumed run trusts the journal of the interrupted run: finished
+        # builds are skipped without looking at their output, and the output
+        # of builds that were in flight is thrown away
+        if self._journal is not None:
+            if (self._journal.resumed("build", target) and
+                    os.path.isdir(binpath)):
+                print("{} already built (journal).".format(target))
+                DiskBudget.touch(binpath)
+                self._setSuccessfulBuild(success=True)
+                return
+            if self._journal.interrupted("build", target):
+                print("Cleaning up the interrupted build of {}".format(
+                    target))
+                shutil.rmtree(binpath, ignore_errors=True)
+                shutil.rmtree(buildpath, ignore_errors=True)
+
+        # the binaries of a build that never finished, e.g. because its run
+        # was killed, are incomplete
+        if os.path.exists(os.path.join(binpath, PARTIAL_MARKER)):
+            print("Removing the unfinished binaries of {}".format(target))
+            shutil.rmtree(binpath, ignore_errors=True)
 
         # check, whether the library was built outside or before the execution
         # of this instance of the script; if so: skip
         if self._checkBuildFolderPopulated() is True:
             print("{}-{}_{} already built.".format(
                 self.name, self.version, self.compiler["short"]))
+            DiskBudget.touch(binpath)
             self._setSuccessfulBuild(success=True)
+            if self._journal is not None:
+                self._journal.done("build", target)
             return
 
         # check for possible dependencies, they need to be built first
@@ -196,82 +570,144 @@ class Task(object):
             # build all dependencies
             with BuildWrapper(
                     dependencyList=self.lib["dependencies"],
-                    isDependencyWrapper=True, libs=self._libs) as wrapper:
+                    isDependencyWrapper=True, libs=self._libs,
+                    **self._options) as wrapper:
                 wrapper.compileFor(self.compiler, cmake)
                 # apply the binary paths of all dependencies so that
                 # we can set proper include  and lib directories
                 dependencyBinPaths = wrapper.binPaths
 
+            # do not waste any time on a build that is doomed to fail
+            # because a dependency is missing; this cancels all transitive
+            # dependents as well, since they see this library as not built
+            for depname, depversion in self.lib["dependencies"].items():
+                dep = self._libs[depname][depversion]
+                if not dep["built"]:
+                    self.cancel("dependency {}-{} {}".format(
+                        depname, depversion, dep.get("status", None)))
+                    return
+
+        if self._journal is not None:
+            self._journal.begin("build", target)
+
+        # ask the remote build cache for the output of an identical build
+        # that was done by another machine or in a previous run
+        buildKey = None
+        if self._buildCache is not None:
+            buildKey = self._buildCache.key(
+                self._libs, self.name, self.version, self.compiler,
+                self._compilerCache.launcher
+                if self._compilerCache is not None else None)
+            if buildKey is not None:
+                with self._resources("download"):
+                    cached = self._buildCache.fetch(
+                        self.name, self.version, self.compiler, buildKey,
+                        binpath)
+                # a cached tree is held to the same standard as a build;
+                # a broken one is replaced by a real build, whose upload
+                # overwrites it in the cache
+                problem = (self._verifyOutput(binpath) if cached else None)
+                if problem is not None:
+                    print("Ignoring cached build of {}: {}".format(
+                        target, problem))
+                    shutil.rmtree(binpath, ignore_errors=True)
+                elif cached:
+                    print("Using cached build of {}-{}_{}".format(
+                        self.name, self.version, self.compiler["short"]))
+                    self._setSuccessfulBuild(success=True)
+                    if self._journal is not None:
+                        self._journal.done("build", target)
+                    return
+
         print("Compiling {}{}-{}_{}".format(
             "dependency " if isDep else "", self.name,
             self.version, self.compiler["short"]))
 
-        # make sure all directories exist
-        if not os.path.exists(buildpath):
-            os.mkdir(buildpath)
+        # make sure the output directory exists; it is marked as unfinished
+        # until the build succeeded
         if not os.path.exists(binpath):
             os.mkdir(binpath)
-
-        # create a temporary batch file
-        _, name = mkstemp(suffix=".bat")
-        os.close(_)
-        # open it writable
-        with open(name, "w") as f:
-            # check if we have a custom build script in the libs.yml
-            if self.lib["custombuild"]:
-                # write all commands to the batch file
-                for cmd in self.lib["custombuild"]:
-                    f.write(self._formatCommand(
-                        cmd, binpath, extractedpath, buildpath
-                    ) + "\n")
-            elif "cmakeflags" in self.lib or "customcmake" in self.lib:
-                # copy over a custom CMake file id there is one present
-                if self.lib["customcmake"]:
-                    shutil.copyfile(self.lib["customcmake"],
-                                    extractedpath + "/CMakeLists.txt")
-
-                # construct the call to CMake; also applies the install prefix
-                # and specifies the output directory for the PDB file
-                args = [cmake,
-                        "-G", self.compiler["generator"],
-                        "-DCMAKE_INSTALL_PREFIX={}".format(binpath),
-                        "-DCMAKE_PDB_OUTPUT_DIRECTORY_RELWITHDEBINFO={}/bin".format(
-                            binpath),
-                        ]
-
-                # append custom CMake flags if provided
-                if "cmakeflags" in self.lib and self.lib["cmakeflags"] is not None:
-                    for flag in self.lib["cmakeflags"]:
-                        args.append("-D{}".format(flag))
-
-                # if there are dependencies, we need to hint cmake some paths
-                # so that the include and lib folder can be found by the
-                # Find*.cmake files
-                if dependencyBinPaths:
-                    args.append("-DCMAKE_PREFIX_PATH={}".format(
-                        ';'.join(dependencyBinPaths)))
-
-                # append the source path
-                args.append(extractedpath)
-
-                # create cmake configuration command
-                cmake_compile = " ".join(
-                        map(lambda x: "\"" + x + "\"", args)
-                    ) + "\n"
-
-                # create cmake install command
-                cmake_install = ("\"{}\" --build . --target install " +
-                                 "--config RelWithDebInfo\n").format(cmake)
-
-                # write commands to file
-                f.write(cmake_compile)
-                f.write(cmake_install)
-
-        # call the batch file so that the compilation can start
-        subprocess.run(name, cwd=buildpath, stdout=subprocess.DEVNULL)
-        # remove the temporary batch file
-        os.unlink(name)
+        open(os.path.join(binpath, PARTIAL_MARKER), "w").close()
+
+        env = None
+        stats = None
+        if self._compilerCache is not None:
+            env = self._compilerCache.environment(self.compiler)
+            stats = self._compilerCache.stats(self.compiler)
+
+        # build in the scratch space if it has room for the build directory;
+        # only the install tree is written to binpath on disk
+        scratchpath = None
+        if self._scratch is not None:
+            scratchpath = self._scratch.acquire(target, self.name)
+
+        # protect the sources from eviction, even by concurrent garbage
+        # collections
+        DiskBudget.pin(extractedpath, self.compiler["short"])
+        try:
+            try:
+                seeded = self._runStages(scratchpath or buildpath, binpath,
+                                         extractedpath, dependencyBinPaths,
+                                         cmake, env)
+            except ProcessError:
+                # the build may have failed because the scratch space ran
+                # full; it is repeated on disk then
+                if scratchpath is None or not self._scratch.full():
+                    raise
+                print("Scratch space is full, building {} on disk".format(
+                    target))
+                self._scratch.release(scratchpath)
+                scratchpath = None
+                seeded = self._runStages(buildpath, binpath, extractedpath,
+                                         dependencyBinPaths, cmake, env)
+            self._matchPdbs(binpath, scratchpath or buildpath)
+        except ProcessError as e:
+            print("Compiling {} failed: {}".format(target, e))
+            self._setStatus(FAILED, str(e))
+            if self._journal is not None:
+                self._journal.failed("build", target, str(e))
+            return
+        finally:
+            DiskBudget.unpin(extractedpath, self.compiler["short"])
+            DiskBudget.touch(binpath)
+            if scratchpath is not None:
+                self._scratch.release(scratchpath)
+
+        if self._compilerCache is not None:
+            self._compilerCache.report(
+                "{}-{}_{}".format(self.name, self.version,
+                                  self.compiler["short"]),
+                stats, self._compilerCache.stats(self.compiler))
+
+        # a zero exit code does not guarantee that the binaries are there
+        problem = self._verifyOutput(binpath)
+        if problem is not None:
+            print("Compiling {}-{}_{} failed: {}".format(
+                self.name, self.version, self.compiler["short"], problem))
+            self._setStatus(FAILED, problem)
+            if self._journal is not None:
+                self._journal.failed("build", target, problem)
+            return
 
         # if we reached this point, compilation was successful
-        # so, set the build status to True
+        # so, publish the binaries and set the build status to True
+        os.remove(os.path.join(binpath, PARTIAL_MARKER))
         self._setSuccessfulBuild(success=True)
+        if self._journal is not None:
+            self._journal.done("build", target)
+
+        # the build directory is not needed anymore once the binaries
+        # are installed
+        if self._diskBudget is not None:
+            self._diskBudget.release(buildpath)
+
+        # share the fresh build with other machines and later runs; the
+        # toolchain probes of the configure cache are specific to this
+        # machine, so builds that relied on them are not shared
+        if buildKey is not None and seeded:
+            print("Not storing {} in the build cache: configured with cached "
+                  "toolchain probes".format(target))
+        elif buildKey is not None:
+            with self._resources("upload"):
+                self._buildCache.store(
+                    self.name, self.version, self.compiler, buildKey, binpath)
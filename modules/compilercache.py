@@ -0,0 +1,136 @@
+import subprocess
+import os
+import json
+import shutil
+import zlib
+
+
+class CompilerCache(object):
+    """ Wires a ccache or sccache compiler launcher into the builds so that
+        object files are reused across library versions and reruns.
+    """
+
+    def __init__(self, launcher, cacheDir, maxSize=None):
+        """ Initializes an instance of this class.
+
+            :param launcher: the full path to the ccache or sccache executable
+            :param cacheDir: the directory where the cache is stored; every
+                compiler gets its own subdirectory because objects can never
+                be shared between compilers anyway
+            :param maxSize: (optional) maximum size of the cache of each
+                compiler, e.g. "20G"
+        """
+        super(CompilerCache, self).__init__()
+        self._launcher = launcher
+        self._cacheDir = os.path.abspath(cacheDir)
+        self._maxSize = maxSize
+        self._isSccache = "sccache" in os.path.basename(launcher).lower()
+
+    @property
+    def launcher(self):
+        return self._launcher
+
+    def environment(self, compiler):
+        """ Returns the environment for a build with the given compiler.
+
+            :param compiler: information about the compiler, as provided
+                in compilers.yml
+        """
+        env = dict(os.environ)
+        cacheDir = os.path.join(self._cacheDir, compiler["short"])
+
+        if self._isSccache:
+            env["SCCACHE_DIR"] = cacheDir
+            if self._maxSize:
+                env["SCCACHE_CACHE_SIZE"] = str(self._maxSize)
+            # builds for one compiler run sequentially, so a separate server
+            # per compiler gives us exact statistics per library
+            env["SCCACHE_SERVER_PORT"] = str(
+                4300 + zlib.crc32(compiler["short"].encode()) % 1000)
+        else:
+            env["CCACHE_DIR"] = cacheDir
+            if self._maxSize:
+                env["CCACHE_MAXSIZE"] = str(self._maxSize)
+            # rewrite absolute paths and ignore the working directory so
+            # that different source and build directories can share objects
+            env["CCACHE_BASEDIR"] = os.getcwd()
+            env["CCACHE_NOHASHDIR"] = "1"
+
+        return env
+
+    def cmakeArgs(self, compiler, buildpath):
+        """ Returns the CMake arguments that route all compiler calls through
+            the launcher.
+
+            :param compiler: information about the compiler, as provided
+                in compilers.yml
+            :param buildpath: the build directory of the library
+        """
+        launcher = self._launcher.replace("\\", "/")
+        args = ["-DCMAKE_C_COMPILER_LAUNCHER={}".format(launcher),
+                "-DCMAKE_CXX_COMPILER_LAUNCHER={}".format(launcher)]
+
+        # the Visual Studio generators ignore the launcher variables; instead,
+        # MSBuild is pointed to a copy of the launcher named cl.exe, which
+        # ccache and sccache detect and forward to the real compiler
+        if compiler["generator"].startswith("Visual Studio"):
+            shimpath = os.path.join(buildpath, "compilercache")
+            if not os.path.exists(shimpath):
+                os.makedirs(shimpath)
+            shutil.copyfile(self._launcher, os.path.join(shimpath, "cl.exe"))
+            args.append("-DCMAKE_VS_GLOBALS=CLToolExe=cl.exe;CLToolPath={}".format(
+                shimpath.replace("\\", "/")))
+            # debug information in a shared PDB (/Zi) cannot be cached, so
+            # embed it into the objects (/Z7); the linker still writes a PDB
+            args.append("-DCMAKE_POLICY_DEFAULT_CMP0141=NEW")
+            args.append("-DCMAKE_MSVC_DEBUG_INFORMATION_FORMAT=Embedded")
+
+        return args
+
+    def stats(self, compiler):
+        """ Returns the number of cache hits and misses of the cache of
+            the given compiler as a tuple, or None if they are unavailable.
+
+            :param compiler: information about the compiler, as provided
+                in compilers.yml
+        """
+        env = self.environment(compiler)
+        try:
+            if self._isSccache:
+                out = subprocess.run(
+                    [self._launcher, "--show-stats", "--stats-format=json"],
+                    env=env, stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL).stdout
+                data = json.loads(out.decode())["stats"]
+                return (sum(data["cache_hits"]["counts"].values()),
+                        sum(data["cache_misses"]["counts"].values()))
+            else:
+                out = subprocess.run(
+                    [self._launcher, "--print-stats"],
+                    env=env, stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL).stdout
+                data = {}
+                for line in out.decode().splitlines():
+                    key, _, value = line.partition("\t")
+                    if value.isdigit():
+                        data[key] = int(value)
+                return (data.get("direct_cache_hit", 0) +
+                        data.get("preprocessed_cache_hit", 0),
+                        data.get("cache_miss", 0))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def report(self, name, before, after):
+        """ Prints the hit rate of a single build.
+
+            :param name: the display name of the build
+            :param before: the statistics before the build
+            :param after: the statistics after the build
+        """
+        if before is None or after is None:
+            return
+        hits = after[0] - before[0]
+        misses = after[1] - before[1]
+        if hits + misses > 0:
+            print("Compiler cache for {}: {} hits, {} misses ({:.0%})".format(
+                name, hits, misses, hits / (hits + misses)))
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import re
+
+from .filelock import FileLock
+
+# cache entries of the toolchain probes, e.g. check_include_file,
+# check_symbol_exists and check_type_size; CMake skips a probe whose result
+# variable is already defined
+PROBE_ENTRY = re.compile(
+    r"^((?:CMAKE_)?(?:HAVE|SIZEOF)_[A-Za-z0-9_]+):INTERNAL=(.*)$")
+
+# calls of the CMake commands that define the toolchain probes, e.g.
+# check_include_file(unistd.h HAVE_UNISTD_H)
+CHECK_CALL = re.compile(
+    r"\b(?:check_\w+|try_compile|try_run|test_big_endian)\s*\([^)]*\)",
+    re.I)
+
+
+class ConfigureCache(object):
+    """ Seeds the build directories of a library with the results of the
+        toolchain probes of previous configure runs of the same library and
+        compiler, so that CMake does not run hundreds of try_compile probes
+        for every version.
+
+        The probe results are stored per library and compiler in an initial
+        cache file, which is passed to CMake with -C. The file name contains
+        a hash of the compilers.yml entry and the CMake executable, so that
+        the results are dropped when the toolchain changes, and a hash of
+        the probes in the CMake files of the sources, so that only versions
+        with the same probes share their results.
+    """
+
+    def __init__(self, directory):
+        """ Initializes an instance of this class.
+
+            :param directory: the directory of the initial cache files
+        """
+        super(ConfigureCache, self).__init__()
+        self._directory = os.path.abspath(directory)
+
+    @staticmethod
+    def checks(extractedpath):
+        """ Returns a hash of the probes defined by the CMake files of a
+            source tree. Versions of a library with the same probes get the
+            same hash, however much the rest of their CMake files differs.
+
+            :param extractedpath: the full path to the source files
+        """
+        calls = []
+        for root, dirs, files in os.walk(extractedpath):
+            dirs.sort()
+            for f in sorted(files):
+                if f != "CMakeLists.txt" and not f.endswith(".cmake"):
+                    continue
+                path = os.path.join(root, f)
+                with open(path, "r", errors="replace") as cmakefile:
+                    found = CHECK_CALL.findall(cmakefile.read())
+                # the command names are case-insensitive, and the arguments
+                # may be spread over several lines
+                found = [command.strip().lower() + "(" + " ".join(
+                    args.split()) for command, args in
+                    (call.split("(", 1) for call in found)]
+                if found:
+                    calls.append([os.path.relpath(path, extractedpath)
+                                  .replace("\\", "/"), found])
+        return hashlib.sha1(json.dumps(calls).encode()).hexdigest()[:16]
+
+    def _path(self, name, compiler, cmake, checks):
+        """ Returns the path of the initial cache file of a library.
+
+            :param name: the name of the library
+            :param compiler: information about the compiler, as provided
+                in compilers.yml
+            :param cmake: the absolute path to the CMake executable
+            :param checks: the hash of the probes, see :meth:`checks`
+        """
+        toolchain = hashlib.sha1(json.dumps(
+            [compiler, cmake], sort_keys=True, default=str).encode()
+        ).hexdigest()[:16]
+        return os.path.join(self._directory, name, "{}-{}-{}.cmake".format(
+            compiler["short"], toolchain, checks))
+
+    def cmakeArgs(self, name, compiler, cmake, checks):
+        """ Returns the CMake arguments that seed a new build directory, or
+            an empty list if no previous configure run was captured.
+
+            :param name: the name of the library
+            :param compiler: information about the compiler, as provided
+                in compilers.yml
+            :param cmake: the absolute path to the CMake executable
+            :param checks: the hash of the probes, see :meth:`checks`
+        """
+        path = self._path(name, compiler, cmake, checks)
+        if not os.path.exists(path):
+            return []
+        return ["-C", path.replace("\\", "/")]
+
+    @staticmethod
+    def _quote(value):
+        """ Quotes a value for a CMake script. """
+        return '"{}"'.format(value.replace("\\", "\\\\")
+                             .replace('"', '\\"').replace("$", "\\$"))
+
+    @staticmethod
+    def _read(path):
+        """ Returns the probe results of an initial cache file. """
+        probes = {}
+        if not os.path.exists(path):
+            return probes
+        with open(path, "r") as f:
+            for line in f:
+                match = re.match(r'^set\((\S+) "(.*)" CACHE INTERNAL ""\)$',
+                                 line.strip())
+                if match:
+                    probes[match.group(1)] = re.sub(
+                        r"\\(.)", r"\1", match.group(2))
+        return probes
+
+    def capture(self, name, compiler, cmake, checks, buildpath):
+        """ Merges the probe results of a successful configure run into the
+            initial cache file of the library.
+
+            :param name: the name of the library
+            :param compiler: information about the compiler, as provided
+                in compilers.yml
+            :param cmake: the absolute path to the CMake executable
+            :param checks: the hash of the probes, see :meth:`checks`
+            :param buildpath: the configured build directory
+        """
+        cachefile = os.path.join(buildpath, "CMakeCache.txt")
+        if not os.path.exists(cachefile):
+            return
+        probes = {}
+        with open(cachefile, "r", errors="replace") as f:
+            for line in f:
+                match = PROBE_ENTRY.match(line.rstrip("\r\n"))
+                if match:
+                    probes[match.group(1)] = match.group(2)
+        if not probes:
+            return
+
+        path = self._path(name, compiler, cmake, checks)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # concurrent runs configure other versions of the same library
+        with FileLock(path + ".lock"):
+            merged = self._read(path)
+            if all(merged.get(k) == v for k, v in probes.items()):
+                return
+            merged.update(probes)
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write("# toolchain probes of {} with {}, written by "
+                        "bindifflib\n".format(name, compiler["short"]))
+                for key, value in sorted(merged.items()):
+                    f.write('set({} {} CACHE INTERNAL "")\n'.format(
+                        key, self._quote(value)))
+            os.replace(tmp, path)
+
+    def invalidate(self, name, compiler, cmake, checks):
+        """ Drops the probe results of a library, e.g. after a seeded
+            configure run failed.
+
+            :param name: the name of the library
+            :param compiler: information about the compiler, as provided
+                in compilers.yml
+            :param cmake: the absolute path to the CMake executable
+            :param checks: the hash of the probes, see :meth:`checks`
+        """
+        path = self._path(name, compiler, cmake, checks)
+        with FileLock(path + ".lock"):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,315 @@
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# states of a job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# the kinds of jobs the daemon accepts
+JOB_TYPES = ["build", "rebuild", "reexport"]
+
+# the work of the runner between two jobs
+RELOAD = "reload"
+TICK = "tick"
+
+
+class Daemon(object):
+    """ Keeps bindifflib running between submissions. Jobs are submitted
+        over a local HTTP API and run one after another by a single runner
+        thread, so that every job only does its own work on top of the warm
+        state of the previous ones. The watched configuration files are
+        reloaded between two jobs as soon as they change, and the tick runs
+        between two jobs as well, so neither ever races with a job.
+
+        The API:
+            GET  /jobs          all jobs, newest first
+            GET  /jobs/<id>     a single job
+            POST /jobs          submits a job, e.g. {"type": "build",
+                                "lib": ["zlib"], "version": ["1.2.*"]}
+            POST /reload        reloads the configuration files
+            GET  /metrics       metrics in the Prometheus text format
+    """
+
+    def __init__(self, runJob, reload, watched, metrics=None,
+                 host="127.0.0.1", port=8421, poll=5, tick=None,
+                 tickInterval=None):
+        """ Initializes an instance of this class.
+
+            :param runJob: callable that runs a job, given as dictionary
+                with "type" and the selectors "lib", "version" and
+                "compiler"; returns the result, which has to be JSON
+                serializable
+            :param reload: callable that reloads the configuration
+            :param watched: list of files whose changes trigger a reload
+            :param metrics: (optional) callable that returns further metrics
+                as a list of (name, labels, value) tuples
+            :param host: (optional) the address the API listens on
+            :param port: (optional) the port the API listens on
+            :param poll: (optional) interval of the checks for changed
+                files in seconds
+            :param tick: (optional) callable that is called with the daemon
+                every tickInterval seconds, e.g. to submit jobs on its own;
+                it runs on the runner thread
+            :param tickInterval: (optional) interval of the tick in seconds
+        """
+        super(Daemon, self).__init__()
+        self._runJob = runJob
+        self._reload = reload
+        self._watched = watched
+        self._metrics = metrics
+        self._address = (host, port)
+        self._poll = poll
+        self._tick = tick
+        self._tickInterval = tickInterval
+        self._condition = threading.Condition()
+        self._jobs = {}
+        self._order = []
+        self._reloadPending = False
+        self._tickPending = False
+        self._busy = 0.0
+        self._started = time.time()
+        self._mtimes = self._stat()
+
+    def _stat(self):
+        """ Returns the modification times of the watched files. """
+        mtimes = {}
+        for path in self._watched:
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def submit(self, request):
+        """ Queues a job and returns it. Raises a ValueError if the request
+            is malformed.
+
+            :param request: dictionary with "type" and optionally the lists
+                of glob patterns "lib", "version" and "compiler"
+        """
+        if request.get("type", "build") not in JOB_TYPES:
+            raise ValueError("unknown job type {}".format(request["type"]))
+        job = {
+            "id": uuid.uuid4().hex,
+            "type": request.get("type", "build"),
+            "state": QUEUED,
+            "submitted": time.time(),
+        }
+        for key in ["lib", "version", "compiler"]:
+            value = request.get(key, None)
+            if isinstance(value, str):
+                value = [value]
+            if value is not None and not isinstance(value, list):
+                raise ValueError("{} has to be a list".format(key))
+            job[key] = value
+        with self._condition:
+            print("Queued {} job {}".format(job["type"], job["id"]))
+            self._jobs[job["id"]] = job
+            self._order.append(job["id"])
+            self._condition.notify_all()
+            return dict(job)
+
+    def requestReload(self):
+        """ Reloads the configuration before the next job. """
+        with self._condition:
+            self._reloadPending = True
+            self._condition.notify_all()
+
+    def job(self, jobId):
+        """ Returns a job, or None if there is no such job. """
+        with self._condition:
+            job = self._jobs.get(jobId, None)
+            return dict(job) if job is not None else None
+
+    def jobs(self):
+        """ Returns all jobs, newest first. """
+        with self._condition:
+            return [dict(self._jobs[jobId]) for jobId in reversed(self._order)]
+
+    def _next(self):
+        """ Waits for the next queued job, a pending reload or a pending
+            tick. Returns the job, RELOAD or TICK.
+        """
+        with self._condition:
+            while True:
+                if self._reloadPending:
+                    self._reloadPending = False
+                    return RELOAD
+                if self._tickPending:
+                    self._tickPending = False
+                    return TICK
+                for jobId in self._order:
+                    if self._jobs[jobId]["state"] == QUEUED:
+                        self._jobs[jobId]["state"] = RUNNING
+                        self._jobs[jobId]["started"] = time.time()
+                        return dict(self._jobs[jobId])
+                self._condition.wait()
+
+    def _runner(self):
+        """ Runs the queued jobs one after another. """
+        while True:
+            job = self._next()
+            if job == RELOAD:
+                print("Reloading the configuration")
+                try:
+                    self._reload()
+                except Exception as e:
+                    print("Reloading failed: {}".format(e))
+                continue
+            if job == TICK:
+                try:
+                    self._tick(self)
+                except Exception as e:
+                    print("Tick failed: {}".format(e))
+                continue
+
+            print("Running {} job {}".format(job["type"], job["id"]))
+            start = time.time()
+            try:
+                update = {"state": DONE, "result": self._runJob(job)}
+            except Exception as e:
+                traceback.print_exc()
+                update = {"state": FAILED, "error": str(e)}
+            update["finished"] = time.time()
+            with self._condition:
+                self._busy += update["finished"] - start
+                self._jobs[job["id"]].update(update)
+            print("{} job {} {}".format(job["type"], job["id"],
+                                        update["state"]))
+
+    def _watcher(self):
+        """ Requests a reload whenever a watched file changed. """
+        while True:
+            time.sleep(self._poll)
+            mtimes = self._stat()
+            if mtimes != self._mtimes:
+                changed = [path for path in mtimes
+                           if mtimes[path] != self._mtimes.get(path)]
+                print("Changed: {}".format(", ".join(changed)))
+                self._mtimes = mtimes
+                self.requestReload()
+
+    def _ticker(self):
+        """ Has the runner call the tick callable periodically. """
+        while True:
+            time.sleep(self._tickInterval)
+            with self._condition:
+                self._tickPending = True
+                self._condition.notify_all()
+
+    def metrics(self):
+        """ Returns the metrics of the daemon and of the metrics callable
+            as a list of (name, labels, value) tuples.
+        """
+        now = time.time()
+        with self._condition:
+            states = dict((state, 0) for state in [QUEUED, RUNNING, DONE,
+                                                   FAILED])
+            for job in self._jobs.values():
+                states[job["state"]] += 1
+            busy = self._busy + sum(now - job["started"]
+                                    for job in self._jobs.values()
+                                    if job["state"] == RUNNING)
+        uptime = now - self._started
+        metrics = [("bindifflib_uptime_seconds", {}, uptime),
+                   ("bindifflib_queue_depth", {}, states[QUEUED]),
+                   ("bindifflib_runner_utilization", {},
+                    busy / uptime if uptime > 0 else 0.0)]
+        metrics += [("bindifflib_jobs", {"state": state}, count)
+                    for state, count in sorted(states.items())]
+        if self._metrics is not None:
+            metrics += self._metrics()
+        return metrics
+
+    @staticmethod
+    def formatMetrics(metrics):
+        """ Renders metrics in the Prometheus text format. """
+        lines = []
+        for name, labels, value in metrics:
+            if labels:
+                name += "{" + ",".join(
+                    '{}="{}"'.format(key, str(labels[key]).replace('"', "'"))
+                    for key in sorted(labels)) + "}"
+            lines.append("{} {}".format(name, value))
+        return "\n".join(lines) + "\n"
+
+    def _handler(self):
+        """ Returns the request handler class of the HTTP API. """
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, status, body, contentType="application/json"):
+                if contentType == "application/json":
+                    body = json.dumps(body, indent=1, sort_keys=True)
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", contentType)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                path = self.path.split("?")[0].rstrip("/")
+                if path == "/jobs":
+                    self._send(200, daemon.jobs())
+                elif path.startswith("/jobs/"):
+                    job = daemon.job(path[len("/jobs/"):])
+                    if job is None:
+                        self._send(404, {"error": "no such job"})
+                    else:
+                        self._send(200, job)
+                elif path == "/metrics":
+                    self._send(200, daemon.formatMetrics(daemon.metrics()),
+                               "text/plain; version=0.0.4")
+                else:
+                    self._send(404, {"error": "not found"})
+
+            def do_POST(self):
+                path = self.path.split("?")[0].rstrip("/")
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    request = json.loads(
+                        self.rfile.read(length).decode("utf-8") or "{}")
+                except ValueError:
+                    self._send(400, {"error": "invalid JSON"})
+                    return
+                if path == "/jobs":
+                    try:
+                        self._send(202, daemon.submit(request))
+                    except (ValueError, AttributeError) as e:
+                        self._send(400, {"error": str(e)})
+                elif path == "/reload":
+                    daemon.requestReload()
+                    self._send(202, {})
+                else:
+                    self._send(404, {"error": "not found"})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve(self):
+        """ Runs the daemon until it is interrupted. """
+        targets = [self._runner, self._watcher]
+        if self._tick is not None and self._tickInterval:
+            targets.append(self._ticker)
+        for target in targets:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        server = ThreadingHTTPServer(self._address, self._handler())
+        print("Listening on http://{}:{}/".format(*self._address))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,322 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import uuid
+from glob import glob
+
+# debug directory entry of the CodeView information, which names the PDB
+IMAGE_DEBUG_TYPE_CODEVIEW = 2
+# CodeView 7.0 record: "RSDS", GUID, age and the path of the PDB
+RSDS_SIGNATURE = b"RSDS"
+
+# header of the multi-stream files (MSF 7.0) of current PDBs
+MSF_MAGIC = b"Microsoft C/C++ MSF 7.00\r\n\x1aDS\x00\x00\x00"
+# streams holding the GUID and the age of a PDB
+PDB_INFO_STREAM = 1
+DBI_STREAM = 3
+NIL_STREAM = 0xffffffff
+
+
+class DebugSignature(object):
+    """ The GUID and age that tie a DLL to its PDB. The linker writes them
+        into the CodeView record of the DLL and into the PDB; IDA only
+        applies a PDB whose signature matches the DLL.
+    """
+
+    def __init__(self, guid, age, pdbPath=None):
+        """ Initializes an instance of this class.
+
+            :param guid: the GUID as 16 raw bytes
+            :param age: the age, incremented by every incremental link
+            :param pdbPath: (optional) the path of the PDB recorded in the
+                DLL by the linker
+        """
+        super(DebugSignature, self).__init__()
+        self.guid = guid
+        self.age = age
+        self.pdbPath = pdbPath
+
+    def __eq__(self, other):
+        return (isinstance(other, DebugSignature) and
+                self.guid == other.guid and self.age == other.age)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        return "{{{}}}-{}".format(uuid.UUID(bytes_le=self.guid), self.age)
+
+
+def _map(path):
+    """ Maps a file into memory read-only, or returns None if it is empty
+        or cannot be opened.
+    """
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+
+def dllSignature(path):
+    """ Reads the debug signature from the CodeView record of a DLL, or
+        returns None if it has none. Only the headers and the record are
+        read, however large the DLL is.
+
+        :param path: the path of the DLL
+    """
+    data = _map(path)
+    if data is None:
+        return None
+    try:
+        peOffset, = struct.unpack_from("<I", data, 0x3c)
+        if data[:2] != b"MZ" or data[peOffset:peOffset + 4] != b"PE\0\0":
+            return None
+        coff = peOffset + 4
+        sections, = struct.unpack_from("<H", data, coff + 2)
+        optionalSize, = struct.unpack_from("<H", data, coff + 16)
+        optional = coff + 20
+        magic, = struct.unpack_from("<H", data, optional)
+        # the data directories follow the fields of PE32 or PE32+ images
+        directories = optional + (96 if magic == 0x10b else 112)
+        count, = struct.unpack_from("<I", data, directories - 4)
+        if count <= 6:
+            return None
+        debugRva, debugSize = struct.unpack_from(
+            "<II", data, directories + 6 * 8)
+        if debugRva == 0:
+            return None
+
+        # translate the RVA of the debug directory into a file offset
+        debugOffset = None
+        table = optional + optionalSize
+        for i in range(sections):
+            virtualSize, virtualAddress, rawSize, rawOffset = \
+                struct.unpack_from("<IIII", data, table + i * 40 + 8)
+            if (virtualAddress <= debugRva <
+                    virtualAddress + max(virtualSize, rawSize)):
+                debugOffset = debugRva - virtualAddress + rawOffset
+                break
+        if debugOffset is None:
+            return None
+
+        for entry in range(debugOffset, debugOffset + debugSize, 28):
+            kind, size, _, rawOffset = struct.unpack_from(
+                "<IIII", data, entry + 12)
+            if (kind != IMAGE_DEBUG_TYPE_CODEVIEW or size < 24 or
+                    data[rawOffset:rawOffset + 4] != RSDS_SIGNATURE):
+                continue
+            guid = data[rawOffset + 4:rawOffset + 20]
+            age, = struct.unpack_from("<I", data, rawOffset + 20)
+            name = data[rawOffset + 24:rawOffset + size].split(b"\0")[0]
+            return DebugSignature(guid, age,
+                                  name.decode("utf-8", "replace") or None)
+        return None
+    except struct.error:
+        # truncated or corrupt headers
+        return None
+    finally:
+        data.close()
+
+
+def _readStream(data, blockSize, blocks, size):
+    """ Returns the contents of a stream of a multi-stream file. """
+    return b"".join(data[b * blockSize:(b + 1) * blockSize]
+                    for b in blocks)[:size]
+
+
+def pdbSignature(path):
+    """ Reads the debug signature of a PDB, or returns None if it is no
+        MSF 7.0 file. The GUID is taken from the PDB info stream and the age
+        from the DBI stream, which is the age debuggers match against.
+
+        :param path: the path of the PDB
+    """
+    data = _map(path)
+    if data is None:
+        return None
+    try:
+        if data[:len(MSF_MAGIC)] != MSF_MAGIC:
+            return None
+        blockSize, _, _, directorySize, _, mapBlock = struct.unpack_from(
+            "<IIIIII", data, len(MSF_MAGIC))
+
+        # the block map lists the blocks of the stream directory, which
+        # lists the sizes and the blocks of all streams
+        directoryBlocks = (directorySize + blockSize - 1) // blockSize
+        blocks = struct.unpack_from(
+            "<{}I".format(directoryBlocks), data, mapBlock * blockSize)
+        directory = _readStream(data, blockSize, blocks, directorySize)
+        streams, = struct.unpack_from("<I", directory, 0)
+        sizes = struct.unpack_from("<{}I".format(streams), directory, 4)
+
+        streamBlocks = []
+        offset = 4 + 4 * streams
+        for size in sizes:
+            count = (0 if size == NIL_STREAM else
+                     (size + blockSize - 1) // blockSize)
+            streamBlocks.append(struct.unpack_from(
+                "<{}I".format(count), directory, offset))
+            offset += 4 * count
+
+        def stream(index):
+            if index >= streams or sizes[index] in [0, NIL_STREAM]:
+                return None
+            return _readStream(data, blockSize, streamBlocks[index],
+                               sizes[index])
+
+        info = stream(PDB_INFO_STREAM)
+        if info is None or len(info) < 28:
+            return None
+        _, _, age = struct.unpack_from("<III", info, 0)
+        guid = info[12:28]
+        dbi = stream(DBI_STREAM)
+        if dbi is not None and len(dbi) >= 12:
+            age, = struct.unpack_from("<I", dbi, 8)
+        return DebugSignature(guid, age)
+    except struct.error:
+        return None
+    finally:
+        data.close()
+
+
+class PdbSearchCache(object):
+    """ Remembers the DLLs whose matching PDB could not be found, so that
+        the search paths are only searched again once the DLL changed.
+        Otherwise, every run would walk the trees for every DLL that lacks
+        its PDB.
+    """
+
+    def __init__(self, path):
+        """ Initializes an instance of this class and loads the failed
+            searches of previous runs.
+
+            :param path: the path of the JSON file holding the failed
+                searches
+        """
+        super(PdbSearchCache, self).__init__()
+        self._path = path
+        self._lock = threading.Lock()
+        self._misses = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self._misses = json.load(f)
+            except ValueError:
+                print("Ignoring corrupt PDB search cache {}".format(path))
+
+    @staticmethod
+    def _stamp(dll):
+        """ Returns the size and modification time of a DLL. """
+        st = os.stat(dll)
+        return [st.st_size, st.st_mtime_ns]
+
+    def missed(self, dll):
+        """ Checks whether the last search for the PDB of a DLL failed and
+            the DLL did not change since.
+
+            :param dll: the path of the DLL
+        """
+        with self._lock:
+            return self._misses.get(dll) == self._stamp(dll)
+
+    def record(self, dll, found):
+        """ Records the outcome of a search for the PDB of a DLL.
+
+            :param dll: the path of the DLL
+            :param found: whether the matching PDB was found
+        """
+        with self._lock:
+            if found:
+                self._misses.pop(dll, None)
+            else:
+                self._misses[dll] = self._stamp(dll)
+
+    def save(self):
+        """ Writes the failed searches back to disk, leaving out the DLLs
+            that no longer exist.
+        """
+        with self._lock:
+            self._misses = {dll: stamp for dll, stamp in self._misses.items()
+                            if os.path.exists(dll)}
+            tmp = self._path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._misses, f, indent=1, sort_keys=True)
+            os.replace(tmp, self._path)
+
+
+def _searchPdb(dll, pdb, expected, searchPaths):
+    """ Looks up the PDB with the expected signature at the path recorded
+        in the DLL and in the search paths, and copies it to the path of
+        the PDB. Returns whether it was found.
+    """
+    names = set([os.path.basename(pdb).lower()])
+    candidates = []
+    if expected.pdbPath:
+        recorded = expected.pdbPath.replace("\\", "/")
+        names.add(os.path.basename(recorded).lower())
+        candidates.append(recorded)
+    for path in searchPaths:
+        for candidate in glob(os.path.join(path, "**", "*.pdb"),
+                              recursive=True):
+            if os.path.basename(candidate).lower() in names:
+                candidates.append(candidate)
+
+    for candidate in candidates:
+        if (os.path.abspath(candidate) == os.path.abspath(pdb) or
+                not os.path.exists(candidate)):
+            continue
+        if pdbSignature(candidate) == expected:
+            print("Using {} for {}".format(candidate, dll))
+            shutil.copyfile(candidate, pdb + ".part")
+            os.replace(pdb + ".part", pdb)
+            return True
+    return False
+
+
+def matchPdb(dll, pdb, searchPaths=None, searchCache=None):
+    """ Makes sure that the PDB next to a DLL belongs to it before IDA
+        spends any time on the DLL. A stale or missing PDB is looked up at
+        the path recorded in the DLL and in the search paths, e.g. the build
+        tree, and the matching one is copied next to the DLL.
+
+        Returns a (pdb, reason) tuple: the path of the matching PDB and
+        None, or None and the reason why there is no matching PDB.
+
+        :param dll: the path of the DLL
+        :param pdb: the path where the PDB of the DLL is expected
+        :param searchPaths: (optional) directories to search for the PDB
+        :param searchCache: (optional) a :class:`PdbSearchCache` to skip
+            the search if it already failed for the DLL
+    """
+    expected = dllSignature(dll)
+    if expected is None:
+        # nothing to verify, e.g. a DLL linked without /DEBUG
+        if os.path.exists(pdb):
+            return pdb, None
+        return None, "no PDB"
+
+    found = pdbSignature(pdb) if os.path.exists(pdb) else None
+    if found == expected:
+        return pdb, None
+
+    if searchCache is None or not searchCache.missed(dll):
+        if _searchPdb(dll, pdb, expected, searchPaths or []):
+            if searchCache is not None:
+                searchCache.record(dll, True)
+            return pdb, None
+        if searchCache is not None:
+            searchCache.record(dll, False)
+
+    if not os.path.exists(pdb):
+        return None, "no PDB with signature {}".format(expected)
+    if found is None:
+        # e.g. an old PDB format; IDA may still make use of it
+        print("Cannot verify the signature of {}".format(pdb))
+        return pdb, None
+    return None, "PDB signature {} does not match {}".format(found, expected)
@@ -1,3 +1,11 @@
+from fnmatch import fnmatch
+
+
+class DependencyError(Exception):
+    """ Raised if the dependencies of a library cannot be resolved, i.e. if
+        a dependency is missing or if there is a dependency cycle.
+    """
+    pass
 
 
 class Internal(object):
@@ -51,29 +59,111 @@ class DependencyHelper(object):
     def __init__(self, libs):
         """ Initializes an instancen of DependecyHelper.
 
-            :param libs: global list of libraries
+            :param libs: global list of libraries; only the "dependencies"
+                of every version are used, so the declarations returned by
+                :meth:`LibHandler.declareFile` work as well
         """
         self._libs = libs
 
-    def resolve(self):
-        """ Performs the dependncy resolution and returns a list with the results."""
+    def select(self, names=None, versions=None):
+        """ Returns all (name, version) pairs matching the given selectors,
+            sorted by name and version.
+
+            :param names: (optional) list of glob patterns for the library
+                names; all libraries are selected if empty
+            :param versions: (optional) list of glob patterns for the
+                versions; all versions are selected if empty
+        """
         ret = []
+        for name in sorted(self._libs):
+            if names and not any(fnmatch(name, n) for n in names):
+                continue
+            for version in sorted(self._libs[name]):
+                if versions and not any(fnmatch(version, v) for v in versions):
+                    continue
+                ret.append((name, version))
+        return ret
+
+    def _visit(self, name, version, state, order, path):
+        """ Depth-first traversal of the dependency graph that appends every
+            library to order after all of its dependencies.
 
-        # iterate over all libraries
-        for name in self._libs:
-            # consider all version separately
-            for version, lib in self._libs[name].items():
-                libdeps = lib["dependencies"]
-                dependencies = []
-
-                # apply dependencies if there are some
-                if libdeps is not None:
-                    for depname, depversion in libdeps.items():
-                        dependencies.append(
-                            Internal(lib=self._libs[depname][depversion],
-                                     name=depname, version=depversion))
-                # append the current library to the resultset
-                ret.append(Internal(lib=lib, name=name, version=version,
-                                    dependencies=dependencies))
+            :param name: the name of the library
+            :param version: the version of the library
+            :param state: dictionary tracking which libraries are currently
+                being visited (False) or are finished (True)
+            :param order: the resulting list of (name, version) pairs
+            :param path: the chain of libraries leading to this one, used
+                for error messages
+        """
+        node = (name, version)
+        if state.get(node) is True:
+            return
+        if state.get(node) is False:
+            cycle = path[path.index(node):] + [node]
+            raise DependencyError("Dependency cycle: {}".format(
+                " -> ".join("{}-{}".format(n, v) for n, v in cycle)))
+
+        if name not in self._libs or version not in self._libs[name]:
+            if path:
+                raise DependencyError("{}-{} depends on {}-{} which is "
+                                      "not available".format(
+                                          path[-1][0], path[-1][1],
+                                          name, version))
+            raise DependencyError("{}-{} is not available".format(
+                name, version))
+
+        state[node] = False
+        deps = self._libs[name][version]["dependencies"]
+        if deps is not None:
+            for depname, depversion in sorted(deps.items()):
+                self._visit(depname, depversion, state, order, path + [node])
+        state[node] = True
+        order.append(node)
+
+    def closure(self, selected):
+        """ Computes the transitive closure of the dependencies of the
+            selected libraries and returns it in topological order, i.e.
+            every library comes after all of its dependencies. Raises a
+            :class:`DependencyError` on cycles and missing dependencies.
+
+            :param selected: list of (name, version) pairs
+        """
+        state = {}
+        order = []
+        for name, version in selected:
+            self._visit(name, version, state, order, [])
+        return order
+
+    def resolve(self):
+        """ Performs the dependency resolution and returns a list with the
+            results in topological order. The dependencies of every entry
+            contain the full transitive closure. Libraries whose dependencies
+            cannot be resolved are skipped.
+        """
+        ret = []
+        state = {}
+        order = []
+
+        for name, version in self.select():
+            try:
+                self._visit(name, version, state, order, [])
+            except DependencyError as e:
+                print("Skipping {}-{}: {}".format(name, version, e))
+                # forget the libraries of the aborted traversal
+                for node in [n for n, s in state.items() if s is False]:
+                    del state[node]
+
+        for name, version in order:
+            # everything that has to be built before the current library
+            closure = self.closure([(name, version)])[:-1]
+            dependencies = [
+                Internal(lib=self._libs[depname][depversion],
+                         name=depname, version=depversion)
+                for depname, depversion in closure]
+
+            # append the current library to the resultset
+            ret.append(Internal(lib=self._libs[name][version], name=name,
+                                version=version, dependencies=dependencies))
 
         return ret
@@ -0,0 +1,177 @@
+import json
+import os
+import re
+import threading
+from urllib.parse import urljoin, unquote
+
+import requests
+
+# base URL of the GitHub REST API
+GITHUB_API = "https://api.github.com/"
+
+
+class VersionDiscovery(object):
+    """ Finds the released versions of a library upstream, as configured in
+        the discover block of libs.yml: either links on an index page or the
+        tags of a GitHub repository are matched against a version regex.
+
+        The listings are fetched with conditional requests (ETag and
+        If-Modified-Since), and the last response of every listing is kept
+        on disk, so an unchanged upstream costs a single 304 per page.
+        Tag listings are followed through all their pages. Within a run,
+        every listing is only requested once; see :meth:`refresh`.
+    """
+
+    def __init__(self, path, githubApi=GITHUB_API, timeout=30):
+        """ Initializes an instance of this class and loads the cached
+            listings.
+
+            :param path: the path of the JSON file holding the cache
+            :param githubApi: (optional) base URL of the GitHub API
+            :param timeout: (optional) timeout of a request in seconds
+        """
+        super(VersionDiscovery, self).__init__()
+        self._path = path
+        self._githubApi = githubApi
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._fetched = set()
+        self._cache = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self._cache = json.load(f)
+            except ValueError:
+                print("Ignoring corrupt discovery cache {}".format(path))
+
+    def refresh(self):
+        """ Makes the next lookups ask the upstreams again. """
+        with self._lock:
+            self._fetched = set()
+
+    def _listingUrl(self, discover):
+        """ Returns the URL of the listing of a discover block. """
+        if discover.get("github"):
+            return "{}repos/{}/tags?per_page=100".format(
+                self._githubApi, discover["github"])
+        return discover["url"]
+
+    def _fetch(self, url):
+        """ Returns the cached response of a listing, a dictionary with the
+            body and the URL of the next page, fetching it again unless the
+            upstream did not change or cannot be reached.
+        """
+        with self._lock:
+            cached = self._cache.get(url, None)
+            if url in self._fetched and cached is not None:
+                return cached
+
+        headers = {}
+        if cached is not None:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("modified"):
+                headers["If-Modified-Since"] = cached["modified"]
+        try:
+            response = requests.get(url, headers=headers,
+                                    timeout=self._timeout)
+        except requests.RequestException as e:
+            print("Could not query {}: {}".format(url, e))
+            return cached
+
+        with self._lock:
+            self._fetched.add(url)
+            if response.status_code == 304 and cached is not None:
+                return cached
+            if response.status_code != 200:
+                print("Could not query {}: HTTP {}".format(
+                    url, response.status_code))
+                return cached
+            self._cache[url] = {
+                "etag": response.headers.get("ETag"),
+                "modified": response.headers.get("Last-Modified"),
+                "body": response.text,
+                "next": response.links.get("next", {}).get("url"),
+            }
+            return self._cache[url]
+
+    def _tags(self, discover):
+        """ Returns the names of all tags of a GitHub repository, following
+            the Link headers through the pages of the listing; the pages
+            that cannot be fetched or parsed are left out.
+        """
+        url = self._listingUrl(discover)
+        tags = []
+        pages = set()
+        while url and url not in pages:
+            pages.add(url)
+            listing = self._fetch(url)
+            if listing is None:
+                break
+            try:
+                names = [tag["name"] for tag in json.loads(listing["body"])]
+            except (ValueError, KeyError, TypeError):
+                print("Unexpected tag listing of {}".format(
+                    discover["github"]))
+                break
+            tags.extend(names)
+            url = listing.get("next")
+        return tags
+
+    def discover(self, name, args):
+        """ Returns the (version, url) pairs of all versions of a library
+            found upstream, in the order of the listing.
+
+            :param name: the name of the library
+            :param args: dictionary of meta data of the library, as
+                provided in libs.yml; uses discover, url and filetype
+        """
+        discover = args.get("discover", None) or {}
+        if not discover.get("regex") or not (discover.get("url") or
+                                             discover.get("github")):
+            print("The discover block of {} needs a regex and a url or a "
+                  "github repository".format(name))
+            return []
+
+        # the candidates are the tag names or the links of the index page
+        if discover.get("github"):
+            candidates = self._tags(discover)
+        else:
+            listing = self._fetch(self._listingUrl(discover))
+            if listing is None:
+                return []
+            candidates = [unquote(link) for link in re.findall(
+                r"href\s*=\s*[\"']([^\"'#?]+)", listing["body"], re.I)]
+
+        regex = re.compile(discover["regex"])
+        template = args.get("url", "")
+        pairs = []
+        versions = set()
+        for candidate in candidates:
+            m = regex.search(candidate)
+            if m is None:
+                continue
+            version = m.group(1) if m.groups() else m.group(0)
+            if version in versions:
+                continue
+            versions.add(version)
+            # the url template of the library takes precedence; otherwise
+            # the link itself or the archive of the tag is downloaded
+            if "{version}" in template:
+                url = template.format(version=version)
+            elif discover.get("github"):
+                url = "https://github.com/{}/archive/{}.{}".format(
+                    discover["github"], candidate,
+                    args.get("filetype", "tar.gz"))
+            else:
+                url = urljoin(discover["url"], candidate)
+            pairs.append((version, url))
+        return pairs
+
+    def save(self):
+        """ Writes the cached listings back to disk. """
+        with self._lock:
+            tmp = self._path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._cache, f, indent=1, sort_keys=True)
+            os.replace(tmp, self._path)
@@ -0,0 +1,241 @@
+import os
+import shutil
+import time
+from glob import glob
+
+from .filelock import FileLock
+
+# directory next to the entries of a stage that holds the markers which
+# protect the entries from eviction while they are in use; the markers are
+# kept out of the entries, since those are source and build trees
+INUSE_DIR = ".inuse"
+# suffix of the marker files written after an IDB was uploaded
+UPLOADED_SUFFIX = ".uploaded"
+
+UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parseSize(size):
+    """ Converts a size like "20G" or 1024 into a number of bytes. """
+    if size is None:
+        return None
+    if isinstance(size, int):
+        return size
+    size = str(size).strip().upper().rstrip("B")
+    if size and size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+def formatSize(size):
+    """ Converts a number of bytes into a human readable string. """
+    for unit in ["", "K", "M", "G"]:
+        if abs(size) < 1024:
+            return "{:.1f}{}B".format(size, unit)
+        size /= 1024.0
+    return "{:.1f}TB".format(size)
+
+
+class DiskBudget(object):
+    """ Keeps the stage directories below tmp/ within configurable budgets by
+        evicting the least recently used entries. The modification time of
+        an entry is its last use, see :meth:`touch`. The eviction honours the
+        dependencies between the stages: directories that are in use are
+        never evicted and binary trees are kept until they were uploaded.
+    """
+
+    def __init__(self, stages, budgets=None, evictBuildAfterInstall=False,
+                 maxInUseAge=12 * 3600):
+        """ Initializes an instance of this class.
+
+            :param stages: dictionary of stage names ("cache", "extracted",
+                "build", "bin") and their path prefixes
+            :param budgets: (optional) dictionary of stage names and their
+                budget, e.g. "20G"; stages without budget are not evicted
+            :param evictBuildAfterInstall: (optional) remove the build
+                directory right after the install step succeeded
+            :param maxInUseAge: (optional) age in seconds after which an
+                in-use marker is considered stale, e.g. after a crash
+        """
+        super(DiskBudget, self).__init__()
+        self._stages = stages
+        self._budgets = {}
+        for stage, budget in (budgets or {}).items():
+            self._budgets[stage] = parseSize(budget)
+        self._evictBuildAfterInstall = evictBuildAfterInstall
+        self._maxInUseAge = maxInUseAge
+
+    @staticmethod
+    def touch(path):
+        """ Records the use of a stage entry. """
+        if os.path.exists(path):
+            os.utime(path, None)
+
+    @staticmethod
+    def _markers(path):
+        """ Returns the directory of the in-use markers of an entry, i.e.
+            <stage directory>/.inuse/<name>.
+        """
+        head, name = os.path.split(os.path.normpath(path))
+        return os.path.join(head, INUSE_DIR, name)
+
+    @staticmethod
+    def _marker(path, owner):
+        """ Returns the path of the in-use marker of an owner. """
+        return os.path.join(DiskBudget._markers(path), owner or "default")
+
+    @staticmethod
+    def pin(path, owner=""):
+        """ Marks a directory as in use so that it is not evicted, not even
+            by other processes.
+
+            :param path: the directory
+            :param owner: (optional) distinguishes several simultaneous
+                users of the same directory, e.g. builds for different
+                compilers sharing one source tree
+        """
+        if os.path.isdir(path):
+            os.makedirs(DiskBudget._markers(path), exist_ok=True)
+            with open(DiskBudget._marker(path, owner), "w") as f:
+                f.write(str(os.getpid()))
+
+    @staticmethod
+    def unpin(path, owner=""):
+        """ Removes the in-use mark of a directory. """
+        try:
+            os.remove(DiskBudget._marker(path, owner))
+        except OSError:
+            pass
+        DiskBudget.touch(path)
+
+    @staticmethod
+    def usage(path):
+        """ Returns the number of bytes a file or directory occupies. Files
+            with several hardlinks (e.g. from the blob store) are accounted
+            for proportionally.
+        """
+        if os.path.isfile(path):
+            st = os.stat(path)
+            return st.st_size // max(st.st_nlink, 1)
+
+        total = 0
+        for root, _, files in os.walk(path):
+            for f in files:
+                try:
+                    st = os.lstat(os.path.join(root, f))
+                except OSError:
+                    continue
+                total += st.st_size // max(st.st_nlink, 1)
+        return total
+
+    def _inUse(self, path):
+        """ Checks whether a directory carries a recent in-use marker. """
+        for marker in glob(os.path.join(self._markers(path), "*")):
+            try:
+                if time.time() - os.stat(marker).st_mtime < self._maxInUseAge:
+                    return True
+            except OSError:
+                pass
+        return False
+
+    @staticmethod
+    def _uploaded(path):
+        """ Checks whether all DLLs with PDBs of a binary tree were analyzed
+            and uploaded.
+        """
+        for dll in glob(path + "/bin/*.dll"):
+            if not os.path.exists(dll[:-4] + ".pdb"):
+                continue
+            if not any(os.path.exists(dll[:-4] + ext + UPLOADED_SUFFIX)
+                       for ext in [".idb", ".i64"]):
+                return False
+        return True
+
+    def _evictable(self, stage, path):
+        """ Checks the stage dependencies of an entry. """
+        if os.path.isdir(path) and self._inUse(path):
+            return False
+        if stage == "bin" and not self._uploaded(path):
+            return False
+        return True
+
+    @staticmethod
+    def _remove(path):
+        """ Removes a stage entry and returns the number of bytes freed. """
+        freed = DiskBudget.usage(path)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            # stale markers, e.g. of a crashed build
+            shutil.rmtree(DiskBudget._markers(path), ignore_errors=True)
+        else:
+            os.remove(path)
+        return freed
+
+    def release(self, buildpath):
+        """ Called after the install step of a build succeeded; removes the
+            build directory if configured. Returns the number of bytes freed.
+
+            :param buildpath: the build directory
+        """
+        if not self._evictBuildAfterInstall or not os.path.exists(buildpath):
+            return 0
+        return self._remove(buildpath)
+
+    def enforce(self, stage, dryRun=False):
+        """ Evicts the least recently used entries of a stage until it is
+            within its budget. Returns the number of bytes freed.
+
+            :param stage: the name of the stage
+            :param dryRun: (optional) only compute what would be freed
+        """
+        budget = self._budgets.get(stage, None)
+        prefix = self._stages[stage]
+        if budget is None or not os.path.exists(prefix):
+            return 0
+
+        entries = []
+        total = 0
+        for name in os.listdir(prefix):
+            # skip internal directories like the extraction staging area
+            if name.startswith("."):
+                continue
+            path = os.path.join(prefix, name)
+            size = self.usage(path)
+            total += size
+            entries.append((os.stat(path).st_mtime, path, size))
+
+        freed = 0
+        for _, path, size in sorted(entries):
+            if total - freed <= budget:
+                break
+            if not self._evictable(stage, path):
+                continue
+            # entries locked by a run, e.g. while they are downloaded, are
+            # in use as well
+            lock = FileLock.forEntry(path)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                print("{} {} ({})".format(
+                    "Would evict" if dryRun else "Evicting", path,
+                    formatSize(size)))
+                freed += size if dryRun else self._remove(path)
+            finally:
+                lock.release()
+
+        return freed
+
+    def gc(self, blobStore=None, dryRun=False):
+        """ Enforces the budgets of all stages and removes unreferenced
+            blobs. Returns a dictionary of stage names and bytes freed.
+
+            :param blobStore: (optional) the :class:`BlobStore` of the
+                extracted sources
+            :param dryRun: (optional) only compute what would be freed
+        """
+        report = {}
+        for stage in self._stages:
+            report[stage] = self.enforce(stage, dryRun)
+        if blobStore is not None and not dryRun:
+            report["blobs"] = blobStore.prune()
+        return report
@@ -1,5 +1,5 @@
 import requests
-from ftplib import FTP
+from ftplib import FTP, all_errors
 from tempfile import TemporaryFile
 
 
@@ -8,12 +8,14 @@ class Downloader(object):
         from different sources.
     """
 
-    def __init__(self, url):
+    def __init__(self, url, timeout=60):
         """ Initializes an instance of this class.
 
             :param url: the url of the file to download
+            :param timeout: (optional) timeout of the connection in seconds
         """
         self._url = url
+        self._timeout = timeout
 
     def getData(self):
         """ Parses the protocol which is required to download the file
@@ -29,11 +31,16 @@ class Downloader(object):
 
     def _httpGet(self):
         """ Performs a HTTP GET request to get the file. """
-        response = requests.get(self._url, stream=True)
-        if response.status_code is not 200:
+        try:
+            response = requests.get(self._url, stream=True,
+                                    timeout=self._timeout)
+            if response.status_code != 200:
+                return None
+            else:
+                return response.raw.read(decode_content=True)
+        except requests.RequestException as e:
+            print("Error while fetching {}: {}".format(self._url, e))
             return None
-        else:
-            return response.raw.read(decode_content=True)
 
     def _ftpGet(self):
         """ Applies FTP commands to get the file. """
@@ -45,7 +52,7 @@ class Downloader(object):
         file = _split[-1]
 
         try:
-            ftp = FTP(host, timeout=60)
+            ftp = FTP(host, timeout=self._timeout)
             ftp.login()
             ftp.cwd(path)
 
@@ -61,3 +68,6 @@ class Downloader(object):
         except TimeoutError:
             print("Timeout while fetching {}".format(self._url))
             return None
+        except all_errors as e:
+            print("Error while fetching {}: {}".format(self._url, e))
+            return None
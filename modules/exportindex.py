@@ -0,0 +1,93 @@
+import json
+import os
+import re
+import threading
+
+from .filelock import FileLock
+
+# the IDAPython script that exports the databases
+EXPORTER = "bindifflib_exporter.py"
+
+
+def exporterVersion(path=EXPORTER):
+    """ Reads EXPORTER_VERSION from the exporter script. The script cannot
+        be imported outside of IDA, so the assignment is parsed instead.
+
+        :param path: (optional) the path of the exporter script
+    """
+    with open(path, "r") as f:
+        m = re.search(r"^EXPORTER_VERSION\s*=\s*(\d+)", f.read(), re.M)
+    return int(m.group(1)) if m else 0
+
+
+class ExportIndex(object):
+    """ Keeps track of the exporter version every local IDB/I64 file was
+        exported with, so that databases exported by an older exporter can
+        be upgraded instead of being analyzed from scratch. The index is
+        shared by all runs on the host; it is read again whenever another
+        run changed it.
+    """
+
+    def __init__(self, path):
+        """ Initializes an instance of this class and loads the index.
+
+            :param path: the path of the JSON file holding the index
+        """
+        super(ExportIndex, self).__init__()
+        self._path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        self._mtime = None
+        self._load()
+
+    def _load(self):
+        """ Reads the index if it changed since it was last read. """
+        try:
+            mtime = os.stat(self._path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self._path, "r") as f:
+                self._data = json.load(f)
+        except ValueError:
+            print("Ignoring corrupt export index {}".format(self._path))
+        self._mtime = mtime
+
+    @staticmethod
+    def _key(idb):
+        return os.path.relpath(idb).replace("\\", "/")
+
+    def version(self, idb):
+        """ Returns the exporter version of a database; databases that are
+            not in the index have version 0.
+
+            :param idb: the path of the IDB/I64 file
+        """
+        with self._lock:
+            self._load()
+            return self._data.get(self._key(idb), 0)
+
+    def databases(self):
+        """ Returns the paths of all databases in the index. """
+        with self._lock:
+            self._load()
+            return sorted(self._data)
+
+    def update(self, idb, version):
+        """ Records the exporter version of a database and writes the index
+            back to disk, so that finished exports survive an aborted run.
+
+            :param idb: the path of the IDB/I64 file
+            :param version: the exporter version
+        """
+        with self._lock, FileLock(self._path + ".lock"):
+            # keep the updates of other runs
+            self._load()
+            self._data[self._key(idb)] = version
+            tmp = self._path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._data, f, indent=1, sort_keys=True)
+            os.replace(tmp, self._path)
+            self._mtime = os.stat(self._path).st_mtime_ns
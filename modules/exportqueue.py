@@ -0,0 +1,278 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from glob import glob
+
+# sub directories of the queue
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+FILES = "files"
+
+# seconds between the renewals of the claim of a running job
+HEARTBEAT = 60
+
+
+class ExportQueue(object):
+    """ Job queue for IDA exports in a directory that is shared by all
+        machines taking part in the export stage, e.g. a network share. A
+        job is a JSON file that moves from pending/ to claimed/ to done/;
+        since renaming a file is atomic, every job is claimed by exactly one
+        worker. A claim is a lease: the worker renews it while the export
+        runs, and a job whose lease expired is put back into the queue. The
+        inputs and outputs of a job (DLL, PDB and the database)
+        are exchanged through files/<job id>/, so workers need nothing but
+        the share and a licensed IDA.
+    """
+
+    def __init__(self, path):
+        """ Initializes an instance of this class.
+
+            :param path: the directory of the queue
+        """
+        super(ExportQueue, self).__init__()
+        self._path = path
+        for d in [PENDING, CLAIMED, DONE, FILES]:
+            os.makedirs(os.path.join(path, d), exist_ok=True)
+
+    @property
+    def path(self):
+        return self._path
+
+    def _dir(self, *parts):
+        return os.path.join(self._path, *parts)
+
+    def files(self, jobId):
+        """ Returns the directory of the inputs and outputs of a job. """
+        return self._dir(FILES, jobId)
+
+    @staticmethod
+    def _write(path, data):
+        """ Writes a JSON file so that it appears atomically. """
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+
+    def submit(self, idahelper, target, reexport=False, priority=0):
+        """ Adds an export to the queue and returns the id of the job.
+
+            :param idahelper: the :class:`IDAHelper` of the DLL
+            :param target: the name of the binary tree of the DLL, i.e.
+                "<name>-<version>_<compiler>"
+            :param reexport: (optional) upgrade the existing database
+                instead of creating a new one
+            :param priority: (optional) jobs with a higher priority, e.g.
+                a longer predicted duration, are claimed first
+        """
+        jobId = uuid.uuid4().hex
+        files = self.files(jobId)
+        os.makedirs(files)
+        inputs = [idahelper.dll, idahelper.pdb]
+        if reexport:
+            inputs.append(idahelper.idb)
+        for path in inputs:
+            shutil.copyfile(path, os.path.join(files, os.path.basename(path)))
+
+        job = {
+            "id": jobId,
+            "target": target,
+            "dll": os.path.basename(idahelper.dll),
+            "pdb": os.path.basename(idahelper.pdb),
+            "reexport": reexport,
+            "profile": idahelper.profile,
+        }
+        # the file names sort by descending priority
+        self._write(self._dir(PENDING, "{:010d}-{}.json".format(
+            max(10 ** 9 - int(priority), 0), jobId)), job)
+        return jobId
+
+    def claim(self):
+        """ Claims the pending job with the highest priority and returns it,
+            or None if there is no pending job.
+        """
+        for path in sorted(glob(self._dir(PENDING, "*.json"))):
+            target = self._dir(CLAIMED, os.path.basename(path))
+            try:
+                os.rename(path, target)
+            except OSError:
+                # another worker was faster
+                continue
+            # the modification time of a claim is the time it was last
+            # renewed
+            os.utime(target, None)
+            with open(target, "r") as f:
+                return json.load(f)
+        return None
+
+    def renew(self, job):
+        """ Renews the claim of a running job. Returns False if the job was
+            requeued meanwhile.
+
+            :param job: the job as returned by :meth:`claim`
+        """
+        renewed = False
+        for path in glob(self._dir(CLAIMED, "*-{}.json".format(job["id"]))):
+            try:
+                os.utime(path, None)
+                renewed = True
+            except OSError:
+                pass
+        return renewed
+
+    def pending(self):
+        """ Returns the number of pending jobs. """
+        return len(glob(self._dir(PENDING, "*.json")))
+
+    def finish(self, job, success, **result):
+        """ Records the result of a claimed job.
+
+            :param job: the job as returned by :meth:`claim`
+            :param success: whether the export succeeded
+            :param result: further information about the export, e.g. the
+                duration or an error message
+        """
+        result.update(success=success)
+        self._write(self._dir(DONE, job["id"] + ".json"), result)
+        # a job that was requeued meanwhile must not run a second time
+        for d in [CLAIMED, PENDING]:
+            for path in glob(self._dir(d, "*-{}.json".format(job["id"]))):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def result(self, jobId):
+        """ Returns the result of a job, or None if it is not done yet. """
+        path = self._dir(DONE, jobId + ".json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def requeue(self, maxAge):
+        """ Puts jobs back into the queue whose claim was not renewed for
+            too long, e.g. because their worker crashed. Returns the number
+            of jobs.
+
+            :param maxAge: seconds since the last renewal of a claim after
+                which it is considered abandoned; has to be well above
+                HEARTBEAT
+        """
+        count = 0
+        for path in glob(self._dir(CLAIMED, "*.json")):
+            try:
+                if time.time() - os.stat(path).st_mtime < maxAge:
+                    continue
+                os.rename(path, self._dir(PENDING, os.path.basename(path)))
+                count += 1
+            except OSError:
+                pass
+        return count
+
+    def remove(self, jobId):
+        """ Removes the result and the files of a job. """
+        shutil.rmtree(self.files(jobId), ignore_errors=True)
+        try:
+            os.remove(self._dir(DONE, jobId + ".json"))
+        except OSError:
+            pass
+
+
+class ExportWorker(object):
+    """ Runs the IDA exports of an :class:`ExportQueue`. """
+
+    def __init__(self, queue, workPrefix, makeHelper, name):
+        """ Initializes an instance of this class.
+
+            :param queue: the :class:`ExportQueue`
+            :param workPrefix: local directory where the binary trees of
+                the jobs are recreated
+            :param makeHelper: callable that creates the :class:`IDAHelper`
+                for a DLL and a PDB path and an IDA profile
+            :param name: the name of the worker, e.g. the host name
+        """
+        super(ExportWorker, self).__init__()
+        self._queue = queue
+        self._workPrefix = workPrefix
+        self._makeHelper = makeHelper
+        self._name = name
+
+    def runOnce(self):
+        """ Claims and runs a single job. Returns False if there was no
+            pending job.
+        """
+        job = self._queue.claim()
+        if job is None:
+            return False
+
+        # the path of the DLL tells the library, version and compiler; the
+        # job id keeps concurrent jobs of the same library apart
+        tree = os.path.join(self._workPrefix, job["id"])
+        binpath = os.path.join(tree, job["target"], "bin")
+        files = self._queue.files(job["id"])
+        shutil.rmtree(tree, ignore_errors=True)
+        shutil.copytree(files, binpath)
+
+        print("{}: {} {}".format(
+            self._name, "re-exporting" if job["reexport"] else "exporting",
+            os.path.join(job["target"], job["dll"])))
+        # renew the claim while the export runs, however long it takes
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(HEARTBEAT):
+                if not self._queue.renew(job):
+                    print("{}: the claim of {} expired".format(
+                        self._name, job["dll"]))
+
+        renewer = threading.Thread(target=heartbeat, daemon=True)
+        renewer.start()
+        start = time.time()
+        try:
+            idahelper = self._makeHelper(
+                os.path.join(binpath, job["dll"]).replace("\\", "/"),
+                os.path.join(binpath, job["pdb"]).replace("\\", "/"),
+                job.get("profile", None))
+            if job["reexport"]:
+                idahelper.reexport()
+                uploaded = idahelper.storeresult(onlyIdb=True)
+            else:
+                idahelper.makeidb()
+                uploaded = idahelper.storeresult()
+            idb = os.path.basename(idahelper.idb)
+            shutil.copyfile(idahelper.idb, os.path.join(files, idb))
+            features = None
+            if os.path.exists(idahelper.features):
+                features = os.path.basename(idahelper.features)
+                shutil.copyfile(idahelper.features,
+                                os.path.join(files, features))
+            self._queue.finish(job, True, worker=self._name, idb=idb,
+                               features=features,
+                               duration=time.time() - start,
+                               exporter=idahelper.exporterVersion,
+                               uploaded=uploaded, uploads=idahelper.uploads)
+        except Exception as e:
+            print("{}: {} failed: {}".format(self._name, job["dll"], e))
+            self._queue.finish(job, False, worker=self._name,
+                               message=str(e))
+        finally:
+            stop.set()
+            renewer.join()
+            shutil.rmtree(tree, ignore_errors=True)
+        return True
+
+    def run(self, poll=None):
+        """ Runs jobs until the queue is empty.
+
+            :param poll: (optional) keep polling for new jobs every that
+                many seconds instead of returning
+        """
+        while True:
+            if not self.runOnce():
+                if poll is None:
+                    return
+                time.sleep(poll)
@@ -0,0 +1,109 @@
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+# directory next to the entries of a stage that holds their lock files; it
+# is skipped by the eviction like all internal directories
+LOCK_DIR = ".locks"
+
+
+class FileLock(object):
+    """ Exclusive lock that is shared by all processes on the host, e.g. two
+        runs with different libs.yml files or the export workers, so that
+        they can share the stage directories. The lock is held on a lock
+        file and released by the operating system when the process dies,
+        so a crashed run never leaves a stale lock behind.
+
+        Locks are not reentrant: a thread must not acquire a lock it holds.
+    """
+
+    def __init__(self, path, poll=0.5):
+        """ Initializes an instance of this class.
+
+            :param path: the path of the lock file
+            :param poll: (optional) interval of the attempts to acquire a
+                lock held by another process in seconds
+        """
+        super(FileLock, self).__init__()
+        self._path = path
+        self._poll = poll
+        self._fd = None
+
+    @staticmethod
+    def forEntry(path):
+        """ Returns the lock of a stage entry, e.g. a source archive or an
+            extracted tree.
+
+            :param path: the path of the entry
+        """
+        head, name = os.path.split(os.path.normpath(path))
+        return FileLock(os.path.join(head, LOCK_DIR, name + ".lock"))
+
+    @staticmethod
+    def _lock(fd):
+        """ Locks a file without blocking; raises an OSError if another
+            process holds the lock.
+        """
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        elif msvcrt is not None:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+    @staticmethod
+    def _unlock(fd):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        elif msvcrt is not None:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def acquire(self, blocking=True):
+        """ Acquires the lock and returns whether it was acquired.
+
+            :param blocking: (optional) wait until the lock is released by
+                other processes instead of giving up at once
+        """
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT)
+        waiting = False
+        while True:
+            try:
+                self._lock(fd)
+                break
+            except OSError:
+                if not blocking:
+                    os.close(fd)
+                    return False
+                if not waiting:
+                    print("Waiting for {}, which is locked by another "
+                          "run".format(self._path))
+                    waiting = True
+                time.sleep(self._poll)
+        self._fd = fd
+        return True
+
+    def release(self):
+        """ Releases the lock. """
+        if self._fd is None:
+            return
+        try:
+            self._unlock(self._fd)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
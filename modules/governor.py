@@ -0,0 +1,207 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from .diskbudget import parseSize
+
+# the resources handed out by the governor
+RESOURCES = ["cpu", "memory", "network", "disk"]
+
+# what a task of every kind needs unless configured otherwise; the memory
+# of builds and IDA is replaced by the observed peaks once there are some
+DEFAULT_DEMANDS = {
+    "build": {"cpu": 1, "memory": "1G"},
+    "ida": {"cpu": 1, "memory": "2G"},
+    "reexport": {"cpu": 1, "memory": "1G"},
+    "upload": {"network": 1, "disk": 1},
+    "download": {"network": 1, "disk": 1},
+}
+
+
+class ResourceGovernor(object):
+    """ Hands out CPU slots, memory and network and disk bandwidth tokens to
+        the tasks of all stages, so that builds, IDA instances and transfers
+        together neither overload the machine nor leave it idle. A task
+        blocks until everything it asks for is available; a task asking for
+        more than there is at all only runs when nothing else uses the
+        resource.
+
+        With psutil installed, the limits follow the observed load: the
+        memory limit shrinks when the available memory runs low, e.g.
+        because a linker or IDA needs more than estimated, CPU slots are
+        added while the CPUs are idle and taken away while they are
+        saturated, and the memory peaks of the child processes replace the
+        estimated demands. Without psutil, the limits are static.
+    """
+
+    def __init__(self, cpu=None, memory=None, network=4, disk=2,
+                 memoryReserve="1G", demands=None, interval=5.0):
+        """ Initializes an instance of this class.
+
+            :param cpu: (optional) maximum number of CPU slots; defaults to
+                the number of CPUs
+            :param memory: (optional) maximum memory of all tasks, e.g.
+                "48G"; defaults to the physical memory without the reserve,
+                or to no limit without psutil
+            :param network: (optional) number of concurrent transfers
+            :param disk: (optional) number of concurrent disk heavy tasks,
+                e.g. compressing a database
+            :param memoryReserve: (optional) memory that is always left to
+                the system
+            :param demands: (optional) dictionary of task kinds and their
+                demands, overriding DEFAULT_DEMANDS
+            :param interval: (optional) interval of the load samples in
+                seconds
+        """
+        super(ResourceGovernor, self).__init__()
+        self._reserve = parseSize(memoryReserve)
+        if memory is None and psutil is not None:
+            memory = psutil.virtual_memory().total - self._reserve
+        self._max = {
+            "cpu": cpu or os.cpu_count() or 1,
+            "memory": parseSize(memory),
+            "network": network,
+            "disk": disk,
+        }
+        self._limits = dict(self._max)
+        self._inUse = dict((resource, 0) for resource in RESOURCES)
+        self._demands = {}
+        for kind, demand in DEFAULT_DEMANDS.items():
+            self._demands[kind] = dict(demand)
+        for kind, demand in (demands or {}).items():
+            self._demands.setdefault(kind, {}).update(demand)
+        for demand in self._demands.values():
+            if "memory" in demand:
+                demand["memory"] = parseSize(demand["memory"])
+        self._configured = set((demands or {}).keys())
+        self._observed = {}
+        self._waiting = 0
+        self._interval = interval
+        self._condition = threading.Condition()
+        if psutil is not None:
+            thread = threading.Thread(target=self._monitor)
+            thread.daemon = True
+            thread.start()
+
+    def demand(self, kind):
+        """ Returns what a task of a kind asks for. Configured demands are
+            kept; otherwise the observed memory peak replaces the estimate.
+        """
+        with self._condition:
+            demand = dict(self._demands.get(kind, {}))
+            if kind in self._observed and kind not in self._configured:
+                demand["memory"] = self._observed[kind]
+            return demand
+
+    def observe(self, kind, memory):
+        """ Records the memory peak of a task. The estimate follows rising
+            peaks at once and decays slowly, so that a single large build
+            keeps the next ones from being started too early.
+
+            :param kind: the kind of the task, e.g. "build"
+            :param memory: the peak memory in bytes
+        """
+        with self._condition:
+            old = self._observed.get(kind, 0)
+            self._observed[kind] = int(max(memory, 0.9 * old))
+
+    def _fits(self, demand):
+        for resource, amount in demand.items():
+            limit = self._limits.get(resource)
+            if limit is None or not amount:
+                continue
+            # a task larger than the limit runs on its own
+            if self._inUse[resource] and self._inUse[resource] + amount > limit:
+                return False
+        return True
+
+    def acquire(self, demand):
+        """ Blocks until the demand is available and takes it. """
+        with self._condition:
+            self._waiting += 1
+            try:
+                while not self._fits(demand):
+                    self._condition.wait()
+            finally:
+                self._waiting -= 1
+            for resource, amount in demand.items():
+                self._inUse[resource] += amount
+
+    def release(self, demand):
+        """ Returns a demand taken with :meth:`acquire`. """
+        with self._condition:
+            for resource, amount in demand.items():
+                self._inUse[resource] -= amount
+            self._condition.notify_all()
+
+    @contextmanager
+    def use(self, kind, **demand):
+        """ Context manager holding the resources of a task.
+
+            :param kind: the kind of the task, see DEFAULT_DEMANDS
+            :param demand: (optional) amounts that override the demand of
+                the kind, e.g. network=2
+        """
+        demand = dict(self.demand(kind), **demand)
+        self.acquire(demand)
+        try:
+            yield demand
+        finally:
+            self.release(demand)
+
+    def _monitor(self):
+        """ Adapts the limits to the observed load. """
+        while True:
+            cpu = psutil.cpu_percent(interval=self._interval)
+            available = psutil.virtual_memory().available
+            with self._condition:
+                # the memory already handed out is partly unused yet, so
+                # the limit is what is in use plus what is still available
+                if self._max["memory"] is not None:
+                    self._limits["memory"] = max(0, min(
+                        self._max["memory"],
+                        self._inUse["memory"] + available - self._reserve))
+
+                if cpu > 90:
+                    self._limits["cpu"] = max(1, min(self._limits["cpu"],
+                                                     self._inUse["cpu"]))
+                elif cpu < 60 and self._waiting:
+                    self._limits["cpu"] = min(self._max["cpu"],
+                                              self._limits["cpu"] + 1)
+                self._condition.notify_all()
+
+    def stats(self):
+        """ Returns the limits and the amounts in use of all resources and
+            the number of waiting tasks.
+        """
+        with self._condition:
+            return {
+                "limits": dict(self._limits),
+                "inUse": dict(self._inUse),
+                "waiting": self._waiting,
+            }
+
+    @staticmethod
+    def peakMemory(pid):
+        """ Returns the memory of a process and all of its children in
+            bytes, or 0 if it cannot be measured.
+        """
+        if psutil is None:
+            return 0
+        try:
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive=True)
+        except psutil.Error:
+            return 0
+        total = 0
+        for p in processes:
+            try:
+                total += p.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
@@ -1,15 +1,22 @@
+from contextlib import nullcontext
 from .downloader import Downloader
 from .extractors import EXTRACTORS
+from .diskbudget import DiskBudget
+from .filelock import FileLock
+from .mirrors import mirrorUrls
 import yaml
 import os
 import shutil
 import re
+import hashlib
 
 
 class LibHandler(object):
     """ Handles a library from libs.yml. """
     def __init__(self, cachePrefix="", extractedPrefix="",
-                 buildPrefix="", binPrefix="", customCmakePrefix=""):
+                 buildPrefix="", binPrefix="", customCmakePrefix="",
+                 blobStore=None, mirrorSelector=None, discovery=None,
+                 journal=None):
         """ Initializes an instance of the class. 
 
             :param cachePrefix: full path prefix to the cache directory
@@ -20,6 +27,15 @@ class LibHandler(object):
                 binaries will be stored
             :param customCmakePrefix: prefix of the directory where the
                 custom cmake files are stored
+            :param blobStore: (optional) a :class:`BlobStore` that
+                deduplicates the files of all extracted source trees
+            :param mirrorSelector: (optional) a :class:`MirrorSelector` that
+                chooses between the mirrors of a library and the source
+                mirror in the artifactory
+            :param discovery: (optional) a :class:`VersionDiscovery` that
+                finds the versions of libraries with a discover block
+            :param journal: (optional) the :class:`RunJournal` that records
+                the extractions
         """
         self._libs = {}
         self._cachePrefix = cachePrefix
@@ -27,13 +43,38 @@ class LibHandler(object):
         self._buildPrefix = buildPrefix
         self._binPrefix = binPrefix
         self._customCmakePrefix = customCmakePrefix
+        self._blobStore = blobStore
+        self._mirrorSelector = mirrorSelector
+        self._discovery = discovery
+        self._journal = journal
+        self._idaProfiles = {}
 
     def getLibs(self):
         """ Returns the global list of libraries. """
         return self._libs
 
-    def addLibrary(self, name, args):
-        """ Adds a new library the global list of libraries.
+    def _versionUrls(self, name, args):
+        """ Yields all (version, url) pairs of a library as given in
+            libs.yml, followed by the versions found upstream that are not
+            listed there, without downloading anything.
+
+            :param name: name of the library
+            :param args: dictionary of meta data of the library, as
+                provided in libs.yml
+        """
+        listed = set()
+        for version, url in self._listedVersionUrls(name, args):
+            listed.add(version)
+            yield version, url
+
+        if self._discovery is not None and args.get("discover"):
+            for version, url in self._discovery.discover(name, args):
+                if version not in listed:
+                    yield version, url
+
+    def _listedVersionUrls(self, name, args):
+        """ Yields all (version, url) pairs of a library as listed in
+            libs.yml.
 
             :param name: name of the library
             :param args: dictionary of meta data of the library, as
@@ -44,16 +85,9 @@ class LibHandler(object):
         urls = args.get("urls", [])
         filetype = args.get("filetype", "")
 
-        # add to internal cache if not yet present at all
-        if name not in self._libs:
-            self._libs[name] = {}
-
-        file = None
-
-        # if we have a list of URLs just download and use those; we do not
+        # if we have a list of URLs just use those; we do not
         # need to take care of URL formatting then.
-        # otherwise, format the URL for every version in the metadata and
-        # download all files that way
+        # otherwise, format the URL for every version in the metadata
         if urls:
             regex = re.compile("\/{name}[-_\.](.*)\.{filetype}$".format(
                 name=name, filetype=filetype))
@@ -64,41 +98,75 @@ class LibHandler(object):
                 # try to find the name and version of the library from the URL
                 m = regex.search(_url)
                 if m:
-                    # download file
-                    fileobj = self._downloadLib(_url)
-                    # get version from regex
-                    version = m.group(1)
-
-                    # if the download was successful, store it in the local cache
-                    if fileobj is not None:
-                        self._addToCache(fileobj=fileobj, version=version,
-                                         name=name, args=args)
+                    yield m.group(1), _url
                 else:
                     if "github" in _url.lower():
                         m = regex_github.search(_url)
                         if m:
-                            fileobj = self._downloadLib(_url)
-                            version = m.group(1)
-                            if fileobj is not None:
-                                self._addToCache(fileobj=fileobj, version=version,
-                                                 name=name, args=args)
+                            yield m.group(1), _url
                     else:
                         print("Could not detect version for url {}".format(_url))
         else:
             for version in versions:
-                if version in self._libs[name]:
-                    # skip if already in cache
-                    print("""{}-{} already present in internal cache.
-                             Skipping.""".format(name, version))
-                    continue
+                yield version, url.format(version=version)
+
+    def addLibrary(self, name, args, selection=None, supervisor=None):
+        """ Adds a new library the global list of libraries.
+
+            :param name: name of the library
+            :param args: dictionary of meta data of the library, as
+                provided in libs.yml
+            :param selection: (optional) set of (name, version) pairs; if
+                given, all other versions are neither downloaded nor added
+            :param supervisor: (optional) the :class:`ProcessSupervisor`
+                whose governor throttles the downloads
+        """
+        # add to internal cache if not yet present at all
+        if name not in self._libs:
+            self._libs[name] = {}
+
+        for version, url in self._versionUrls(name, args):
+            if selection is not None and (name, version) not in selection:
+                continue
+
+            if version in self._libs[name]:
+                # skip if already in cache
+                print("""{}-{} already present in internal cache.
+                         Skipping.""".format(name, version))
+                continue
+
+            # download lib
+            fileobj = self._downloadLib(url, version, args.get("mirrors"),
+                                        name, supervisor)
+
+            # if the download was successful, store it in the local cache
+            if fileobj is not None:
+                self._addToCache(fileobj=fileobj, version=version,
+                                 name=name, args=args)
+
+    @staticmethod
+    def _parseDependencies(dependencies, version):
+        """ Returns the dependencies of a specific version of a library
+            as a dictionary of names and versions, or None if there are none.
+
+            :param dependencies: the dependencies as provided in libs.yml
+            :param version: the version of the library
+        """
+        if not dependencies:
+            return None
 
-                # download lib
-                file = self._downloadLib(url.format(version=version))
+        deps = {}
+        # dependencies that are flagged as "all" have to be
+        # applied to all versions of the current library
+        if "all" in dependencies:
+            deps.update(dependencies["all"])
+        # if we have special dependencies for a specific version,
+        # take care of that now; if there was a different version
+        # of the dependency in "all", it will be overwritten
+        if version in dependencies:
+            deps.update(dependencies[version])
 
-                # if download was successful, store the library in the local cache
-                if file is not None:
-                    self._addToCache(fileobj=file, version=version,
-                                     name=name, args=args)
+        return deps if deps else None
 
     def _addToCache(self, fileobj, version, name, args):
         """ Adds a given library to the local cache. Also ensures, that 
@@ -122,71 +190,75 @@ class LibHandler(object):
         cmakeflags = args.get("cmakeflags", [])
         custombuild = args.get("custombuild", [])
         build_64bit = args.get("64bit", True)
+        ida_profile = self._idaProfile(name, args.get("ida_profile", None))
 
         # the file handle should not be closed at that point,
         # but we check it anyway to get sure
         if fileobj is not None:
-            extractedName = ""
-            # if the file was already extracted in a previous run, we can
-            # skip the extraction for obvious reasons
-            if not self._alreadyExtracted(
-                    name, version):
-                extractor = None
-                # if the library source has no root folder in the package,
-                # we need to create it manually to avoid pollution of the
-                # extractedPath directory
-                if (extratcsToSubfolder is not True):
-                    extractor = EXTRACTORS[filetype](
-                                    fileobj, self._extractedPrefix + "/" +
-                                    name + "-" + version)
-                else:
-                    extractor = EXTRACTORS[filetype](
-                                    fileobj, self._extractedPrefix)
-
-                # extrac the files and close the handle to the source package
-                extractedName = extractor.extract()
+            newName = "{}-{}".format(name, version)
+
+            # hash the source archive so that builds can be identified
+            # by their input, e.g. for the remote build cache; a resumed
+            # run knows the hashes of the archives it extracted
+            sourcehash = None
+            if self._journal is not None and self._journal.resumed(
+                    "extract", newName):
+                sourcehash = self._journal.data(
+                    "extract", newName).get("sourcehash", None)
+            if sourcehash is None:
+                fileobj.seek(0)
+                digest = hashlib.sha1()
+                for chunk in iter(lambda: fileobj.read(1 << 20), b""):
+                    digest.update(chunk)
+                fileobj.seek(0)
+                sourcehash = digest.hexdigest()
+
+            # other runs sharing the extracted directory wait for the tree
+            # instead of extracting it a second time
+            with FileLock.forEntry(self._extractedPrefix + newName):
+                # the tree of an interrupted extraction is incomplete
+                if self._journal is not None and self._journal.interrupted(
+                        "extract", newName):
+                    print("Removing the partially extracted {}".format(
+                        newName))
+                    shutil.rmtree(self._extractedPrefix + newName,
+                                  ignore_errors=True)
+
+                # if the file was already extracted in a previous run, we
+                # can skip the extraction for obvious reasons
+                if not self._alreadyExtracted(name, version):
+                    if self._journal is not None:
+                        self._journal.begin("extract", newName)
+                    self._extract(fileobj, newName, filetype,
+                                  extratcsToSubfolder, subfolderNeedsRename)
                 fileobj.close()
-
-                # if we need to rename the root directory of the source,
-                # we do it now by moving it to another name; also, change
-                # the internal name of the directory accordingly
-                if subfolderNeedsRename:
-                    new_name = "{}-{}".format(name, version)
-                    shutil.move(self._extractedPrefix + extractedName,
-                                self._extractedPrefix + new_name)
-                    extractedName = new_name
-                else:
-                    extractedName = "{}-{}".format(name, version)
-
-            else:
-                extractedName = "{}-{}".format(name, version)
-
-            # remove file that have to be removed from the source tree
-            if remove_files_from and ("source" in remove_files_from):
-                for f in remove_files_from["source"]:
-                    path = "{}/{}/{}".format(self._extractedPrefix, extractedName, f)
-                    try: # try to remove file
-                        os.remove(path)
-                    except OSError:
-                        try: # try to remove directory
-                            os.removedirs(path)
+                extractedName = newName
+
+                if self._journal is not None:
+                    self._journal.done("extract", newName,
+                                       sourcehash=sourcehash)
+
+                # record the use of the tree for the LRU eviction
+                DiskBudget.touch(self._extractedPrefix + extractedName)
+
+                # remove file that have to be removed from the source tree;
+                # removing a file only drops its link, so trees sharing the
+                # same blob are not affected
+                if remove_files_from and ("source" in remove_files_from):
+                    for f in remove_files_from["source"]:
+                        path = "{}/{}/{}".format(self._extractedPrefix,
+                                                 extractedName, f)
+                        try: # try to remove file
+                            os.remove(path)
                         except OSError:
-                            print("Cannot remove path \"{}\"".format(path))
+                            try: # try to remove directory
+                                os.removedirs(path)
+                            except OSError:
+                                print("Cannot remove path \"{}\"".format(
+                                    path))
 
 
-            deps = None
-            # parse the dependencies from the metadata
-            if dependencies is not None:
-                # dependencies that are flagged as "all" have to be
-                # applied to all versions of the current library
-                if "all" in dependencies:
-                    deps = dependencies["all"]
-                # if we have special dependencies for a specific version,
-                # take care of that now; if there was a different version
-                # of the dependency in "all", it will be overwritten
-                if version in dependencies:
-                    for n, v in dependencies[version].items():
-                        deps[n] = dependencies[version][n]
+            deps = self._parseDependencies(dependencies, version)
 
             customcmake = ""
             # check if there is a custom cmake file present
@@ -212,30 +284,137 @@ class LibHandler(object):
                 'binpath': self._binPrefix + extractedName,
                 'dependencies': deps,
                 'built': False,
+                'status': None,
+                'reason': None,
                 'cmakeflags': cmakeflags,
                 'customcmake': customcmake,
                 'custombuild': custombuild,
                 '64bit': build_64bit,
+                'sourcehash': sourcehash,
+                'remove_files_from': remove_files_from,
+                'ida_profile': ida_profile,
             }
 
-    def addFile(self, name):
-        """ Parses a new yml and adds all libraries from there to the cache."""
-        if name is not None and name is not "":
+    def _extract(self, fileobj, newName, filetype, extractsToSubfolder,
+                 subfolderNeedsRename):
+        """ Extracts a source archive into a private staging directory and
+            publishes the tree under its final name by renaming it, so that
+            other runs never see a partially extracted tree.
+
+            :param fileobj: an open file object of the source archive
+            :param newName: the name of the tree, i.e. "<name>-<version>"
+            :param filetype: the type of the archive, see EXTRACTORS
+            :param extractsToSubfolder: whether the archive has a root
+                folder
+            :param subfolderNeedsRename: whether the root folder has to be
+                renamed to newName
+        """
+        staging = "{}.staging/{}/".format(self._extractedPrefix, newName)
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+
+        # if the library source has no root folder in the package,
+        # we need to create it manually to avoid pollution of the
+        # extractedPath directory
+        if extractsToSubfolder is not True:
+            extractor = EXTRACTORS[filetype](fileobj, staging + newName)
+        else:
+            extractor = EXTRACTORS[filetype](fileobj, staging)
+
+        # extract the files; if we need to rename the root directory of
+        # the source, it is published under the new name
+        extractedName = extractor.extract()
+        root = staging + (extractedName if subfolderNeedsRename else newName)
+        if self._blobStore is not None:
+            # with a blob store, the final tree is linked together from
+            # the blob store
+            self._blobStore.ingest(root, self._extractedPrefix + newName)
+        else:
+            os.rename(root, self._extractedPrefix + newName)
+        shutil.rmtree(staging)
+
+    def _loadFile(self, name):
+        """ Parses a yml file and returns its dictionary of libraries. """
+        if name is not None and name != "":
             print("Parsing file {}".format(name))
             with open(name, "rb") as f:
                 yaml_data = yaml.load(f.read())
 
+                # the IDA analysis profiles are shared by all files
+                self._idaProfiles.update(yaml_data.get("ida_profiles") or {})
+
                 if "libs" in yaml_data and yaml_data["libs"] is not None:
-                    libs = yaml_data["libs"]
-                    for libname in libs:
-                        _libname = libs[libname].get("name", libname)
-                        self.addLibrary(_libname, libs[libname])
+                    return yaml_data["libs"]
+        return {}
 
-    def _downloadLib(self, url):
+    def _idaProfile(self, name, profile):
+        """ Returns the IDA analysis profile of a library, or None if it
+            has none. The name of the profile is stored in "name".
+
+            :param name: the name of the library
+            :param profile: the ida_profile as provided in libs.yml, either
+                the name of an entry of ida_profiles or the profile itself
+        """
+        if not profile:
+            return None
+        if isinstance(profile, dict):
+            return dict(profile, name=name)
+        if profile not in self._idaProfiles:
+            print("Unknown IDA profile \"{}\" of {}".format(profile, name))
+            return None
+        return dict(self._idaProfiles[profile], name=profile)
+
+    def addFile(self, name, selection=None, supervisor=None):
+        """ Parses a new yml and adds all libraries from there to the cache.
+
+            :param name: path of the yml file
+            :param selection: (optional) set of (name, version) pairs that
+                restricts which libraries are downloaded and added
+            :param supervisor: (optional) the :class:`ProcessSupervisor`
+                whose governor throttles the downloads
+        """
+        libs = self._loadFile(name)
+        for libname in libs:
+            _libname = libs[libname].get("name", libname)
+            self.addLibrary(_libname, libs[libname], selection, supervisor)
+
+    def declareFile(self, name, declared=None):
+        """ Parses a yml file without downloading anything and returns the
+            declared libraries in the same layout as the global list of
+            libraries, but with only the dependencies filled in. Allows for
+            checking and resolving the dependencies up front.
+
+            :param name: path of the yml file
+            :param declared: (optional) dictionary of previously declared
+                libraries that will be extended
+        """
+        if declared is None:
+            declared = {}
+
+        libs = self._loadFile(name)
+        for libname in libs:
+            args = libs[libname]
+            _libname = args.get("name", libname)
+            versions = declared.setdefault(_libname, {})
+            for version, _ in self._versionUrls(_libname, args):
+                versions[version] = {
+                    'dependencies': self._parseDependencies(
+                        args.get("dependencies", []), version),
+                }
+        return declared
+
+    def _downloadLib(self, url, version=None, mirrors=None, name=None,
+                     supervisor=None):
         """ Utilizes the :class:`Downloader` to download a file from
-            the given URL.
+            the given URL, or from the fastest mirror that has it.
 
             :param url: the URL of the file to download
+            :param version: (optional) the version of the library
+            :param mirrors: (optional) the mirrors of the library, as
+                provided in libs.yml
+            :param name: (optional) the name of the library
+            :param supervisor: (optional) the :class:`ProcessSupervisor`
+                that holds the "download" resources during the download
         """
         filename = url.split("/")[-1]
 
@@ -249,19 +428,33 @@ class LibHandler(object):
         # check cache for presence of an already downloaded copy
         # and skip if there is one. Otherwise, download it.
         tempname = self._cachePrefix + filename
-        if not os.path.exists(tempname):
-            print("Downloading {}".format(filename))
-
-            data = Downloader(url).getData()
-            if data is not None:
-                file = open(tempname, "w+b")
-                file.write(data)
-                file.seek(0)
-                return file
-            return None
-        else:
-            print("Using cached {}".format(filename))
-            return open(tempname, "r+b")
+        # another run downloading the same archive finishes it first
+        with FileLock.forEntry(tempname):
+            if not os.path.exists(tempname):
+                print("Downloading {}".format(filename))
+
+                # the downloads share the network with the uploads and the
+                # build cache transfers
+                with (supervisor.resources("download")
+                      if supervisor is not None else nullcontext()):
+                    if self._mirrorSelector is not None:
+                        data = self._mirrorSelector.fetch(
+                            mirrorUrls(url, version, mirrors), filename,
+                            name)
+                    else:
+                        data = Downloader(url).getData()
+                if data is not None:
+                    # an interrupted download must not be taken for a
+                    # cached archive by the next run
+                    with open(tempname + ".part", "wb") as file:
+                        file.write(data)
+                    os.replace(tempname + ".part", tempname)
+                    return open(tempname, "r+b")
+                return None
+            else:
+                print("Using cached {}".format(filename))
+                DiskBudget.touch(tempname)
+                return open(tempname, "r+b")
 
     def _alreadyExtracted(self, name, version):
         """ Helper function that checks if a library was already extracted.
@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+import time
+
+
+class RunHistory(object):
+    """ Persists the durations of the build stages (configure, build,
+        install) and of the IDA analysis per library, version and compiler,
+        so that later runs can predict how long a task will take.
+    """
+
+    # the build stages, in the order they are run
+    BUILD_STAGES = ["configure", "build", "install"]
+
+    def __init__(self, path, alpha=0.5, default=60.0, logPath=None):
+        """ Initializes an instance of this class and loads the history.
+
+            :param path: the path of the JSON file holding the history
+            :param alpha: (optional) weight of a new measurement in the
+                exponential moving average of the durations
+            :param default: (optional) duration in seconds assumed for
+                tasks without any history at all
+            :param logPath: (optional) path of a file that receives every
+                single measurement as a line of JSON, e.g. for tuning the
+                IDA profiles
+        """
+        super(RunHistory, self).__init__()
+        self._path = path
+        self._alpha = alpha
+        self._default = default
+        self._logPath = logPath
+        self._lock = threading.Lock()
+        self._data = {}
+        # number and total duration of the stages of this process
+        self._stats = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self._data = json.load(f)
+            except ValueError:
+                print("Ignoring corrupt run history {}".format(path))
+
+    @staticmethod
+    def _key(stage, name, version, compiler):
+        return "|".join([stage, name, version, compiler])
+
+    def record(self, stage, name, version, compiler, duration, details=None):
+        """ Records the duration of a stage.
+
+            :param stage: the stage, e.g. "build" or "ida"
+            :param name: the name of the library
+            :param version: the version of the library
+            :param compiler: the short name of the compiler
+            :param duration: the duration in seconds
+            :param details: (optional) dictionary of further information
+                that is written to the log, e.g. the IDA profile
+        """
+        key = self._key(stage, name, version, compiler)
+        with self._lock:
+            if self._logPath is not None:
+                entry = dict(details or {})
+                entry.update(time=time.time(), stage=stage, name=name,
+                             version=version, compiler=compiler,
+                             duration=duration)
+                with open(self._logPath, "a") as f:
+                    f.write(json.dumps(entry, sort_keys=True) + "\n")
+            stats = self._stats.setdefault(stage, {"count": 0, "seconds": 0.0})
+            stats["count"] += 1
+            stats["seconds"] += duration
+            old = self._data.get(key, None)
+            if old is None:
+                self._data[key] = duration
+            else:
+                self._data[key] = (self._alpha * duration +
+                                   (1 - self._alpha) * old)
+
+    def _mean(self, match):
+        """ Returns the mean of all durations whose key parts match. """
+        values = [value for key, value in self._data.items()
+                  if match(key.split("|"))]
+        return sum(values) / len(values) if values else None
+
+    def _lookup(self, stage, name, version, compiler, fallbacks):
+        """ Returns the exact record of a stage or the mean of the first
+            matching fallback, or None if there is no such record.
+        """
+        exact = self._data.get(self._key(stage, name, version, compiler))
+        if exact is not None:
+            return exact
+        for match in fallbacks:
+            value = self._mean(match)
+            if value is not None:
+                return value
+        return None
+
+    @staticmethod
+    def _libraryFallbacks(stage, name, compiler):
+        """ Other versions of the library with the same compiler, then the
+            library with any compiler.
+        """
+        return [lambda k: k[0] == stage and k[1] == name and k[3] == compiler,
+                lambda k: k[0] == stage and k[1] == name]
+
+    def estimate(self, stage, name, version, compiler):
+        """ Predicts the duration of a stage. Without an exact record, the
+            prediction falls back to other versions of the library with the
+            same compiler, then to the library with any compiler and finally
+            to all libraries.
+
+            :param stage: the stage, e.g. "build" or "ida"
+            :param name: the name of the library
+            :param version: the version of the library
+            :param compiler: the short name of the compiler
+        """
+        with self._lock:
+            value = self._lookup(
+                stage, name, version, compiler,
+                self._libraryFallbacks(stage, name, compiler) +
+                [lambda k: k[0] == stage])
+        return value if value is not None else self._default
+
+    def estimateBuild(self, name, version, compiler):
+        """ Predicts the duration of all build stages of a library. Stages
+            that never ran for the library (e.g. custom build scripts only
+            have a "build" stage) do not count.
+        """
+        with self._lock:
+            values = [self._lookup(stage, name, version, compiler,
+                                   self._libraryFallbacks(stage, name,
+                                                          compiler))
+                      for stage in self.BUILD_STAGES]
+            values = [value for value in values if value is not None]
+            if not values:
+                # nothing known about the library, use all libraries
+                values = [self._mean(lambda k, stage=stage: k[0] == stage)
+                          for stage in self.BUILD_STAGES]
+                values = [value for value in values if value is not None]
+        return sum(values) if values else self._default
+
+    def stats(self):
+        """ Returns the number and the total duration of every stage that
+            was recorded since the history was loaded, as a dictionary of
+            stages and {"count", "seconds"} dictionaries.
+        """
+        with self._lock:
+            return dict((stage, dict(stats))
+                        for stage, stats in self._stats.items())
+
+    def save(self):
+        """ Writes the history back to disk. """
+        with self._lock:
+            tmp = self._path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._data, f, indent=1, sort_keys=True)
+            os.replace(tmp, self._path)
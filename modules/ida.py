@@ -1,9 +1,15 @@
 import subprocess
+import json
 import os
 import re
-import hashlib
-from urllib.request import Request, urlopen
-from base64 import b64encode
+import shutil
+import time
+from contextlib import nullcontext
+from .artifactory import Artifactory, CODECS
+from .diskbudget import UPLOADED_SUFFIX, parseSize
+from .exportindex import EXPORTER, exporterVersion
+from .filelock import FileLock
+from .supervisor import ProcessError
 
 REGEX = re.compile(r".*[/\\](.*?)-([^/\\]*)_(.*?)[/\\]bin[/\\](.*?)\.dll")
 
@@ -11,7 +17,9 @@ REGEX = re.compile(r".*[/\\](.*?)-([^/\\]*)_(.*?)[/\\]bin[/\\](.*?)\.dll")
 class IDAHelper(object):
     """ Helper class that provides an easy-to-use interface to IDA Pro. """
 
-    def __init__(self, dll, pdb, idaq, idaq64, artifactoryPath, auth):
+    def __init__(self, dll, pdb, idaq, idaq64, artifactoryPath, auth,
+                 supervisor=None, compression=None, compressionLevel=None,
+                 history=None, exportIndex=None, profile=None, journal=None):
         """ Initializes an instance of this class.
 
             :param dll: the path of the dll to be analyzed with IDA Pro
@@ -20,6 +28,19 @@ class IDAHelper(object):
             :param idaq64: the full path to idaq64.exe
             :param artifactortPath: the URL base path for the artifactory
             :param auth: HTTP basic auth tokens for the artifactory
+            :param supervisor: (optional) the :class:`ProcessSupervisor`
+                that runs IDA; without one, IDA is run directly
+            :param compression: (optional) codec used to compress the IDB
+                and PDB before uploading them, see CODECS in artifactory.py
+            :param compressionLevel: (optional) the compression level
+            :param history: (optional) the :class:`RunHistory` that predicts
+                and receives the duration of the analysis
+            :param exportIndex: (optional) the :class:`ExportIndex` that
+                records the exporter version of the database
+            :param profile: (optional) the IDA analysis profile of the
+                library, see ida_profile in libs.yml
+            :param journal: (optional) the :class:`RunJournal` that records
+                the analysis and the upload
         """
         super(IDAHelper, self).__init__()
         self._dll = (os.getcwd() + "/" + dll).replace("\\", "/")
@@ -27,36 +48,255 @@ class IDAHelper(object):
         self._idaq = idaq if "x64" not in dll else idaq64
         self._idb = (self._dll.replace(".dll", ".idb") if "x64" not in self._dll
                      else self._dll.replace(".dll", ".i64"))
+        # cheap features of the database for the candidate ranking of the
+        # IDA plugin, written by the exporter
+        self._features = self._dll[:-len(".dll")] + ".features.json"
         self._cwd = os.getcwd() + "/" + "/".join(dll.split("/")[:-1])
         self._cwd = self._cwd.replace("\\", "/")
         self._artifactoryPath = artifactoryPath
         self._auth = auth
+        self._supervisor = supervisor
+        self._compression = compression
+        self._compressionLevel = compressionLevel
+        self._history = history
+        self._exportIndex = exportIndex
+        self._exporterVersion = exporterVersion(EXPORTER)
+        self._profile = profile or {}
+        self._journal = journal
+        self._uploads = []
+
+    def _runIda(self, reexport):
+        """ Runs IDA Pro with the exporter script, either on the DLL to
+            create a new database or on the existing database.
+
+            :param reexport: open the existing database instead of
+                analyzing the DLL from scratch
+        """
+        profileFile = None
+        if reexport:
+            # the exporter only runs the steps that are newer than the
+            # version the database was exported with
+            args = [self._idaq,
+                    # autonomous mode (no dialog boxes etc)
+                    "-A"]
+            target = self._idb
+        else:
+            args = [self._idaq,
+                    # overwrite existing
+                    "-c",
+                    # autonomous mode (no dialog boxes etc; remove on
+                    # IDA crash)
+                    "-A"]
+            # batch mode (create IDB and ASM file automatically and exit);
+            # the exporter exits IDA anyway, so the ASM file can be skipped
+            if self._profile.get("asm_output", True):
+                args.append("-B")
+            args += self._profileArgs()
+            profileFile = self._writeProfile()
+            if profileFile is not None:
+                args.append("-Obindifflib_profile:{}".format(profileFile))
+            target = self._dll
+        args += [
+            # pass arguments to our script
+            "-Obindifflib:{}".format(self._pdb),
+            # tell IDA to execute the bindifflib_exporter script
+            "-S\"{}/{}\"".format(os.getcwd(), EXPORTER),
+            # pack database
+            "-P+",
+            target]
+        # run IDA; the log is named after the build directory and the DLL
+        name = "{}.{}.{}".format(
+            os.path.basename(os.path.dirname(self._cwd)),
+            os.path.splitext(os.path.basename(self._dll))[0],
+            "reexport" if reexport else "ida")
+        start = time.time()
+        try:
+            if self._supervisor is not None:
+                self._supervisor.run(args, name, cwd=self._cwd,
+                                     kind="reexport" if reexport else "ida")
+            else:
+                returncode = subprocess.run(args, cwd=self._cwd).returncode
+                if returncode != 0:
+                    raise ProcessError(name, returncode, None)
+        finally:
+            if profileFile is not None:
+                os.remove(profileFile)
+        self._record("reexport" if reexport else "ida",
+                     time.time() - start)
+        if self._exportIndex is not None:
+            self._exportIndex.update(self._idb, self._exporterVersion)
+
+    def _profileArgs(self):
+        """ Returns the command line arguments of the analysis profile. """
+        args = []
+        # processor type, e.g. "metapc"
+        if self._profile.get("processor", None):
+            args.append("-p{}".format(self._profile["processor"]))
+        # configuration directives of ida.cfg and the processor modules,
+        # e.g. processor options
+        for directive in self._profile.get("config", None) or []:
+            args.append("-d{}".format(directive))
+        return args
+
+    def _writeProfile(self):
+        """ Writes the options of the profile that are applied by the
+            exporter into a file next to the DLL and returns its path, or
+            None if there are none.
+        """
+        disabled = self._profile.get("disable_analysis", None)
+        threshold = parseSize(self._profile.get(
+            "disable_analysis_larger_than", None))
+        if not disabled or (threshold is not None and
+                            os.path.getsize(self._dll) <= threshold):
+            return None
+
+        path = self._dll[:-len(".dll")] + ".profile.json"
+        with open(path, "w") as f:
+            json.dump({"disable_analysis": disabled}, f)
+        return path
+
+    def skipReason(self):
+        """ Returns why the DLL is not analyzed according to its profile,
+            or None if it is analyzed.
+        """
+        threshold = parseSize(self._profile.get("skip_larger_than", None))
+        if threshold is not None and os.path.getsize(self._dll) > threshold:
+            return "larger than {} (profile {})".format(
+                self._profile["skip_larger_than"], self._profile["name"])
+        return None
+
+    @property
+    def journalKey(self):
+        """ Returns the key of the DLL in the :class:`RunJournal`, i.e.
+            "<name>-<version>_<compiler>/<file>.dll".
+        """
+        return "/".join(self._dll.split("/")[-3::2])
+
+    def _journaled(self, stage, **data):
+        """ Records a stage of the DLL in the journal, if there is one,
+            together with the PDB, which may be another one than the PDB
+            next to the DLL.
+        """
+        if self._journal is None:
+            return nullcontext()
+        return self._journal.task(
+            stage, self.journalKey,
+            pdb=os.path.relpath(self._pdb).replace("\\", "/"), **data)
 
     def makeidb(self):
         """ Runs IDA Pro with command line flags to output an IDB file. """
-        args = [self._idaq,
-                # overwrite existing
-                "-c",
-                # batch mode (create IDB and ASM file automatically and exit)
-                "-B",
-                # autonomous mode (no dialog boxes etc; remove on IDA crash)
-                "-A",
-                # pass arguments to our script
-                "-Obindifflib:{}".format(self._pdb),
-                # tell IDA to execute the bindifflib_exporter script
-                "-S\"{}/bindifflib_exporter.py\"".format(os.getcwd()),
-                # pack database
-                "-P+",
-                self._dll]
-        # run IDA
-        subprocess.run(args, cwd=self._cwd)
-
-    def storeresult(self):
-        """ Stores the IDB, DLL, and PDB file in the artifactory. """
+        # a concurrent run that selected the same library analyzes the DLL
+        # only once
+        with FileLock.forEntry(self._idb):
+            if os.path.exists(self._idb) and not self.stale:
+                print("{} was analyzed by another run".format(self._dll))
+                return
+            with self._journaled("ida"):
+                self._runIda(reexport=False)
+
+    def reexport(self):
+        """ Upgrades an existing IDB file to the current exporter version
+            without running the auto-analysis again.
+        """
+        self._runIda(reexport=True)
+
+    @property
+    def stale(self):
+        """ Checks whether the existing database was exported with an
+            older version of the exporter.
+        """
+        return (self._exportIndex is not None and os.path.exists(self._idb)
+                and self._exportIndex.version(self._idb) <
+                self._exporterVersion)
+
+    def _historyKey(self):
+        """ Returns the (name, version, compiler) under which the analysis
+            is kept in the run history, or None if the path of the DLL does
+            not tell. Every DLL of a library is recorded separately.
+        """
+        m = REGEX.search(self._dll)
+        if not m:
+            return None
+        return ("{}/{}".format(m.group(1), m.group(4)), m.group(2),
+                m.group(3))
+
+    def _record(self, stage, duration):
+        """ Records the duration of the analysis in the run history,
+            together with the profile and the size of the DLL so that the
+            profiles can be tuned.
+        """
+        key = self._historyKey()
+        if self._history is not None and key is not None:
+            self._history.record(stage, key[0], key[1], key[2], duration, {
+                "profile": self._profile.get("name", None),
+                "size": os.path.getsize(self._dll),
+            })
+
+    def estimate(self, reexport=False):
+        """ Predicts the duration of the analysis in seconds.
+
+            :param reexport: (optional) predict the upgrade of the existing
+                database instead of a full analysis
+        """
+        key = self._historyKey()
+        if self._history is None or key is None:
+            return 0.0
+        return self._history.estimate("reexport" if reexport else "ida",
+                                      key[0], key[1], key[2])
+
+    def adopt(self, idb, duration, exporterVersion, uploaded,
+              reexport=False, uploads=None, features=None):
+        """ Takes over the database of an export that was done by another
+            machine, see :class:`ExportQueue`.
+
+            :param idb: the path of the database created by the export
+            :param duration: the duration of the export in seconds
+            :param exporterVersion: the exporter version of the database
+            :param uploaded: whether the export already uploaded the results
+            :param reexport: (optional) whether the export was a re-export
+            :param uploads: (optional) the files uploaded by the export,
+                see :attr:`uploads`
+            :param features: (optional) the path of the features written
+                by the export
+        """
+        for src, dst in [(idb, self._idb), (features, self._features)]:
+            if src is not None:
+                tmp = dst + ".part"
+                shutil.copyfile(src, tmp)
+                os.replace(tmp, dst)
+        self._record("reexport" if reexport else "ida", duration)
+        if self._exportIndex is not None:
+            self._exportIndex.update(self._idb, exporterVersion)
+        if uploaded:
+            self._uploads += uploads or []
+            self._markUploaded()
+
+    def _markUploaded(self):
+        """ Marks the results as uploaded so that the binary tree may be
+            evicted from the local disk.
+        """
+        open(self._idb + UPLOADED_SUFFIX, "w").close()
+
+    def _resources(self, kind):
+        """ Holds the resources of a transfer, see
+            :meth:`ProcessSupervisor.resources`.
+        """
+        if self._supervisor is None:
+            return nullcontext()
+        return self._supervisor.resources(kind)
+
+    def storeresult(self, onlyIdb=False):
+        """ Stores the IDB, DLL, and PDB file in the artifactory. The IDB
+            carries the exporter version in its "exporter" property.
+            Returns whether the files were stored.
+
+            :param onlyIdb: (optional) only upload the IDB and its features,
+                e.g. after a re-export
+        """
 
         # well, storing into void is not that useful
         if self._artifactoryPath is None:
-            return
+            return False
 
         m = REGEX.search(self._dll)
         if m:
@@ -66,33 +306,80 @@ class IDAHelper(object):
             compiler = m.group(3)
             filename = m.group(4)
 
-            # send each file separately
-            names = [self._dll, self._pdb, self._idb]
-            for file in names:
-                # construct the PUT header, e.g. MD5 and SHA-1 hashes
-                # of the file and, most importantly, setup HTTP basic auth
-                headers = {
-                    "Content-Type": "application/octet-stream",
-                    "X-Checksum-md5": hashlib.md5(
-                        open(file, "rb").read()).hexdigest(),
-                    "X-Checksum-sha1": hashlib.sha1(
-                        open(file, "rb").read()).hexdigest(),
-                    "Authorization": "Basic {}".format(
-                        b64encode(
-                            ":".join(self._auth).encode()).decode("ascii")),
-                }
-
-                # construct the urllib request
-                r = Request(self._artifactoryPath +
+            artifactory = Artifactory(self._artifactoryPath, self._auth)
+
+            # send each file separately; the large IDBs and PDBs are
+            # compressed, the DLL is kept as it is, and so are the small
+            # features the plugin fetches for every candidate
+            names = [(self._dll, None, None),
+                     (self._pdb, self._compression, None),
+                     (self._idb, self._compression,
+                      {"exporter": self._exporterVersion})]
+            if onlyIdb:
+                names = names[2:]
+            if os.path.exists(self._features):
+                names.append((self._features, None, None))
+            with self._journaled("upload", onlyIdb=onlyIdb):
+                for file, codec, properties in names:
+                    fname = file.replace("\\", "/").split("/")[-1]
+                    with self._resources("upload"):
+                        path, sha1 = artifactory.putFile(
                             "bin/{name}/{version}/{compiler}/{fname}".format(
                                 name=name, version=version, compiler=compiler,
-                                fname=file.replace("\\", "/").split("/")[-1]),
-                            headers=headers, data=open(file, "rb").read(),
-                            method="PUT")
+                                fname=fname),
+                            file, codec=codec, level=self._compressionLevel,
+                            properties=properties)
+                    # remember the uploads for the manifest of the library;
+                    # the codec may have fallen back to another one
+                    self._uploads.append({
+                        "file": fname,
+                        "path": path,
+                        "codec": ([c for c, ext in CODECS.items()
+                                   if path.endswith(ext)] or [None])[0],
+                        "size": os.path.getsize(file),
+                        "sha1": sha1,
+                    })
 
-                # send the request and upload the file
-                urlopen(r)
+                self._markUploaded()
+            return True
+        return False
 
     @property
     def dll(self):
         return self._dll
+
+    @property
+    def pdb(self):
+        return self._pdb
+
+    @property
+    def idb(self):
+        return self._idb
+
+    @property
+    def features(self):
+        """ Returns the path of the features written by the exporter. """
+        return self._features
+
+    @property
+    def exporterVersion(self):
+        return self._exporterVersion
+
+    @property
+    def profile(self):
+        return self._profile
+
+    @property
+    def uploads(self):
+        """ Returns the files uploaded by :meth:`storeresult` as
+            dictionaries of "file", "path", "codec", "size" and "sha1".
+        """
+        return self._uploads
+
+    def publishTo(self, manifest):
+        """ Records the uploaded files in a :class:`Manifest`. """
+        m = REGEX.search(self._dll)
+        if not m:
+            return
+        for entry in self._uploads:
+            manifest.add(m.group(1), m.group(2), m.group(3), entry)
@@ -0,0 +1,181 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .filelock import FileLock
+
+# states of a task in the journal
+STARTED = "started"
+DONE = "done"
+FAILED = "failed"
+
+
+class RunJournal(object):
+    """ Append-only journal of the stage transitions of a run, e.g. the
+        extraction of "zlib-1.2.11", the build of "zlib-1.2.11_vc14" or the
+        IDA analysis and upload of "zlib-1.2.11_vc14/zlib.dll". Every record
+        is written and fsync'd before the next step of a task starts, so the
+        journal survives a crash, a reboot or Ctrl-C.
+
+        A resumed run knows from the journal which tasks of the interrupted
+        run are done and which were in flight; the in-flight ones are
+        started over from a clean state instead of trusting whatever they
+        left behind on disk.
+
+        Every kind of run, e.g. the runs with the same libs.yml files and
+        selectors, has a journal of its own, so that concurrent runs of
+        different kinds do not interfere; runs of the same kind wait for
+        each other.
+    """
+
+    def __init__(self, directory):
+        """ Initializes an instance of this class.
+
+            :param directory: the directory of the journal files
+        """
+        super(RunJournal, self).__init__()
+        self._directory = directory
+        self._path = None
+        self._runLock = None
+        self._lock = threading.Lock()
+        self._file = None
+        self._state = {}
+        self._data = {}
+        self._previous = {}
+
+    @staticmethod
+    def _load(path):
+        """ Replays a journal and returns the last state and the merged
+            data of every (stage, key).
+        """
+        state = {}
+        data = {}
+        if not os.path.exists(path):
+            return state, data
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    task = (record["stage"], record["key"])
+                except (ValueError, KeyError, TypeError):
+                    # the last line may be torn by the crash
+                    continue
+                state[task] = record["state"]
+                data.setdefault(task, {}).update(record.get("data", {}))
+        return state, data
+
+    def start(self, run, resume=False):
+        """ Starts the journal of a new run.
+
+            :param run: the kind of the run, e.g. a hash of its arguments
+            :param resume: (optional) continue the journal of the previous
+                run of the same kind instead of starting a new one
+        """
+        self.close()
+        os.makedirs(self._directory, exist_ok=True)
+        path = os.path.join(self._directory, run + ".log")
+        runLock = FileLock(path + ".lock")
+        runLock.acquire()
+        with self._lock:
+            self._path = path
+            self._runLock = runLock
+            self._state = {}
+            self._data = {}
+            if resume:
+                self._state, self._data = self._load(self._path)
+            self._previous = dict(self._state)
+
+            # the resumed journal is compacted to the last state of every
+            # task, so that it does not grow with every resume
+            tmp = self._path + ".tmp"
+            with open(tmp, "w") as f:
+                for (stage, key), state in sorted(self._state.items()):
+                    f.write(json.dumps(
+                        {"stage": stage, "key": key, "state": state,
+                         "data": self._data.get((stage, key), {})},
+                        sort_keys=True) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._path)
+            self._file = open(self._path, "a")
+
+    def _write(self, stage, key, state, data):
+        with self._lock:
+            self._state[(stage, key)] = state
+            self._data.setdefault((stage, key), {}).update(data)
+            if self._file is None:
+                return
+            self._file.write(json.dumps(
+                {"time": time.time(), "stage": stage, "key": key,
+                 "state": state, "data": data}, sort_keys=True) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def begin(self, stage, key, **data):
+        """ Records the start of a task.
+
+            :param stage: the stage, e.g. "build"
+            :param key: the task within the stage, e.g. "zlib-1.2.11_vc14"
+            :param data: (optional) information needed to resume the task
+        """
+        self._write(stage, key, STARTED, data)
+
+    def done(self, stage, key, **data):
+        """ Records the completion of a task, see :meth:`begin`. """
+        self._write(stage, key, DONE, data)
+
+    def failed(self, stage, key, reason=None):
+        """ Records the failure of a task, see :meth:`begin`. """
+        self._write(stage, key, FAILED, {"reason": reason})
+
+    @contextmanager
+    def task(self, stage, key, **data):
+        """ Context manager that records the start and the outcome of a
+            task, see :meth:`begin`.
+        """
+        self.begin(stage, key, **data)
+        try:
+            yield
+        except Exception as e:
+            self.failed(stage, key, str(e))
+            raise
+        self.done(stage, key)
+
+    def state(self, stage, key):
+        """ Returns the state of a task, or None if it is not journaled. """
+        with self._lock:
+            return self._state.get((stage, key), None)
+
+    def data(self, stage, key):
+        """ Returns the information recorded with a task. """
+        with self._lock:
+            return dict(self._data.get((stage, key), {}))
+
+    def previous(self, stage):
+        """ Returns the keys and states of the tasks of a stage as they
+            were when the resumed run was interrupted.
+        """
+        return dict((key, state) for (s, key), state in self._previous.items()
+                    if s == stage)
+
+    def resumed(self, stage, key):
+        """ Checks whether a task was completed by the interrupted run. """
+        return self._previous.get((stage, key), None) == DONE
+
+    def interrupted(self, stage, key):
+        """ Checks whether a task was in flight when the resumed run was
+            interrupted.
+        """
+        return self._previous.get((stage, key), None) == STARTED
+
+    def close(self):
+        """ Ends the journal of the run; it is kept for a resume. """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._runLock is not None:
+                self._runLock.release()
+                self._runLock = None
@@ -0,0 +1,260 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from .artifactory import CODECS
+
+# the top-level index of all libraries and their versions
+INDEX = "index.json"
+# the manifest of a library, next to its versions
+MANIFEST = "manifest.json"
+# lease that serializes the publishes of all hosts and workers
+LOCK = ".publish.lock"
+
+
+class Manifest(object):
+    """ Maintains a small JSON manifest per library and a top-level index
+        of all libraries and versions in the artifactory, so that clients
+        like the IDA plugin resolve the exact files of a library with two
+        small requests instead of listing the whole repository.
+
+        The manifests are only published after all files of the run were
+        uploaded, and the index only after the manifests, so a client never
+        sees an entry whose file does not exist yet. Every document is
+        replaced with a single PUT; entries of other hosts and earlier runs
+        are kept by merging with the published document.
+
+        The artifactory has no conditional PUT, so the publishes of all hosts
+        are serialized with a lease stored next to the index, see
+        :meth:`locked`, and every publish reads its documents back and
+        merges again if another writer dropped its entries anyway.
+
+        The first publish into a repository backfills the manifests from a
+        listing of the files uploaded before there were manifests; the
+        index is marked "complete" afterwards, and clients have to list the
+        repository themselves as long as it is not.
+    """
+
+    def __init__(self, artifactory, prefix="bin/", lease=300.0,
+                 settle=1.0, retries=3):
+        """ Initializes an instance of this class.
+
+            :param artifactory: the :class:`Artifactory` holding the files
+            :param prefix: (optional) the path of the binaries within the
+                repository
+            :param lease: (optional) seconds after which the lease of a
+                crashed publisher expires
+            :param settle: (optional) seconds to wait before checking that
+                a lease was not taken over by another publisher
+            :param retries: (optional) number of merges after another writer
+                dropped the entries of a publish
+        """
+        super(Manifest, self).__init__()
+        self._artifactory = artifactory
+        self._prefix = prefix
+        self._lease = lease
+        self._settle = settle
+        self._retries = retries
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def add(self, name, version, compiler, entry):
+        """ Records an uploaded file for the next :meth:`publish`.
+
+            :param name: the name of the library
+            :param version: the version of the library
+            :param compiler: the short name of the compiler
+            :param entry: dictionary describing the file: "file" (the name
+                without compression suffix), "path" (the path within the
+                repository), "codec", "size" (uncompressed) and "sha1"
+                (of the stored artifact)
+        """
+        with self._lock:
+            files = self._entries.setdefault(name, {}).setdefault(
+                version, {}).setdefault(compiler, {})
+            files[entry["file"]] = entry
+
+    def manifestPath(self, name):
+        """ Returns the path of the manifest of a library. """
+        return "{}{}/{}".format(self._prefix, name, MANIFEST)
+
+    def loadManifest(self, name):
+        """ Downloads the published manifest of a library, or returns None
+            if there is none.
+        """
+        return self._load(self.manifestPath(name), None)
+
+    def storeManifest(self, manifest):
+        """ Replaces the published manifest of a library. """
+        manifest["updated"] = time.time()
+        self._store(self.manifestPath(manifest["name"]), manifest)
+
+    def loadIndex(self):
+        """ Downloads the published index of all libraries. """
+        return self._load(self._prefix + INDEX, {"libraries": {}})
+
+    def storeIndex(self, index):
+        """ Replaces the published index of all libraries. """
+        index["updated"] = time.time()
+        self._store(self._prefix + INDEX, index)
+
+    def _load(self, remotePath, default):
+        """ Downloads a published document, or returns the default. """
+        data = self._artifactory.get(remotePath)
+        if data is None:
+            return default
+        try:
+            return json.loads(data.decode("utf-8"))
+        except ValueError:
+            print("Replacing corrupt {}".format(remotePath))
+            return default
+
+    def _store(self, remotePath, document):
+        self._artifactory.put(remotePath, json.dumps(
+            document, indent=1, sort_keys=True).encode("utf-8"))
+
+    @contextmanager
+    def locked(self):
+        """ Context manager that holds the publish lease of the repository.
+            The lease is taken by writing a token and reading it back after
+            a while; of concurrent publishers, only the last writer finds its
+            token. The lease of a crashed publisher expires.
+        """
+        path = self._prefix + LOCK
+        token = "{}-{}".format(socket.gethostname(), uuid.uuid4().hex)
+        waiting = False
+        while True:
+            lease = self._load(path, {})
+            if lease.get("token") and lease.get("expires", 0) > time.time():
+                if not waiting:
+                    print("Waiting for the manifests, which are published "
+                          "by {}".format(lease["token"]))
+                    waiting = True
+                time.sleep(self._settle)
+                continue
+            self._store(path, {"token": token,
+                               "expires": time.time() + self._lease})
+            time.sleep(self._settle)
+            if self._load(path, {}).get("token") == token:
+                break
+        try:
+            yield
+        finally:
+            # an expired lease instead of a DELETE, which plain HTTP servers
+            # standing in for the artifactory may not support
+            self._store(path, {"token": None, "expires": 0})
+
+    def _backfill(self, index):
+        """ Adds the files uploaded before there were manifests to the
+            manifests and the index, once per repository.
+        """
+        backfilled = {}
+        for f in self._artifactory.list(self._prefix):
+            parts = f["path"][len(self._prefix):].split("/")
+            if len(parts) != 4:
+                continue
+            name, version, compiler, fname = parts
+            base, ext = os.path.splitext(fname)
+            codecs = [c for c, e in CODECS.items() if e == ext]
+            entry = {
+                "file": base if codecs else fname,
+                "path": f["path"],
+                "codec": codecs[0] if codecs else None,
+                "size": f["size"],
+                "sha1": f["sha1"],
+            }
+            backfilled.setdefault(name, {}).setdefault(
+                version, {}).setdefault(compiler, {})[entry["file"]] = entry
+
+        for name, versions in sorted(backfilled.items()):
+            path = self.manifestPath(name)
+            manifest = self._load(path, {"name": name, "versions": {}})
+            for version, compilers in versions.items():
+                for compiler, files in compilers.items():
+                    published = manifest["versions"].setdefault(
+                        version, {}).setdefault(compiler, [])
+                    known = set(e["file"] for e in published)
+                    published += [files[f] for f in sorted(files)
+                                  if f not in known]
+            manifest["updated"] = time.time()
+            self._store(path, manifest)
+            self._indexLibrary(index, name, manifest)
+        index["complete"] = True
+        if backfilled:
+            print("Backfilled the manifests of {} libraries".format(
+                len(backfilled)))
+
+    def _indexLibrary(self, index, name, manifest):
+        library = index["libraries"].setdefault(name, {"versions": []})
+        library["manifest"] = self.manifestPath(name)
+        library["versions"] = sorted(
+            set(library["versions"]) | set(manifest["versions"]))
+
+    @staticmethod
+    def _merge(manifest, versions):
+        """ Merges recorded files into a manifest. """
+        for version, compilers in versions.items():
+            for compiler, files in compilers.items():
+                published = manifest["versions"].setdefault(
+                    version, {}).setdefault(compiler, [])
+                # entries of the same file are replaced, e.g. after a
+                # re-export or a change of the compression codec
+                published[:] = [e for e in published
+                                if e["file"] not in files]
+                published += [files[f] for f in sorted(files)]
+
+    @staticmethod
+    def _contains(manifest, versions):
+        """ Checks whether a manifest holds all recorded files. """
+        for version, compilers in versions.items():
+            for compiler, files in compilers.items():
+                published = manifest["versions"].get(version, {}).get(
+                    compiler, [])
+                if not all(e in published for e in files.values()):
+                    return False
+        return True
+
+    def publish(self):
+        """ Merges the recorded files into the manifests of their libraries
+            and updates the index. Returns the number of manifests written.
+        """
+        with self._lock:
+            entries = self._entries
+            self._entries = {}
+        if not entries:
+            return 0
+
+        with self.locked():
+            pending = dict(entries)
+            for attempt in range(self._retries + 1):
+                index = self.loadIndex()
+                if not index.get("complete", False):
+                    self._backfill(index)
+                for name, versions in sorted(pending.items()):
+                    path = self.manifestPath(name)
+                    manifest = self._load(path, {"name": name, "versions": {}})
+                    self._merge(manifest, versions)
+                    manifest["updated"] = time.time()
+                    self._store(path, manifest)
+                    self._indexLibrary(index, name, manifest)
+                self.storeIndex(index)
+
+                # a writer that ignored or lost the lease may have replaced
+                # the documents in the meantime
+                pending = dict(
+                    (name, versions) for name, versions in pending.items()
+                    if not self._contains(self._load(
+                        self.manifestPath(name), {"versions": {}}), versions))
+                index = self.loadIndex()
+                pending.update(
+                    (name, entries[name]) for name in entries
+                    if name not in index["libraries"])
+                if not pending:
+                    break
+                print("The manifests of {} libraries were overwritten by "
+                      "another host, merging again".format(len(pending)))
+        return len(entries)
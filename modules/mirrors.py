@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+
+from .downloader import Downloader
+
+# size of a typical source archive, used to weigh the latency of a mirror
+# against its throughput
+REFERENCE_SIZE = 20 * 1024 * 1024
+
+
+def mirrorUrls(url, version, mirrors):
+    """ Returns the URLs of a source archive on all mirrors of a library,
+        followed by the upstream URL itself.
+
+        :param url: the upstream URL of the archive
+        :param version: the version of the library
+        :param mirrors: the mirrors as provided in libs.yml; every mirror is
+            a URL that may contain the placeholders {filename} (the file
+            name of the upstream URL), {path} (its path without the leading
+            slash) and {version}. Without placeholders, the file name is
+            appended.
+    """
+    path = urlsplit(url).path.lstrip("/")
+    filename = path.split("/")[-1]
+    urls = []
+    for mirror in mirrors or []:
+        if "{" in mirror:
+            urls.append(mirror.format(filename=filename, path=path,
+                                      version=version))
+        else:
+            urls.append(mirror.rstrip("/") + "/" + filename)
+    urls.append(url)
+    return urls
+
+
+class MirrorSelector(object):
+    """ Chooses the mirror a source archive is downloaded from. Mirrors are
+        ranked by their latency, probed once per run with a HEAD request
+        (failed probes are repeated after a while), and by the throughput
+        of previous downloads from the same host, which is kept across runs.
+        If a download fails, the next mirror is tried. An archive from a
+        mirror is only used if its size matches the Content-Length the
+        upstream reports for it.
+
+        With a source mirror in the artifactory, archives are looked up
+        there first, and archives fetched from elsewhere can be pushed to
+        it, so that other hosts never hit the upstream sites. Archives are
+        stored there per library and upstream URL, since file names like
+        v1.0.tar.gz are not unique.
+    """
+
+    def __init__(self, path, artifactory=None, prefix="sources/", push=False,
+                 probeTimeout=5.0, alpha=0.5, failureTtl=600.0):
+        """ Initializes an instance of this class and loads the throughput
+            measurements.
+
+            :param path: the path of the JSON file holding the throughput
+                of every host in bytes per second
+            :param artifactory: (optional) the :class:`Artifactory` holding
+                the source mirror
+            :param prefix: (optional) the path of the source mirror within
+                the repository
+            :param push: (optional) upload archives that were not found in
+                the source mirror
+            :param probeTimeout: (optional) timeout of a probe in seconds
+            :param alpha: (optional) weight of a new measurement in the
+                exponential moving average of the throughput
+            :param failureTtl: (optional) seconds after which a failed probe
+                is repeated, e.g. in a long running daemon
+        """
+        super(MirrorSelector, self).__init__()
+        self._path = path
+        self._artifactory = artifactory
+        self._prefix = prefix
+        self._push = push and artifactory is not None
+        self._probeTimeout = probeTimeout
+        self._alpha = alpha
+        self._failureTtl = failureTtl
+        self._lock = threading.Lock()
+        self._latency = {}
+        # the times of the failed probes
+        self._failed = {}
+        # the sizes of the files reported by the probes
+        self._sizes = {}
+        self._throughput = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self._throughput = json.load(f)
+            except ValueError:
+                print("Ignoring corrupt mirror statistics {}".format(path))
+
+    @staticmethod
+    def _host(url):
+        return urlsplit(url).netloc.lower()
+
+    def probe(self, url):
+        """ Returns the latency of a HEAD request for the URL in seconds,
+            or None if the file is not available there. Only HTTP mirrors
+            are probed; the latency of all others is unknown (0).
+        """
+        if not url.startswith("http"):
+            return 0.0
+        start = time.time()
+        try:
+            response = requests.head(url, allow_redirects=True,
+                                     timeout=self._probeTimeout)
+        except requests.RequestException:
+            return None
+        if response.status_code >= 400:
+            return None
+        size = response.headers.get("Content-Length", "")
+        if size.isdigit() and not response.headers.get("Content-Encoding"):
+            with self._lock:
+                self._sizes[url] = int(size)
+        return time.time() - start
+
+    def _score(self, url):
+        """ Returns the expected duration of downloading a typical archive
+            from a URL; mirrors without throughput measurements are assumed
+            to be as fast as the best known one, so that they get a chance.
+        """
+        latency = self._latency.get(url)
+        throughput = self._throughput.get(self._host(url))
+        if throughput is None:
+            throughput = max(self._throughput.values(), default=None)
+        return latency + (REFERENCE_SIZE / throughput if throughput else 0)
+
+    def rank(self, urls):
+        """ Returns the URLs ordered from the fastest to the slowest mirror.
+            Mirrors that failed their probe are moved to the end instead of
+            being dropped, since some servers do not answer HEAD requests.
+        """
+        now = time.time()
+        unprobed = [url for url in urls if url not in self._latency or (
+            self._latency[url] is None and
+            now - self._failed.get(url, 0) >= self._failureTtl)]
+        if len(urls) > 1 and unprobed:
+            with ThreadPoolExecutor(len(unprobed)) as executor:
+                for url, latency in zip(unprobed,
+                                        executor.map(self.probe, unprobed)):
+                    self._latency[url] = latency
+                    if latency is None:
+                        self._failed[url] = now
+        elif unprobed:
+            # a single URL is downloaded anyway
+            self._latency[unprobed[0]] = 0.0
+
+        available = [url for url in urls if self._latency[url] is not None]
+        failed = [url for url in urls if self._latency[url] is None]
+        return sorted(available, key=self._score) + failed
+
+    def record(self, url, size, duration):
+        """ Records the throughput of a download.
+
+            :param url: the URL the file was downloaded from
+            :param size: the size of the file in bytes
+            :param duration: the duration of the download in seconds
+        """
+        if duration <= 0:
+            return
+        host = self._host(url)
+        with self._lock:
+            old = self._throughput.get(host, None)
+            value = size / duration
+            self._throughput[host] = (value if old is None else
+                                      self._alpha * value +
+                                      (1 - self._alpha) * old)
+
+    def save(self):
+        """ Writes the throughput measurements back to disk. """
+        with self._lock:
+            tmp = self._path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._throughput, f, indent=1, sort_keys=True)
+            os.replace(tmp, self._path)
+
+    def _mirrorPath(self, urls, filename, name):
+        """ Returns the path of an archive in the source mirror:
+            <prefix>/<name>/<hash of the upstream URL>/<filename>.
+        """
+        digest = hashlib.sha1(urls[-1].encode("utf-8")).hexdigest()[:16]
+        return "{}{}/{}/{}".format(self._prefix, name or "_", digest,
+                                   filename)
+
+    def _verify(self, data, urls, source):
+        """ Checks whether the size of an archive from a mirror matches the
+            size of the upstream archive. An archive that cannot be checked,
+            e.g. because the upstream is down, is used anyway.
+
+            :param data: the contents of the archive
+            :param urls: the URLs of the archive, see :func:`mirrorUrls`
+            :param source: the mirror, for the messages
+        """
+        upstream = urls[-1]
+        if upstream not in self._latency:
+            self._latency[upstream] = self.probe(upstream)
+            if self._latency[upstream] is None:
+                self._failed[upstream] = time.time()
+        size = self._sizes.get(upstream, None)
+        if size is None:
+            print("Cannot verify {} from {}".format(
+                upstream.split("/")[-1], source))
+            return True
+        if len(data) != size:
+            print("Ignoring {} from {}: {} bytes instead of {}".format(
+                upstream.split("/")[-1], source, len(data), size))
+            return False
+        return True
+
+    def fetch(self, urls, filename, name=None):
+        """ Downloads a source archive and returns its contents, or None if
+            no mirror has it.
+
+            :param urls: the URLs of the archive, see :func:`mirrorUrls`;
+                the last one is the upstream URL
+            :param filename: the file name of the archive
+            :param name: (optional) the name of the library
+        """
+        mirrorPath = self._mirrorPath(urls, filename, name)
+        if self._artifactory is not None:
+            try:
+                data = self._artifactory.get(mirrorPath)
+            except Exception as e:
+                print("Source mirror failed for {}: {}".format(filename, e))
+                data = None
+            if data is not None and self._verify(data, urls,
+                                                 "the source mirror"):
+                print("Fetched {} from the source mirror".format(filename))
+                return data
+
+        for url in self.rank(urls):
+            start = time.time()
+            data = Downloader(url).getData()
+            if data is None:
+                print("Download from {} failed, trying next mirror".format(
+                    self._host(url)))
+                continue
+            self.record(url, len(data), time.time() - start)
+            if url != urls[-1] and not self._verify(data, urls,
+                                                    self._host(url)):
+                continue
+            if self._push:
+                try:
+                    self._artifactory.put(mirrorPath, data)
+                    print("Pushed {} to the source mirror".format(filename))
+                except Exception as e:
+                    print("Could not push {} to the source mirror: {}".format(
+                        filename, e))
+            return data
+        return None
@@ -0,0 +1,258 @@
+import json
+import os
+import time
+
+from .artifactory import CODECS
+from .manifest import INDEX
+
+# reasons for removing an artifact
+UNREFERENCED = "unreferenced"
+SUPERSEDED = "superseded"
+DUPLICATE = "duplicate"
+
+
+class Retention(object):
+    """ Keeps the binaries in the artifactory in check. Every run uploads
+        below bin/<name>/<version>/<compiler>/ and nothing is ever removed,
+        so re-uploads with another codec, renamed DLLs and libraries dropped
+        from libs.yml pile up, and so do the manifests the IDA plugin reads.
+
+        The artifacts that are still referenced are the files listed in the
+        manifests for the libraries, versions and compilers of the current
+        libs.yml and compilers.yml files, all files of the builds that are
+        still built but missing from their manifest, and the files of the
+        local databases of the export index that are missing from the
+        manifests.
+        Identical files of different paths are stored once; the manifest
+        entries of the duplicates point to the copy that is kept. All other
+        artifacts are deleted or moved to an archive repository.
+
+        The whole repository is listed with a single request, and folders
+        without any artifact that is kept are removed with a single request
+        as well.
+    """
+
+    def __init__(self, artifactory, manifest, archive=None,
+                 minAge=24 * 3600, prefix="bin/"):
+        """ Initializes an instance of this class.
+
+            :param artifactory: the :class:`Artifactory` holding the files
+            :param manifest: the :class:`Manifest` of the libraries
+            :param archive: (optional) the name of a repository the removed
+                artifacts are moved to instead of deleting them
+            :param minAge: (optional) artifacts younger than this are kept
+                in seconds, since they may belong to a run whose manifests
+                are not published yet
+            :param prefix: (optional) the path of the binaries within the
+                repository
+        """
+        super(Retention, self).__init__()
+        self._artifactory = artifactory
+        self._manifest = manifest
+        self._archive = archive
+        self._minAge = minAge
+        self._prefix = prefix
+
+    def _target(self, path):
+        """ Returns the (name, version, compiler) of an artifact, or None if
+            it is no artifact of a build, e.g. a manifest.
+        """
+        parts = path[len(self._prefix):].split("/")
+        if len(parts) != 4:
+            return None
+        return tuple(parts[:3])
+
+    @staticmethod
+    def _folders(path):
+        """ Returns the folders of a path, innermost first. """
+        folders = []
+        while "/" in path:
+            path = path.rsplit("/", 1)[0]
+            folders.append(path)
+        return folders
+
+    def plan(self, targets, local=None):
+        """ Computes what has to change and returns the plan for
+            :meth:`apply`: the pruned manifests and index, and the artifacts
+            to remove with the reason and size of each.
+
+            :param targets: set of (name, version, compiler) tuples that
+                are still built
+            :param local: (optional) dictionary of (name, version, compiler)
+                tuples and the names of their local files, e.g. from the
+                export index
+        """
+        local = local or {}
+        files = self._artifactory.list(self._prefix)
+        listed = dict((f["path"], f) for f in files)
+        now = time.time()
+
+        # drop the versions and compilers that are no longer built from the
+        # manifests, and the libraries without any version from the index
+        index = self._manifest.loadIndex()
+        published = {None: json.dumps(index, sort_keys=True)}
+        names = set(index["libraries"])
+        names |= set(t[0] for t in map(self._target, listed) if t)
+        manifests = {}
+        pruned = 0
+        for name in sorted(names):
+            manifest = self._manifest.loadManifest(name)
+            if manifest is None:
+                manifest = {"name": name, "versions": {}}
+            published[name] = json.dumps(manifest, sort_keys=True)
+            for version in list(manifest["versions"]):
+                compilers = manifest["versions"][version]
+                for compiler in list(compilers):
+                    if (name, version, compiler) not in targets:
+                        pruned += len(compilers.pop(compiler))
+                if not compilers:
+                    del manifest["versions"][version]
+            manifests[name] = manifest
+
+        # identical files are kept once; the manifest entries of the
+        # duplicates are pointed to the first path
+        canonical = {}
+        duplicates = {}
+        for name, manifest in sorted(manifests.items()):
+            for version, compilers in sorted(manifest["versions"].items()):
+                for compiler, entries in sorted(compilers.items()):
+                    for entry in entries:
+                        f = listed.get(entry["path"], None)
+                        if f is None or not f["sha1"]:
+                            continue
+                        key = (f["sha1"], f["size"],
+                               os.path.splitext(f["path"])[1])
+                        first = canonical.setdefault(key, entry["path"])
+                        if first != entry["path"]:
+                            duplicates[entry["path"]] = first
+                            entry["path"] = first
+
+        referenced = set()
+        for manifest in manifests.values():
+            for compilers in manifest["versions"].values():
+                for entries in compilers.values():
+                    referenced |= set(e["path"] for e in entries)
+        # builds that are missing from their manifest, e.g. uploaded before
+        # there were manifests, are unmanaged; only whole libraries,
+        # versions and compilers that are no longer built can be dropped
+        for path in listed:
+            target = self._target(path)
+            if target in targets and target[2] not in manifests.get(
+                    target[0], {}).get("versions", {}).get(target[1], {}):
+                referenced.add(path)
+
+        # local databases whose files are missing from the manifests, e.g.
+        # after a failed publish, keep their artifacts
+        suffixes = [""] + list(CODECS.values())
+        for target, fnames in local.items():
+            if target not in targets:
+                continue
+            entries = manifests.get(target[0], {}).get("versions", {}).get(
+                target[1], {}).get(target[2], [])
+            known = set(e["file"] for e in entries)
+            folder = "{}{}/".format(self._prefix, "/".join(target))
+            for fname in fnames:
+                if fname not in known:
+                    referenced |= set(folder + fname + s for s in suffixes)
+
+        removals = []
+        for path, f in sorted(listed.items()):
+            target = self._target(path)
+            if target is None or path in referenced:
+                continue
+            if (f["modified"] is not None and
+                    now - f["modified"] < self._minAge):
+                continue
+            if path in duplicates:
+                reason = DUPLICATE
+            elif target in targets:
+                reason = SUPERSEDED
+            else:
+                reason = UNREFERENCED
+            removals.append((path, reason, f["size"]))
+
+        # libraries without any version left lose their manifest, too
+        for name, manifest in manifests.items():
+            path = self._manifest.manifestPath(name)
+            if not manifest["versions"] and path in listed:
+                removals.append((path, UNREFERENCED, listed[path]["size"]))
+
+        return {
+            "files": files,
+            "manifests": manifests,
+            "changed": sorted(
+                name for name, manifest in manifests.items()
+                if json.dumps(manifest, sort_keys=True) != published[name]),
+            "index": index,
+            "published": published[None],
+            "pruned": pruned,
+            "removals": removals,
+        }
+
+    def _batches(self, plan):
+        """ Returns the paths to remove with as few requests as possible:
+            a folder is removed at once if nothing in it is kept.
+        """
+        removed = set(path for path, _, _ in plan["removals"])
+        kept = set()
+        for f in plan["files"]:
+            if f["path"] not in removed:
+                kept |= set(self._folders(f["path"]))
+        # the prefix itself is never removed
+        kept |= set(self._folders(self._prefix + INDEX))
+
+        batches = set()
+        for path in removed:
+            outermost = path
+            for folder in self._folders(path):
+                if folder in kept:
+                    break
+                outermost = folder
+            batches.add(outermost)
+        return sorted(batches)
+
+    def apply(self, plan, dryRun=False):
+        """ Publishes the pruned manifests and index first, so that clients
+            never see an entry of a removed file, and then removes the
+            artifacts. Returns a report of the removed artifacts per reason
+            as (count, bytes), the pruned manifest entries and the number
+            of requests.
+
+            :param plan: the plan, see :meth:`plan`
+            :param dryRun: (optional) only report what would be removed
+        """
+        report = {
+            "pruned": plan["pruned"],
+            "requests": 0,
+        }
+        for reason in [UNREFERENCED, SUPERSEDED, DUPLICATE]:
+            matches = [size for _, r, size in plan["removals"] if r == reason]
+            report[reason] = (len(matches), sum(matches))
+
+        batches = self._batches(plan)
+        if dryRun:
+            report["requests"] = len(batches)
+            return report
+
+        index = plan["index"]
+        for name, manifest in sorted(plan["manifests"].items()):
+            if manifest["versions"]:
+                if name in plan["changed"]:
+                    self._manifest.storeManifest(manifest)
+                index["libraries"].setdefault(name, {})
+                index["libraries"][name]["manifest"] = \
+                    self._manifest.manifestPath(name)
+                index["libraries"][name]["versions"] = sorted(
+                    manifest["versions"])
+            else:
+                index["libraries"].pop(name, None)
+        if json.dumps(index, sort_keys=True) != plan["published"]:
+            self._manifest.storeIndex(index)
+
+        for path in batches:
+            if self._archive:
+                self._artifactory.move(path, self._archive)
+            else:
+                self._artifactory.delete(path)
+            report["requests"] += 1
+        return report
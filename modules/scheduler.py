@@ -0,0 +1,203 @@
+import heapq
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def formatDuration(seconds):
+    """ Converts a number of seconds into a string like "1:02:03". """
+    seconds = int(round(max(seconds, 0)))
+    return "{}:{:02d}:{:02d}".format(
+        seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class Scheduler(object):
+    """ Runs a graph of tasks on a pool of worker threads. Whenever a worker
+        becomes free, the ready task with the longest remaining critical path
+        is started, i.e. the task whose predicted duration plus the longest
+        chain of tasks waiting for it is the largest. This way, long builds
+        and the builds they block start early instead of dominating the end
+        of the run. After every task, the progress and the estimated time
+        until all tasks are done are printed.
+    """
+
+    def __init__(self, workers, title="tasks", perGroup=None):
+        """ Initializes an instance of this class.
+
+            :param workers: the number of tasks that run at the same time
+            :param title: (optional) what the tasks are, for the progress
+                output
+            :param perGroup: (optional) the number of tasks of the same
+                group that run at the same time, see :meth:`add`
+        """
+        super(Scheduler, self).__init__()
+        self._workers = max(workers, 1)
+        self._title = title
+        self._perGroup = perGroup
+        self._tasks = {}
+        self._order = []
+
+    def add(self, key, func, cost, dependencies=(), label=None, group=None,
+            onCancel=None):
+        """ Adds a task to the graph.
+
+            :param key: a hashable that identifies the task
+            :param func: the callable that runs the task; the task failed
+                if it raises an exception or returns False
+            :param cost: the predicted duration of the task in seconds
+            :param dependencies: (optional) keys of the tasks that have to
+                be finished before this one starts; unknown keys are ignored
+            :param label: (optional) the name of the task in the progress
+                output
+            :param group: (optional) the group of the task, e.g. its
+                compiler; see perGroup
+            :param onCancel: (optional) the callable that is called with a
+                reason instead of func if a dependency failed
+        """
+        self._tasks[key] = {
+            "group": group,
+            "onCancel": onCancel,
+            "func": func,
+            "cost": cost,
+            "dependencies": list(dependencies),
+            "dependents": [],
+            "label": label if label is not None else str(key),
+        }
+        self._order.append(key)
+
+    def _criticalPaths(self):
+        """ Computes the remaining critical path of every task, i.e. its
+            cost plus the longest critical path of its dependents.
+        """
+        paths = {}
+
+        def visit(key):
+            if key not in paths:
+                task = self._tasks[key]
+                paths[key] = task["cost"] + max(
+                    [visit(dependent) for dependent in task["dependents"]],
+                    default=0)
+            return paths[key]
+
+        for key in self._order:
+            visit(key)
+        return paths
+
+    def _eta(self, paths, pending, running, now):
+        """ Estimates the time until all tasks are done: the remaining work
+            spread over all workers, but at least the longest remaining
+            critical path.
+        """
+        work = sum(self._tasks[key]["cost"] for key in pending)
+        longest = max([paths[key] for key in pending], default=0)
+        for key, start in running.items():
+            elapsed = now - start
+            work += max(self._tasks[key]["cost"] - elapsed, 0)
+            longest = max(longest, paths[key] - elapsed)
+        return max(work / self._workers, longest)
+
+    def _cancel(self, key, cancelled):
+        """ Cancels the transitive dependents of a failed task and returns
+            the keys of the newly cancelled tasks.
+        """
+        reason = "dependency {} failed".format(self._tasks[key]["label"])
+        keys = []
+        queue = list(self._tasks[key]["dependents"])
+        while queue:
+            dependent = queue.pop(0)
+            if dependent in cancelled:
+                continue
+            cancelled.add(dependent)
+            keys.append(dependent)
+            task = self._tasks[dependent]
+            if task["onCancel"] is not None:
+                task["onCancel"](reason)
+            queue += task["dependents"]
+        return keys
+
+    def run(self):
+        """ Runs all tasks and returns a dictionary of keys and the return
+            values of the tasks. Tasks raising an exception have None as
+            return value. The transitive dependents of a failed task are
+            never started; they are cancelled and have None as return value
+            as well.
+        """
+        waiting = {}
+        for key in self._order:
+            task = self._tasks[key]
+            task["dependencies"] = [dep for dep in task["dependencies"]
+                                    if dep in self._tasks]
+            waiting[key] = len(task["dependencies"])
+            for dep in task["dependencies"]:
+                self._tasks[dep]["dependents"].append(key)
+        paths = self._criticalPaths()
+
+        # ready tasks ordered by the longest critical path; the index keeps
+        # the insertion order for ties
+        ready = [(-paths[key], i, key) for i, key in enumerate(self._order)
+                 if waiting[key] == 0]
+        heapq.heapify(ready)
+        pending = set(self._order)
+        running = {}
+        futures = {}
+        results = {}
+        total = len(self._order)
+
+        groups = {}
+        cancelled = set()
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            while ready or futures:
+                # tasks of a group that is busy wait for the next round
+                deferred = []
+                while ready and len(futures) < self._workers:
+                    item = heapq.heappop(ready)
+                    key = item[2]
+                    group = self._tasks[key]["group"]
+                    if (group is not None and self._perGroup is not None and
+                            groups.get(group, 0) >= self._perGroup):
+                        deferred.append(item)
+                        continue
+                    groups[group] = groups.get(group, 0) + 1
+                    pending.discard(key)
+                    running[key] = time.time()
+                    futures[executor.submit(self._tasks[key]["func"])] = key
+                for item in deferred:
+                    heapq.heappush(ready, item)
+
+                done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = futures.pop(future)
+                    task = self._tasks[key]
+                    groups[task["group"]] -= 1
+                    duration = time.time() - running.pop(key)
+                    if future.exception() is not None:
+                        print("exception: {}".format(future.exception()))
+                        results[key] = None
+                        failed = True
+                    else:
+                        results[key] = future.result()
+                        failed = results[key] is False
+
+                    # the dependents of a failed task are bound to fail, so
+                    # they are dropped together with everything after them
+                    if failed:
+                        for dependent in self._cancel(key, cancelled):
+                            pending.discard(dependent)
+                            results[dependent] = None
+                            print("[{}/{} {}] {} cancelled".format(
+                                len(results), total, self._title,
+                                self._tasks[dependent]["label"]))
+
+                    for dependent in task["dependents"]:
+                        waiting[dependent] -= 1
+                        if waiting[dependent] == 0 and (
+                                dependent not in cancelled):
+                            heapq.heappush(ready, (
+                                -paths[dependent],
+                                self._order.index(dependent), dependent))
+
+                    print("[{}/{} {}] {} finished after {}, ETA {}".format(
+                        len(results), total, self._title, task["label"],
+                        formatDuration(duration), formatDuration(self._eta(
+                            paths, pending, running, time.time()))))
+
+        return results
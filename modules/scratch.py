@@ -0,0 +1,118 @@
+import json
+import os
+import shutil
+import threading
+
+from .diskbudget import DiskBudget, parseSize
+
+
+class ScratchSpace(object):
+    """ Fast scratch volume for the build directories, e.g. a RAM disk, so
+        that the object file churn of parallel builds does not compete with
+        the downloads and IDA for the bandwidth of the main disk. Only the
+        build directories live there; the install trees are still written
+        to the binary paths on disk.
+
+        Before a build, room for its build directory is reserved based on
+        the largest build directory of the library seen so far. Builds that
+        do not fit into the budget or the free space of the volume are done
+        on disk instead.
+    """
+
+    def __init__(self, root, sizesPath, budget=None, reserve="2G",
+                 minFree="512M"):
+        """ Initializes an instance of this class and loads the sizes of
+            previous build directories.
+
+            :param root: the directory on the scratch volume
+            :param sizesPath: the path of the JSON file holding the size of
+                the build directory of every target, grouped by library
+            :param budget: (optional) the maximum size of all build
+                directories in the scratch space, e.g. "16G"; without a
+                budget, only the free space of the volume counts
+            :param reserve: (optional) the space reserved for libraries
+                that were never built before
+            :param minFree: (optional) space that is always left free on
+                the volume
+        """
+        super(ScratchSpace, self).__init__()
+        self._root = root
+        self._sizesPath = sizesPath
+        self._budget = parseSize(budget)
+        self._reserve = parseSize(reserve)
+        self._minFree = parseSize(minFree)
+        self._lock = threading.Lock()
+        self._reserved = {}
+        self._sizes = {}
+        os.makedirs(root, exist_ok=True)
+        if os.path.exists(sizesPath):
+            try:
+                with open(sizesPath, "r") as f:
+                    self._sizes = json.load(f)
+            except ValueError:
+                print("Ignoring corrupt scratch sizes {}".format(sizesPath))
+
+    def _estimate(self, target, name):
+        """ Returns the space to reserve for the build directory of a
+            target: its size in the last build, else the largest build
+            directory of the same library, else the default reservation.
+        """
+        sizes = self._sizes.get(name, {})
+        if target in sizes:
+            return sizes[target]
+        return max(sizes.values()) if sizes else self._reserve
+
+    def _free(self):
+        return shutil.disk_usage(self._root).free
+
+    def acquire(self, target, name):
+        """ Reserves room for a build directory and returns its path, or
+            None if the build has to be done on disk.
+
+            :param target: the name of the build directory, i.e.
+                "<name>-<version>_<compiler>"
+            :param name: the name of the library; the target cannot be
+                split reliably, as versions and compilers may contain
+                dashes
+        """
+        size = self._estimate(target, name)
+        with self._lock:
+            reserved = sum(size for _, size in self._reserved.values())
+            if (self._budget is not None and
+                    reserved + size > self._budget):
+                return None
+            # the reservations of running builds are only partly used yet
+            if self._free() - (reserved + size) < self._minFree:
+                return None
+            path = os.path.join(self._root, target).replace("\\", "/")
+            self._reserved[path] = (name, size)
+
+        # a leftover of an aborted run
+        shutil.rmtree(path, ignore_errors=True)
+        return path
+
+    def full(self):
+        """ Checks whether the volume ran out of space. """
+        return self._free() < self._minFree
+
+    def release(self, path):
+        """ Records the size of a build directory, removes it and frees its
+            reservation.
+
+            :param path: the path returned by :meth:`acquire`
+        """
+        size = DiskBudget.usage(path) if os.path.exists(path) else 0
+        shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            name, _ = self._reserved.pop(path, (None, 0))
+            target = os.path.basename(path)
+            if size > 0 and name is not None:
+                self._sizes.setdefault(name, {})[target] = size
+
+    def save(self):
+        """ Writes the sizes of the build directories back to disk. """
+        with self._lock:
+            tmp = self._sizesPath + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._sizes, f, indent=1, sort_keys=True)
+            os.replace(tmp, self._sizesPath)
@@ -0,0 +1,168 @@
+import asyncio
+import gzip
+import os
+import threading
+from contextlib import nullcontext
+
+from .governor import ResourceGovernor
+
+
+class ProcessError(Exception):
+    """ Raised if a child process exits with a non-zero exit code. """
+
+    def __init__(self, name, returncode, logfile):
+        message = "{} failed with exit code {}".format(name, returncode)
+        if logfile is not None:
+            message += ", see {}".format(logfile)
+        super(ProcessError, self).__init__(message)
+        self.name = name
+        self.returncode = returncode
+        self.logfile = logfile
+
+
+class ProcessSupervisor(object):
+    """ Launches all child processes (CMake, build scripts, IDA) from a single
+        asyncio event loop running in a background thread. The loop enforces
+        a global limit of concurrently running children, streams the output
+        of every child into a compressed per-task log file and checks the
+        exit codes. The worker threads of the stages only wait for their
+        children, so no additional Python interpreters are needed.
+
+        With a :class:`ResourceGovernor`, every child first acquires the
+        resources of its kind, and the memory peak of the child and its
+        descendants is reported back to the governor.
+    """
+
+    def __init__(self, logPrefix, maxProcesses=None, governor=None):
+        """ Initializes an instance of this class.
+
+            :param logPrefix: the directory where the log files are stored
+            :param maxProcesses: (optional) maximum number of concurrently
+                running child processes; defaults to the number of CPUs
+            :param governor: (optional) the resource governor shared by all
+                stages
+        """
+        super(ProcessSupervisor, self).__init__()
+        self._logPrefix = logPrefix
+        self._maxProcesses = maxProcesses or os.cpu_count() or 1
+        self._governor = governor
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._running = 0
+
+    @property
+    def maxProcesses(self):
+        return self._maxProcesses
+
+    @property
+    def governor(self):
+        return self._governor
+
+    def resources(self, kind, **demand):
+        """ Returns a context manager holding the resources of a task of a
+            kind, e.g. an upload; without a governor, it does nothing.
+        """
+        if self._governor is None or kind is None:
+            return nullcontext()
+        return self._governor.use(kind, **demand)
+
+    @property
+    def running(self):
+        """ Returns the number of running child processes. """
+        return self._running
+
+    def __enter__(self):
+        if not os.path.exists(self._logPrefix):
+            os.makedirs(self._logPrefix)
+
+        if os.name == "nt":
+            # only the proactor loop supports child processes on Windows
+            self._loop = asyncio.ProactorEventLoop()
+        else:
+            self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+
+        # synchronization primitives have to be created within the loop
+        self._submit(self._setup()).result()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _setup(self):
+        self._semaphore = asyncio.Semaphore(self._maxProcesses)
+
+    def _submit(self, coroutine):
+        """ Schedules a coroutine on the event loop from any thread. """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def logfile(self, name):
+        """ Returns the path of the log file of a task. """
+        return os.path.join(self._logPrefix, name + ".log.gz")
+
+    @staticmethod
+    async def _pump(stream, log):
+        """ Copies the output of a child line by line into the log. """
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            log.write(line)
+
+    async def _sample(self, proc, kind, interval=1.0):
+        """ Reports the memory peak of a child and its descendants to the
+            governor once the child exited.
+        """
+        peak = 0
+        try:
+            while proc.returncode is None:
+                peak = max(peak, ResourceGovernor.peakMemory(proc.pid))
+                await asyncio.sleep(interval)
+        finally:
+            if peak > 0:
+                self._governor.observe(kind, peak)
+
+    async def _run(self, args, name, cwd, env, kind):
+        """ Runs a child process and returns its exit code. """
+        async with self._semaphore:
+            self._running += 1
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *args, cwd=cwd, env=env, stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE)
+                sampler = None
+                if self._governor is not None and kind is not None:
+                    sampler = asyncio.ensure_future(self._sample(proc, kind))
+                with gzip.open(self.logfile(name), "wb") as log:
+                    await asyncio.gather(self._pump(proc.stdout, log),
+                                         self._pump(proc.stderr, log))
+                    returncode = await proc.wait()
+                if sampler is not None:
+                    sampler.cancel()
+                return returncode
+            finally:
+                self._running -= 1
+
+    def run(self, args, name, cwd=None, env=None, kind=None):
+        """ Runs a child process and blocks until it exits. May be called
+            from any thread. Raises a :class:`ProcessError` if the child
+            exits with a non-zero exit code.
+
+            :param args: the command line of the child process
+            :param name: the name of the task, used for the log file
+            :param cwd: (optional) the working directory of the child
+            :param env: (optional) the environment of the child
+            :param kind: (optional) the kind of the task, e.g. "build"; the
+                child waits for the resources of its kind
+        """
+        with self.resources(kind):
+            returncode = self._submit(
+                self._run(args, name, cwd, env, kind)).result()
+        if returncode != 0:
+            raise ProcessError(name, returncode, self.logfile(name))
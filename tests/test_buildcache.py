@@ -0,0 +1,125 @@
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from modules.buildcache import BuildCache
+
+COMPILER = {"generator": "Visual Studio 14 2015 Win64", "short": "msvc14",
+            "version": "19.0"}
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """ Stands in for the artifactory: plain GET and PUT of the files below
+        the root.
+    """
+    root = None
+
+    def _file(self):
+        return os.path.join(self.root, self.path.lstrip("/"))
+
+    def _send(self, code, body=b""):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if not os.path.isfile(self._file()):
+            return self._send(404)
+        with open(self._file(), "rb") as f:
+            self._send(200, f.read())
+
+    def do_PUT(self):
+        os.makedirs(os.path.dirname(self._file()), exist_ok=True)
+        with open(self._file(), "wb") as f:
+            f.write(self.rfile.read(int(self.headers["Content-Length"])))
+        self._send(201)
+
+    def log_message(self, *args):
+        pass
+
+
+def makeLib(sourcehash="abc", dependencies=None):
+    return {"sourcehash": sourcehash, "customcmake": None,
+            "dependencies": dependencies, "cmakeflags": ["BUILD_SHARED=ON"],
+            "custombuild": None}
+
+
+class BuildCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        StubHandler.root = os.path.join(self.tmp, "server")
+        self.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.cache = BuildCache("http://127.0.0.1:{}/repo/".format(
+            self.server.server_port), ("user", "password"))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def write(self, path, data):
+        path = os.path.join(self.tmp, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def test_builds_are_stored_and_fetched(self):
+        self.write("bin/zlib-1.2.11_msvc14/bin/zlib.dll", b"dll")
+        self.write("bin/zlib-1.2.11_msvc14/bin/zlib.idb", b"database")
+        self.write("bin/zlib-1.2.11_msvc14/include/zlib.h", b"header")
+        self.cache.store("zlib", "1.2.11", COMPILER, "key",
+                         os.path.join(self.tmp, "bin/zlib-1.2.11_msvc14"))
+
+        # the leftovers of a broken build are replaced by the cached tree
+        binpath = os.path.join(self.tmp, "other/zlib-1.2.11_msvc14")
+        self.write("other/zlib-1.2.11_msvc14/bin/broken.dll", b"")
+        self.assertTrue(self.cache.fetch("zlib", "1.2.11", COMPILER, "key",
+                                         binpath))
+
+        files = sorted(os.path.relpath(os.path.join(root, f), binpath)
+                       for root, _, names in os.walk(binpath)
+                       for f in names)
+        self.assertEqual(files, [os.path.join("bin", "zlib.dll"),
+                                 os.path.join("include", "zlib.h")])
+        with open(os.path.join(binpath, "bin", "zlib.dll"), "rb") as f:
+            self.assertEqual(f.read(), b"dll")
+
+    def test_unknown_builds_are_missed(self):
+        binpath = os.path.join(self.tmp, "bin/zlib-1.2.11_msvc14")
+        self.assertFalse(self.cache.fetch("zlib", "1.2.11", COMPILER, "key",
+                                          binpath))
+        self.assertFalse(os.path.exists(binpath))
+
+    def test_key_covers_the_build_inputs(self):
+        libs = {"zlib": {"1.2.11": makeLib()},
+                "png": {"1.6": makeLib("def", {"zlib": "1.2.11"})}}
+        key = self.cache.key(libs, "png", "1.6", COMPILER)
+        self.assertEqual(key, self.cache.key(libs, "png", "1.6", COMPILER))
+
+        # the kind of the compiler launcher counts, but not its location
+        ccache = self.cache.key(libs, "png", "1.6", COMPILER,
+                                "/usr/bin/ccache")
+        self.assertNotEqual(ccache, key)
+        self.assertEqual(ccache, self.cache.key(
+            libs, "png", "1.6", COMPILER, "/opt/ccache/bin/ccache"))
+        self.assertNotEqual(ccache, self.cache.key(
+            libs, "png", "1.6", COMPILER, "/usr/bin/sccache"))
+
+        # so do the sources of the dependencies
+        libs["zlib"]["1.2.11"]["sourcehash"] = "abd"
+        self.assertNotEqual(key, self.cache.key(libs, "png", "1.6",
+                                                COMPILER))
+        libs["zlib"]["1.2.11"]["sourcehash"] = None
+        self.assertIsNone(self.cache.key(libs, "png", "1.6", COMPILER))
+
+
+if __name__ == "__main__":
+    unittest.main()
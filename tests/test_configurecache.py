@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from modules.configurecache import ConfigureCache
+
+COMPILER = {"generator": "Visual Studio 14 2015 Win64", "short": "msvc14",
+            "version": "19.0"}
+CMAKE = "C:/cmake/bin/cmake.exe"
+
+
+class ConfigureCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = ConfigureCache(os.path.join(self.tmp, "configurecache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, path, text):
+        path = os.path.join(self.tmp, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(text)
+        return os.path.dirname(path)
+
+    def sources(self, version, checks):
+        return self.write(
+            "zlib-{}/CMakeLists.txt".format(version),
+            "project(zlib VERSION {})\n{}\n".format(version, checks))
+
+    def test_versions_with_the_same_probes_share_them(self):
+        old = self.sources("1.2.10", "check_include_file(unistd.h "
+                                     "HAVE_UNISTD_H)")
+        new = self.sources("1.2.11", "CHECK_INCLUDE_FILE(unistd.h\n"
+                                     "    HAVE_UNISTD_H)")
+        other = self.sources("1.3", "check_include_file(stdint.h "
+                                    "HAVE_STDINT_H)")
+
+        self.assertEqual(self.cache.checks(old), self.cache.checks(new))
+        self.assertNotEqual(self.cache.checks(old), self.cache.checks(other))
+
+    def test_probes_are_captured_and_seeded(self):
+        sources = self.sources("1.2.11", "check_type_size(off64_t OFF64_T)")
+        checks = self.cache.checks(sources)
+        self.assertEqual(self.cache.cmakeArgs("zlib", COMPILER, CMAKE,
+                                              checks), [])
+
+        build = self.write("build/CMakeCache.txt",
+                           "HAVE_OFF64_T:INTERNAL=\n"
+                           "SIZEOF_VOID_P:INTERNAL=8\n"
+                           "CMAKE_BUILD_TYPE:STRING=Release\n")
+        self.cache.capture("zlib", COMPILER, CMAKE, checks, build)
+
+        args = self.cache.cmakeArgs("zlib", COMPILER, CMAKE, checks)
+        self.assertEqual(args[0], "-C")
+        with open(args[1], "r") as f:
+            seed = f.read()
+        self.assertIn('set(HAVE_OFF64_T "" CACHE INTERNAL "")', seed)
+        self.assertIn('set(SIZEOF_VOID_P "8" CACHE INTERNAL "")', seed)
+        self.assertNotIn("CMAKE_BUILD_TYPE", seed)
+
+        self.cache.invalidate("zlib", COMPILER, CMAKE, checks)
+        self.assertEqual(self.cache.cmakeArgs("zlib", COMPILER, CMAKE,
+                                              checks), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
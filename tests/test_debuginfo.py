@@ -0,0 +1,140 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import uuid
+
+from modules.debuginfo import (MSF_MAGIC, PdbSearchCache, dllSignature,
+                               matchPdb, pdbSignature)
+
+GUID = uuid.UUID("12345678-9abc-def0-1234-56789abcdef0").bytes_le
+
+
+def makeDll(guid=GUID, age=3, pdbPath=b"C:\\build\\zlib.pdb"):
+    """ Returns a minimal PE32+ image with one section holding the debug
+        directory and its CodeView record.
+    """
+    data = bytearray(0x400)
+    data[:2] = b"MZ"
+    struct.pack_into("<I", data, 0x3c, 0x80)
+    data[0x80:0x84] = b"PE\0\0"
+    coff = 0x84
+    optionalSize = 112 + 16 * 8
+    struct.pack_into("<HHIIIHH", data, coff, 0x8664, 1, 0, 0, 0,
+                     optionalSize, 0x2022)
+    optional = coff + 20
+    struct.pack_into("<H", data, optional, 0x20b)
+    struct.pack_into("<I", data, optional + 108, 16)
+    # the debug directory, entry 6 of the data directories
+    struct.pack_into("<II", data, optional + 112 + 6 * 8, 0x1000, 28)
+    # a single section mapping RVA 0x1000 to the file offset 0x200
+    section = optional + optionalSize
+    data[section:section + 8] = b".rdata\0\0"
+    struct.pack_into("<IIII", data, section + 8, 0x200, 0x1000, 0x200,
+                     0x200)
+    record = b"RSDS" + guid + struct.pack("<I", age) + pdbPath + b"\0"
+    struct.pack_into("<IIHHIIII", data, 0x200, 0, 0, 0, 0, 2, len(record),
+                     0x1040, 0x240)
+    data[0x240:0x240 + len(record)] = record
+    return bytes(data)
+
+
+def makePdb(guid=GUID, age=3, blockSize=512):
+    """ Returns a minimal MSF 7.0 file with a PDB info stream and the age
+        field of a DBI stream.
+    """
+    blocks = [bytearray(blockSize) for _ in range(5)]
+    info = struct.pack("<III", 20000404, 0, 1) + guid
+    dbi = struct.pack("<iII", -1, 19990903, age)
+    # streams 0 and 2 are empty, stream 1 is in block 3, stream 3 in block 4
+    directory = struct.pack("<I4I2I", 4, 0, len(info), 0, len(dbi), 3, 4)
+    struct.pack_into("<IIIIII", blocks[0], len(MSF_MAGIC), blockSize, 1,
+                     len(blocks), len(directory), 0, 1)
+    blocks[0][:len(MSF_MAGIC)] = MSF_MAGIC
+    struct.pack_into("<I", blocks[1], 0, 2)
+    blocks[2][:len(directory)] = directory
+    blocks[3][:len(info)] = info
+    blocks[4][:len(dbi)] = dbi
+    return b"".join(bytes(block) for block in blocks)
+
+
+class DebugInfoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.dll = self.write("bin/zlib.dll", makeDll())
+        self.pdb = os.path.join(self.tmp, "bin", "zlib.pdb")
+        self.build = os.path.join(self.tmp, "build")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, path, data):
+        path = os.path.join(self.tmp, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_signature_of_a_dll(self):
+        signature = dllSignature(self.dll)
+        self.assertEqual(signature.guid, GUID)
+        self.assertEqual(signature.age, 3)
+        self.assertEqual(signature.pdbPath, "C:\\build\\zlib.pdb")
+
+    def test_signature_of_a_pdb(self):
+        self.write("bin/zlib.pdb", makePdb())
+        self.assertEqual(pdbSignature(self.pdb), dllSignature(self.dll))
+        self.write("bin/zlib.pdb", makePdb(age=4))
+        self.assertNotEqual(pdbSignature(self.pdb), dllSignature(self.dll))
+
+    def test_files_without_signature(self):
+        truncated = self.write("truncated.dll", makeDll()[:0x100])
+        self.assertIsNone(dllSignature(truncated))
+        self.assertIsNone(dllSignature(self.write("empty.dll", b"")))
+        self.assertIsNone(pdbSignature(self.write("old.pdb", b"JG" * 64)))
+        self.assertIsNone(pdbSignature(
+            self.write("truncated.pdb", makePdb()[:600])))
+
+    def test_matching_pdb_is_taken_from_the_build_tree(self):
+        self.write("bin/zlib.pdb", makePdb(age=2))
+        self.write("build/old/zlib.pdb", makePdb(age=1))
+        self.write("build/zlib.dir/Release/zlib.pdb", makePdb())
+
+        pdb, reason = matchPdb(self.dll, self.pdb, [self.build])
+
+        self.assertEqual((pdb, reason), (self.pdb, None))
+        self.assertEqual(pdbSignature(self.pdb), dllSignature(self.dll))
+
+    def test_stale_pdb_is_rejected(self):
+        self.write("bin/zlib.pdb", makePdb(age=2))
+
+        pdb, reason = matchPdb(self.dll, self.pdb, [self.build])
+
+        self.assertIsNone(pdb)
+        self.assertIn("does not match", reason)
+
+    def test_failed_searches_are_remembered(self):
+        cache = PdbSearchCache(os.path.join(self.tmp, "pdbsearch.json"))
+        self.assertEqual(matchPdb(self.dll, self.pdb, [self.build], cache)[0],
+                         None)
+        cache.save()
+
+        # the PDB appears in the tree, but the DLL did not change
+        self.write("build/zlib.pdb", makePdb())
+        cache = PdbSearchCache(os.path.join(self.tmp, "pdbsearch.json"))
+        self.assertTrue(cache.missed(self.dll))
+        self.assertEqual(matchPdb(self.dll, self.pdb, [self.build], cache)[0],
+                         None)
+
+        # a relinked DLL is searched for again
+        self.write("bin/zlib.dll", makeDll(pdbPath=b"zlib.pdb"))
+        os.utime(self.dll, (0, 0))
+        self.assertEqual(matchPdb(self.dll, self.pdb, [self.build], cache)[0],
+                         self.pdb)
+        self.assertFalse(cache.missed(self.dll))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import http.server
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from modules.discovery import VersionDiscovery
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """ Stands in for an index page and the tag listing of the GitHub API:
+        serves the bodies of ``pages`` with an ETag, answers a matching
+        If-None-Match with a 304, and records the paths of all requests.
+    """
+    pages = {}
+    links = {}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path not in self.pages:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.pages[self.path].encode()
+        etag = '"{}"'.format(abs(hash(body)))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        if self.path in self.links:
+            self.send_header("Link", '<http://{}:{}{}>; rel="next"'.format(
+                *self.server.server_address, self.links[self.path]))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DiscoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "discovery.json")
+        StubHandler.pages = {}
+        StubHandler.links = {}
+        StubHandler.requests = []
+        self.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.base = "http://127.0.0.1:{}/".format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def discovery(self):
+        return VersionDiscovery(self.path, githubApi=self.base + "api/")
+
+    def test_links_of_an_index_page(self):
+        StubHandler.pages["/zlib/"] = (
+            '<a href="zlib-1.2.11.tar.gz">1.2.11</a>'
+            "<a HREF='zlib-1.2.12.tar.gz#sig'>1.2.12</a>"
+            '<a href = "/zlib/zlib-1.3%2Bdfsg.tar.gz?raw=1">1.3</a>'
+            '<a href="zlib-1.2.11.tar.gz">again</a>'
+            '<a href="README">readme</a>')
+        args = {"discover": {"url": self.base + "zlib/",
+                             "regex": r"zlib-([\d.]+(\+dfsg)?)\.tar\.gz"}}
+
+        pairs = self.discovery().discover("zlib", args)
+
+        self.assertEqual(pairs, [
+            ("1.2.11", self.base + "zlib/zlib-1.2.11.tar.gz"),
+            ("1.2.12", self.base + "zlib/zlib-1.2.12.tar.gz"),
+            ("1.3+dfsg", self.base + "zlib/zlib-1.3+dfsg.tar.gz"),
+        ])
+
+    def test_tags_are_followed_through_all_pages(self):
+        first = "/api/repos/madler/zlib/tags?per_page=100"
+        StubHandler.pages[first] = json.dumps(
+            [{"name": "v1.3"}, {"name": "v1.2.13"}])
+        StubHandler.pages["/api/page2"] = json.dumps(
+            [{"name": "v1.2.12"}, {"name": "nightly"}])
+        StubHandler.links[first] = "/api/page2"
+        args = {"discover": {"github": "madler/zlib", "regex": r"^v(.+)$"},
+                "filetype": "zip"}
+
+        pairs = self.discovery().discover("zlib", args)
+
+        self.assertEqual([version for version, _ in pairs],
+                         ["1.3", "1.2.13", "1.2.12"])
+        self.assertEqual(
+            pairs[0][1], "https://github.com/madler/zlib/archive/v1.3.zip")
+
+        # a url template of the library takes precedence over the tag
+        args["url"] = "https://zlib.net/zlib-{version}.tar.gz"
+        pairs = self.discovery().discover("zlib", args)
+        self.assertEqual(pairs[2][1], "https://zlib.net/zlib-1.2.12.tar.gz")
+
+    def test_unchanged_listings_are_reused(self):
+        StubHandler.pages["/zlib/"] = '<a href="zlib-1.2.11.tar.gz">'
+        args = {"discover": {"url": self.base + "zlib/",
+                             "regex": r"zlib-([\d.]+)\.tar\.gz"}}
+        discovery = self.discovery()
+        first = discovery.discover("zlib", args)
+        # within a run, a listing is only requested once
+        self.assertEqual(discovery.discover("zlib", args), first)
+        self.assertEqual(len(StubHandler.requests), 1)
+        discovery.save()
+
+        # the next run asks with the ETag and reuses the body on a 304
+        discovery = self.discovery()
+        self.assertEqual(discovery.discover("zlib", args), first)
+        self.assertEqual(len(StubHandler.requests), 2)
+        self.assertIsNotNone(StubHandler.requests[1][1])
+
+        # the cached body is also used while the upstream is unreachable
+        self.server.shutdown()
+        self.server.server_close()
+        discovery.refresh()
+        self.assertEqual(discovery.discover("zlib", args), first)
+
+    def test_changed_listings_are_fetched_again(self):
+        StubHandler.pages["/zlib/"] = '<a href="zlib-1.2.11.tar.gz">'
+        args = {"discover": {"url": self.base + "zlib/",
+                             "regex": r"zlib-([\d.]+)\.tar\.gz"}}
+        discovery = self.discovery()
+        discovery.discover("zlib", args)
+
+        StubHandler.pages["/zlib/"] += '<a href="zlib-1.3.tar.gz">'
+        discovery.refresh()
+
+        self.assertEqual([v for v, _ in discovery.discover("zlib", args)],
+                         ["1.2.11", "1.3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
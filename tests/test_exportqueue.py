@@ -0,0 +1,161 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from modules import exportqueue
+from modules.exportqueue import ExportQueue, ExportWorker
+
+
+class StubHelper(object):
+    """ Stands in for the :class:`IDAHelper` and idaq: the "analysis"
+        writes the database and the features next to the DLL.
+    """
+
+    def __init__(self, dll, pdb, profile=None, duration=0, fail=False,
+                 queue=None):
+        self.dll = dll
+        self.pdb = pdb
+        self.idb = dll[:-4] + ".i64"
+        self.features = dll[:-4] + ".features.json"
+        self.profile = profile
+        self.exporterVersion = 7
+        self.uploads = ["bin/zlib.dll"]
+        self._duration = duration
+        self._fail = fail
+        self._queue = queue
+        self.abandoned = None
+
+    def makeidb(self):
+        time.sleep(self._duration)
+        if self._queue is not None:
+            # another host looks for abandoned claims meanwhile
+            self.abandoned = self._queue.requeue(self._duration / 2)
+        if self._fail:
+            raise RuntimeError("idaq crashed")
+        with open(self.dll, "rb") as f:
+            dll = f.read()
+        with open(self.idb, "wb") as f:
+            f.write(b"database of " + dll)
+        with open(self.features, "w") as f:
+            f.write("{}")
+
+    def reexport(self):
+        with open(self.idb, "ab") as f:
+            f.write(b" upgraded")
+
+    def storeresult(self, onlyIdb=False):
+        return True
+
+
+class ExportQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.queue = ExportQueue(os.path.join(self.tmp, "queue"))
+        self.helpers = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def helper(self, name, **kwargs):
+        dll = os.path.join(self.tmp, "bin", name + ".dll")
+        os.makedirs(os.path.dirname(dll), exist_ok=True)
+        for path, data in [(dll, name.encode()), (dll[:-4] + ".pdb", b"")]:
+            with open(path, "wb") as f:
+                f.write(data)
+        return StubHelper(dll, dll[:-4] + ".pdb", **kwargs)
+
+    def worker(self, **kwargs):
+        def makeHelper(dll, pdb, profile):
+            helper = StubHelper(dll, pdb, profile, queue=self.queue,
+                                **kwargs)
+            self.helpers.append(helper)
+            return helper
+        return ExportWorker(self.queue, os.path.join(self.tmp, "work"),
+                            makeHelper, "worker")
+
+    def test_jobs_are_claimed_by_priority(self):
+        small = self.queue.submit(self.helper("small"), "small-1_c",
+                                  priority=10)
+        large = self.queue.submit(self.helper("large"), "large-1_c",
+                                  priority=500)
+
+        self.assertEqual(self.queue.pending(), 2)
+        self.assertEqual(self.queue.claim()["id"], large)
+        self.assertEqual(self.queue.claim()["id"], small)
+        self.assertIsNone(self.queue.claim())
+
+    def test_results_are_returned(self):
+        jobId = self.queue.submit(self.helper("zlib", profile="fast"),
+                                  "zlib-1.2.11_msvc14")
+
+        self.assertTrue(self.worker().runOnce())
+        self.assertFalse(self.worker().runOnce())
+
+        result = self.queue.result(jobId)
+        self.assertTrue(result["success"])
+        self.assertEqual(result["exporter"], 7)
+        self.assertEqual(result["uploads"], ["bin/zlib.dll"])
+        self.assertEqual(self.helpers[0].profile, "fast")
+        # the database and the features come back through the files
+        files = self.queue.files(jobId)
+        with open(os.path.join(files, result["idb"]), "rb") as f:
+            self.assertEqual(f.read(), b"database of zlib")
+        self.assertTrue(os.path.exists(
+            os.path.join(files, result["features"])))
+        # the work tree of the worker is cleaned up
+        self.assertEqual(os.listdir(os.path.join(self.tmp, "work")), [])
+
+        self.queue.remove(jobId)
+        self.assertIsNone(self.queue.result(jobId))
+        self.assertFalse(os.path.exists(files))
+
+    def test_failures_are_returned(self):
+        jobId = self.queue.submit(self.helper("zlib"), "zlib-1.2.11_msvc14")
+
+        self.worker(fail=True).runOnce()
+
+        result = self.queue.result(jobId)
+        self.assertFalse(result["success"])
+        self.assertEqual(result["message"], "idaq crashed")
+
+    def test_expired_claims_are_requeued(self):
+        jobId = self.queue.submit(self.helper("zlib"), "zlib-1.2.11_msvc14")
+        job = self.queue.claim()
+        self.assertEqual(self.queue.requeue(60), 0)
+
+        # the worker crashed and stopped renewing its claim
+        path = os.path.join(self.queue.path, exportqueue.CLAIMED,
+                            os.listdir(os.path.join(self.queue.path,
+                                                    exportqueue.CLAIMED))[0])
+        os.utime(path, (time.time() - 120, time.time() - 120))
+        self.assertEqual(self.queue.requeue(60), 1)
+        self.assertFalse(self.queue.renew(job))
+        self.assertEqual(self.queue.pending(), 1)
+
+        # a late result of the first worker removes the requeued copy
+        self.queue.finish(job, True)
+        self.assertEqual(self.queue.pending(), 0)
+        self.assertTrue(self.queue.result(jobId)["success"])
+
+    def test_running_jobs_keep_their_claim(self):
+        heartbeat = exportqueue.HEARTBEAT
+        exportqueue.HEARTBEAT = 0.05
+        try:
+            jobId = self.queue.submit(self.helper("zlib"),
+                                      "zlib-1.2.11_msvc14")
+            self.worker(duration=0.5).runOnce()
+        finally:
+            exportqueue.HEARTBEAT = heartbeat
+
+        # the claim was renewed while the export ran for longer than the
+        # lease, so the job was not handed out twice
+        self.assertEqual(self.helpers[0].abandoned, 0)
+        self.assertTrue(self.queue.result(jobId)["success"])
+        self.assertEqual(self.queue.pending(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from modules.artifactory import Artifactory
+from modules.mirrors import MirrorSelector, mirrorUrls
+
+ARCHIVE = b"zlib source archive" * 100
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """ Stands in for the upstream, the mirrors and the artifactory: serves
+        the bodies of ``files`` and accepts PUT uploads into them. HEAD
+        requests of the upstream are slow, so that the mirrors rank first.
+    """
+    files = {}
+    requests = []
+
+    def _send(self, code, body=b"", head=False):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        if self.path.startswith("/upstream/"):
+            time.sleep(0.2)
+        if self.path not in self.files:
+            return self._send(404, head=True)
+        self._send(200, self.files[self.path], head=True)
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.path not in self.files:
+            return self._send(404)
+        self._send(200, self.files[self.path])
+
+    def do_PUT(self):
+        self.files[self.path] = self.rfile.read(
+            int(self.headers["Content-Length"]))
+        self._send(201)
+
+    def log_message(self, *args):
+        pass
+
+
+class MirrorSelectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        StubHandler.files = {"/upstream/zlib-1.2.11.tar.gz": ARCHIVE}
+        StubHandler.requests = []
+        self.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.base = "http://127.0.0.1:{}/".format(self.server.server_port)
+        self.urls = mirrorUrls(self.base + "upstream/zlib-1.2.11.tar.gz",
+                               "1.2.11", [self.base + "mirror/"])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def selector(self, **kwargs):
+        return MirrorSelector(os.path.join(self.tmp, "mirrors.json"),
+                              **kwargs)
+
+    def test_archives_are_fetched_from_the_mirror(self):
+        StubHandler.files["/mirror/zlib-1.2.11.tar.gz"] = ARCHIVE
+
+        data = self.selector().fetch(self.urls, "zlib-1.2.11.tar.gz")
+
+        self.assertEqual(data, ARCHIVE)
+        self.assertEqual(StubHandler.requests,
+                         ["/mirror/zlib-1.2.11.tar.gz"])
+
+    def test_truncated_archives_of_mirrors_are_ignored(self):
+        StubHandler.files["/mirror/zlib-1.2.11.tar.gz"] = ARCHIVE[:100]
+
+        data = self.selector().fetch(self.urls, "zlib-1.2.11.tar.gz")
+
+        self.assertEqual(data, ARCHIVE)
+        self.assertEqual(StubHandler.requests,
+                         ["/mirror/zlib-1.2.11.tar.gz",
+                          "/upstream/zlib-1.2.11.tar.gz"])
+
+    def test_source_mirror_is_verified_and_filled(self):
+        artifactory = Artifactory(self.base + "art/", ("user", "password"))
+        selector = self.selector(artifactory=artifactory, push=True)
+        path = "/art/" + selector._mirrorPath(self.urls,
+                                              "zlib-1.2.11.tar.gz", "zlib")
+        StubHandler.files[path] = b"an interrupted upload"
+
+        data = selector.fetch(self.urls[-1:], "zlib-1.2.11.tar.gz", "zlib")
+
+        # the broken copy is replaced by the verified upstream archive
+        self.assertEqual(data, ARCHIVE)
+        self.assertEqual(StubHandler.files[path], ARCHIVE)
+        self.assertEqual(self.selector(artifactory=artifactory).fetch(
+            self.urls[-1:], "zlib-1.2.11.tar.gz", "zlib"), ARCHIVE)
+        self.assertEqual(StubHandler.requests.count(
+            "/upstream/zlib-1.2.11.tar.gz"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
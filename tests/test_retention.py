@@ -0,0 +1,174 @@
+import datetime
+import hashlib
+import http.server
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from modules.artifactory import Artifactory
+from modules.manifest import Manifest
+from modules.retention import Retention, SUPERSEDED, UNREFERENCED
+
+# the repository is served below this path, like in the artifactory
+PREFIX = "/artifactory/"
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """ Stands in for the artifactory: plain GET, PUT and DELETE of the
+        files below the root, and the listing of the storage API.
+    """
+    root = None
+
+    def _file(self):
+        path = self.path.split("?")[0].split(";")[0][len(PREFIX):]
+        return os.path.join(self.root, path)
+
+    def _send(self, code, body=b""):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith(PREFIX + "api/storage/"):
+            folder = os.path.join(self.root, self.path.split("?")[0][
+                len(PREFIX + "api/storage/"):])
+            if not os.path.isdir(folder):
+                return self._send(404)
+            files = []
+            for dirpath, _, names in os.walk(folder):
+                for name in names:
+                    path = os.path.join(dirpath, name)
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    files.append({
+                        "uri": "/" + os.path.relpath(path, folder).replace(
+                            os.sep, "/"),
+                        "size": len(data),
+                        "sha1": hashlib.sha1(data).hexdigest(),
+                        # the format of the artifactory, e.g.
+                        # 2019-01-01T10:00:00.000+0000
+                        "lastModified": datetime.datetime.fromtimestamp(
+                            os.path.getmtime(path),
+                            datetime.timezone.utc).strftime(
+                                "%Y-%m-%dT%H:%M:%S.000%z"),
+                    })
+            return self._send(200, json.dumps({"files": files}).encode())
+        if not os.path.isfile(self._file()):
+            return self._send(404)
+        with open(self._file(), "rb") as f:
+            self._send(200, f.read())
+
+    def do_PUT(self):
+        os.makedirs(os.path.dirname(self._file()), exist_ok=True)
+        with open(self._file(), "wb") as f:
+            f.write(self.rfile.read(int(self.headers["Content-Length"])))
+        self._send(201)
+
+    def do_DELETE(self):
+        path = self._file()
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.isfile(path):
+            os.remove(path)
+        else:
+            return self._send(404)
+        self._send(204)
+
+    def log_message(self, *args):
+        pass
+
+
+class RetentionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        StubHandler.root = self.root
+        self.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.artifactory = Artifactory("http://127.0.0.1:{}{}repo/".format(
+            self.server.server_port, PREFIX), ("user", "password"))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def put(self, path, data, age=7 * 86400):
+        path = os.path.join(self.root, "repo", path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+
+    def exists(self, path):
+        return os.path.exists(os.path.join(self.root, "repo", path))
+
+    def entry(self, path):
+        return {"file": os.path.basename(path), "path": path, "codec": None,
+                "size": 0}
+
+    def retention(self, targets):
+        helper = Retention(self.artifactory, Manifest(self.artifactory))
+        plan = helper.plan(targets)
+        return plan, helper.apply(plan)
+
+    def test_builds_missing_from_the_manifest_are_kept(self):
+        # the manifest only lists 1.2.8; 1.2.7 was uploaded before there
+        # were manifests, but is still built
+        self.put("bin/zlib/1.2.8/msvc14/zlib.dll", b"dll 1.2.8")
+        self.put("bin/zlib/1.2.7/msvc14/zlib.dll", b"dll 1.2.7")
+        self.put("bin/zlib/1.2.7/msvc14/zlib.idb", b"idb 1.2.7")
+        self.put("bin/zlib/1.2.6/msvc14/zlib.dll", b"dll 1.2.6")
+        self.put("bin/zlib/manifest.json", json.dumps({
+            "name": "zlib",
+            "versions": {"1.2.8": {"msvc14": [
+                self.entry("bin/zlib/1.2.8/msvc14/zlib.dll")]}},
+        }).encode())
+
+        plan, report = self.retention(set([
+            ("zlib", "1.2.8", "msvc14"), ("zlib", "1.2.7", "msvc14")]))
+
+        self.assertTrue(self.exists("bin/zlib/1.2.8/msvc14/zlib.dll"))
+        self.assertTrue(self.exists("bin/zlib/1.2.7/msvc14/zlib.dll"))
+        self.assertTrue(self.exists("bin/zlib/1.2.7/msvc14/zlib.idb"))
+        self.assertFalse(self.exists("bin/zlib/1.2.6"))
+        self.assertEqual(report[UNREFERENCED][0], 1)
+        self.assertEqual(report[SUPERSEDED][0], 0)
+
+    def test_superseded_uploads_are_removed(self):
+        self.put("bin/zlib/1.2.8/msvc14/zlib.pdb.gz", b"pdb gzip")
+        self.put("bin/zlib/1.2.8/msvc14/zlib.pdb.zst", b"pdb zstd")
+        self.put("bin/zlib/manifest.json", json.dumps({
+            "name": "zlib",
+            "versions": {"1.2.8": {"msvc14": [
+                self.entry("bin/zlib/1.2.8/msvc14/zlib.pdb.zst")]}},
+        }).encode())
+
+        plan, report = self.retention(set([("zlib", "1.2.8", "msvc14")]))
+
+        self.assertFalse(self.exists("bin/zlib/1.2.8/msvc14/zlib.pdb.gz"))
+        self.assertTrue(self.exists("bin/zlib/1.2.8/msvc14/zlib.pdb.zst"))
+        self.assertEqual(report[SUPERSEDED][0], 1)
+
+    def test_recent_uploads_are_kept(self):
+        # the upload of a running export whose manifest is not published
+        self.put("bin/zlib/1.2.6/msvc14/zlib.dll", b"dll 1.2.6", age=60)
+        self.put("bin/zlib/1.2.5/msvc14/zlib.dll", b"dll 1.2.5")
+
+        plan, report = self.retention(set())
+
+        self.assertTrue(self.exists("bin/zlib/1.2.6/msvc14/zlib.dll"))
+        self.assertFalse(self.exists("bin/zlib/1.2.5/msvc14/zlib.dll"))
+        self.assertEqual(report[UNREFERENCED][0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()